@@ -0,0 +1,208 @@
+"""
+Measures how disk and partition discovery scales with the number of block devices.
+
+Each benchmark is run against generated `/sys/block`, udev database and `/proc/self/mountinfo` trees (see
+`benchmarks.generators`) of every size, and its best time out of `--repeats` runs and its peak traced memory are
+compared with the stored baseline. Run from the repository root:
+
+    python -m benchmarks.discovery
+    python -m benchmarks.discovery --sizes 10 100 --update-baseline
+
+Timings depend on the machine, so the baseline should be re-recorded (with `--update-baseline`) on the machine the
+benchmarks are compared on.
+"""
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from truenas_installer.disks import DiskInventory, _disk_label, _read_block_device, _scan_disks, mounted_disks
+from truenas_installer.executor import host_path, use_executor
+from truenas_installer.simulation import SimulatedExecutor
+from truenas_installer.utils import get_partitions
+
+from .generators import generate_block_devices, generate_mountinfo
+
+__all__ = ["BENCHMARKS", "Measurement", "find_regressions", "run_benchmarks"]
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+# Number of `get_partitions` calls per measurement, so that the measurements of all sizes are comparable
+GET_PARTITIONS_CALLS = 50
+# Differences below these are noise, even if they exceed the relative tolerance
+MIN_TIME_REGRESSION = 0.005
+MIN_MEMORY_REGRESSION = 64 * 1024
+
+
+@dataclass
+class Measurement:
+    seconds: float
+    peak_bytes: int
+
+
+async def _scan_disks_benchmark(disks):
+    if len(scanned := await _scan_disks()) != len(disks):
+        raise RuntimeError(f"Scanned {len(scanned)} disks instead of {len(disks)}")
+
+
+async def _list_disks_benchmark(disks):
+    inventory = DiskInventory()
+    try:
+        await inventory.disks()
+    finally:
+        inventory.close()
+
+
+async def _disk_label_benchmark(disks):
+    devices = await asyncio.to_thread(lambda: [_read_block_device(disk.name) for disk in disks])
+    for device in devices:
+        _disk_label(device)
+
+
+async def _mounted_disks_benchmark(disks):
+    mounted_disks()
+
+
+async def _get_partitions_benchmark(disks):
+    partitioned = [disk for disk in disks if disk.partitions]
+    for i in range(GET_PARTITIONS_CALLS):
+        disk = partitioned[i % len(partitioned)]
+        await get_partitions(host_path(f"/dev/{disk.name}"), list(range(1, len(disk.partitions) + 1)))
+
+
+BENCHMARKS = {
+    "scan_disks": _scan_disks_benchmark,
+    "list_disks": _list_disks_benchmark,
+    "disk_label": _disk_label_benchmark,
+    "mounted_disks": _mounted_disks_benchmark,
+    "get_partitions": _get_partitions_benchmark,
+}
+
+
+def run_benchmarks(sizes: list[int], repeats: int, callback) -> dict[str, dict[str, Measurement]]:
+    """
+    Runs every benchmark against generated trees of every size in `sizes`. Returns the measurements by benchmark
+    name and size, `callback` is called with the benchmark name, size and measurement as soon as it is taken.
+    """
+    results = {name: {} for name in BENCHMARKS}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            executor = SimulatedExecutor(root)
+            disks = generate_block_devices(root, size)
+            os.makedirs(os.path.join(root, "proc/self"))
+            generate_mountinfo(os.path.join(root, "proc/self/mountinfo"), disks)
+
+            with use_executor(executor):
+                for name, benchmark in BENCHMARKS.items():
+                    results[name][str(size)] = measurement = asyncio.run(_measure(benchmark, disks, repeats))
+                    callback(name, size, measurement)
+
+    return results
+
+
+async def _measure(benchmark, disks, repeats):
+    # Warm up the page and dentry caches, so that the first repetition is not an outlier
+    await benchmark(disks)
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await benchmark(disks)
+        seconds.append(time.perf_counter() - start)
+
+    # Memory is traced in a separate run, tracing slows the benchmark down
+    tracemalloc.start()
+    try:
+        current = tracemalloc.get_traced_memory()[0]
+        await benchmark(disks)
+        peak_bytes = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(min(seconds), peak_bytes)
+
+
+def find_regressions(results: dict[str, dict[str, Measurement]], baseline: dict, time_tolerance: float,
+                     memory_tolerance: float) -> list[str]:
+    """
+    Compares `results` with `baseline` (as stored by `--update-baseline`). Returns a description of every measurement
+    that is worse than its baseline by more than the relative tolerance. Measurements without a baseline are skipped.
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, measurement in sizes.items():
+            if (expected := baseline.get(name, {}).get(size)) is None:
+                continue
+
+            if (
+                measurement.seconds > expected["seconds"] * (1 + time_tolerance) and
+                measurement.seconds - expected["seconds"] > MIN_TIME_REGRESSION
+            ):
+                regressions.append(f"{name} ({size} disks): took {measurement.seconds:.4f}s, baseline is "
+                                   f"{expected['seconds']:.4f}s")
+
+            if (
+                measurement.peak_bytes > expected["peak_bytes"] * (1 + memory_tolerance) and
+                measurement.peak_bytes - expected["peak_bytes"] > MIN_MEMORY_REGRESSION
+            ):
+                regressions.append(f"{name} ({size} disks): used {measurement.peak_bytes} bytes, baseline is "
+                                   f"{expected['peak_bytes']} bytes")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark disk and partition discovery scalability")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Numbers of disks to generate")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs of each benchmark")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the baseline instead of comparing them with it")
+    parser.add_argument("--time-tolerance", type=float, default=0.5,
+                        help="Allowed relative increase of the time a benchmark takes")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25,
+                        help="Allowed relative increase of the peak memory a benchmark uses")
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = run_benchmarks(
+        args.sizes,
+        args.repeats,
+        lambda name, size, measurement: print(
+            f"{name:<16}{size:>6} disks {measurement.seconds:>10.4f}s {measurement.peak_bytes / 1024:>10.0f} KiB"
+        ),
+    )
+
+    if args.update_baseline:
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update({size: asdict(measurement) for size, measurement in sizes.items()})
+
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if regressions := find_regressions(results, baseline, args.time_tolerance, args.memory_tolerance):
+        print("Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+        sys.exit(1)
+
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+import os
+import string
+
+__all__ = ["GeneratedDisk", "disk_names", "generate_block_devices", "generate_mountinfo"]
+
+# Partition counts cycled through by the generated disks; every `DEEP_EVERY`th disk gets a full GPT instead
+PARTITION_COUNTS = [0, 1, 2, 3, 4]
+DEEP_EVERY = 100
+DEEP_PARTITIONS = 128
+# Filesystems of the generated partitions, cycled through
+FILESYSTEMS = [("zfs_member", "boot-pool"), ("zfs_member", "tank"), ("ext4", "data"), ("xfs", "scratch"),
+               ("vfat", "EFI"), (None, None)]
+# One in `NVME_EVERY` disks is an NVMe disk, the others are SCSI disks
+NVME_EVERY = 8
+DISK_SIZE = 4 * 1000 ** 4
+# Kernel `dev_t` minor numbers are 20 bits wide
+MINORS_PER_MAJOR = 1 << 20
+
+
+@dataclass
+class GeneratedDisk:
+    name: str
+    partitions: list[str]
+
+
+def disk_names(count: int) -> list[str]:
+    """
+    Returns `count` disk names the way the kernel names them: `nvme<N>n1` for every `NVME_EVERY`th disk, and
+    `sda`..`sdz`, `sdaa`..`sdzz`, `sdaaa`... for the others.
+    """
+    names = []
+    scsi = 0
+    for i in range(count):
+        if i % NVME_EVERY == 0:
+            names.append(f"nvme{i // NVME_EVERY}n1")
+        else:
+            names.append(f"sd{_scsi_suffix(scsi)}")
+            scsi += 1
+
+    return names
+
+
+def generate_block_devices(root: str, count: int) -> list[GeneratedDisk]:
+    """
+    Creates the `/dev` nodes, `/sys/block` and `/sys/class/block` trees and udev database entries of `count` disks
+    (and their partitions) in `root`, the way `truenas_installer.disks` reads them.
+    """
+    for path in ["dev", "sys/block", "sys/class/block", "run/udev/data"]:
+        os.makedirs(os.path.join(root, path), exist_ok=True)
+
+    disks = []
+    minor = 0
+    for i, name in enumerate(disk_names(count)):
+        partitions = PARTITION_COUNTS[i % len(PARTITION_COUNTS)]
+        if i % DEEP_EVERY == DEEP_EVERY - 1:
+            partitions = DEEP_PARTITIONS
+
+        sysfs = os.path.join(root, "sys/block", name)
+        os.makedirs(os.path.join(sysfs, "queue"))
+        os.makedirs(os.path.join(sysfs, "device"))
+        _write_device(root, sysfs, name, minor, [
+            ("size", DISK_SIZE // 512),
+            ("removable", 0),
+            ("queue/rotational", int(not name.startswith("nvme"))),
+            ("queue/logical_block_size", 512),
+            ("queue/physical_block_size", 4096),
+            ("device/model", "Generated Disk"),
+            ("device/serial", f"GEN{i:06d}"),
+        ], {"ID_MODEL_ENC": "Generated\\x20Disk", "ID_SERIAL_SHORT": f"GEN{i:06d}"})
+        minor += 1
+
+        partition_names = []
+        for number in range(1, partitions + 1):
+            partition = f"{name}p{number}" if name.startswith("nvme") else f"{name}{number}"
+            os.makedirs(partition_sysfs := os.path.join(sysfs, partition))
+            fstype, label = FILESYSTEMS[(i + number) % len(FILESYSTEMS)]
+            _write_device(root, partition_sysfs, partition, minor, [
+                ("partition", number),
+                ("size", DISK_SIZE // 512 // DEEP_PARTITIONS),
+            ], {"ID_FS_TYPE": fstype, "ID_FS_LABEL_ENC": label} if fstype is not None else {})
+            minor += 1
+            partition_names.append(partition)
+
+        disks.append(GeneratedDisk(name, partition_names))
+
+    return disks
+
+
+def generate_mountinfo(path: str, disks: list[GeneratedDisk], mounted_every: int = 10, pseudo_mounts: int = 200):
+    """
+    Writes a `/proc/self/mountinfo` to `path` that mounts the first partition of every `mounted_every`th disk of
+    `disks` that has partitions, together with `pseudo_mounts` filesystems that are not backed by a block device.
+    """
+    lines = [
+        "1 0 0:1 / / rw,relatime - zfs boot-pool/ROOT/default rw,xattr,noacl",
+        "2 1 0:5 / /dev rw,nosuid,relatime - devtmpfs udev rw,size=8000000k,nr_inodes=2000000,mode=755",
+        "3 1 0:20 / /proc rw,nosuid,nodev,noexec,relatime - proc proc rw",
+        "4 1 0:21 / /sys rw,nosuid,nodev,noexec,relatime - sysfs sysfs rw",
+    ]
+    for i in range(pseudo_mounts):
+        lines.append(f"{len(lines) + 1} 4 0:{30 + i} / /sys/fs/cgroup/slice{i} rw,nosuid,nodev,noexec,relatime "
+                     "shared:9 - cgroup2 cgroup2 rw")
+
+    # Counted among the partitioned disks only: `mounted_every` and `PARTITION_COUNTS` share a factor, so every
+    # `mounted_every`th disk of `disks` would be one without partitions
+    for i, disk in enumerate(disk for disk in disks if disk.partitions):
+        if i % mounted_every == 0:
+            lines.append(f"{len(lines) + 1} 1 8:{i} / /mnt/{disk.name} rw,relatime - ext4 /dev/{disk.partitions[0]} "
+                         "rw")
+
+    with open(path, "w") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def _write_device(root, sysfs, name, minor, attributes, udev_properties):
+    major = 259 + minor // MINORS_PER_MAJOR
+    for attribute, value in attributes + [("dev", f"{major}:{minor % MINORS_PER_MAJOR}")]:
+        with open(os.path.join(sysfs, attribute), "w") as f:
+            f.write(f"{value}\n")
+
+    with open(os.path.join(root, f"run/udev/data/b{major}:{minor % MINORS_PER_MAJOR}"), "w") as f:
+        f.write("".join(f"E:{key}={value}\n" for key, value in udev_properties.items()))
+
+    class_block = os.path.join(root, "sys/class/block")
+    os.symlink(os.path.relpath(sysfs, class_block), os.path.join(class_block, name))
+    with open(os.path.join(root, "dev", name), "wb"):
+        pass
+
+
+def _scsi_suffix(index):
+    # `sd` suffixes are bijective base-26 numbers: a..z, aa..zz, aaa...
+    suffix = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        suffix = string.ascii_lowercase[remainder] + suffix
+
+    return suffix
@@ -0,0 +1,98 @@
+import pytest
+
+from truenas_installer.disk_query import query_disks
+from truenas_installer.disks import Disk
+
+
+def disk(name, size, transport, rotational=False, enclosure_slot=None):
+    return Disk(name, size, "Model", "", [], False, transport, rotational, enclosure_slot=enclosure_slot)
+
+
+DISKS = [
+    disk("nvme0n1", 500_000_000_000, "nvme"),
+    disk("nvme1n1", 1_000_000_000_000, "nvme"),
+    disk("sda", 240_000_000_000, "sata"),
+    disk("sdb", 16_000_000_000_000, "sas", True, "Slot 01"),
+    disk("sdc", 16_000_000_000_000, "sas", True, "Slot 02"),
+    disk("sdd", 18_000_000_000_000, "sas", True, "Slot 03"),
+]
+
+
+def names(disks):
+    return [disk.name for disk in disks]
+
+
+def test__filters():
+    disks, next_cursor, total = query_disks(DISKS, [["rotational", "=", False], ["size", "<", 800_000_000_000]])
+
+    assert names(disks) == ["nvme0n1", "sda"]
+    assert next_cursor is None
+    assert total == 2
+
+
+@pytest.mark.parametrize("filters,expected", [
+    ([["name", "~", "^nvme"]], ["nvme0n1", "nvme1n1"]),
+    ([["transport", "in", ["sata", "nvme"]]], ["nvme0n1", "nvme1n1", "sda"]),
+    ([["transport", "nin", ["sata", "nvme"]]], ["sdb", "sdc", "sdd"]),
+    ([["enclosure_slot", ">=", "Slot 02"]], ["sdc", "sdd"]),
+    ([["enclosure_slot", "!=", None]], ["sdb", "sdc", "sdd"]),
+])
+def test__filter_operators(filters, expected):
+    assert names(query_disks(DISKS, filters)[0]) == expected
+
+
+def test__order_by():
+    disks, next_cursor, total = query_disks(DISKS, order_by=["rotational", "-size"])
+
+    assert names(disks) == ["nvme1n1", "nvme0n1", "sda", "sdd", "sdb", "sdc"]
+
+
+def test__missing_values_sort_last():
+    assert names(query_disks(DISKS, order_by=["-enclosure_slot"])[0]) == [
+        "sdd", "sdc", "sdb", "nvme0n1", "nvme1n1", "sda",
+    ]
+
+
+def test__pagination():
+    pages = []
+    cursor = None
+    while True:
+        disks, cursor, total = query_disks(DISKS, order_by=["-size"], limit=4, cursor=cursor)
+        pages.append(names(disks))
+        assert total == 6
+        if cursor is None:
+            break
+
+    assert pages == [["sdd", "sdb", "sdc", "nvme1n1"], ["nvme0n1", "sda"]]
+
+
+def test__pagination_is_stable_when_disks_change():
+    disks, cursor, total = query_disks(DISKS, limit=2)
+    assert names(disks) == ["nvme0n1", "nvme1n1"]
+
+    # A disk that sorts before the cursor was removed and one after the cursor was added
+    changed = DISKS[1:] + [disk("nvme2n1", 500_000_000_000, "nvme")]
+    assert names(query_disks(changed, limit=2, cursor=cursor)[0]) == ["nvme2n1", "sda"]
+
+
+@pytest.mark.parametrize("kwargs,error", [
+    ({"filters": [["device", "=", "x"]]}, "Invalid field 'device'"),
+    ({"filters": [["name", "like", "x"]]}, "Invalid filter operator 'like'"),
+    ({"filters": [["size", ">", "big"]]}, "Invalid filter value"),
+    ({"order_by": ["-vendor"]}, "Invalid field 'vendor'"),
+    ({"cursor": "garbage"}, "Invalid cursor"),
+])
+def test__invalid_query(kwargs, error):
+    with pytest.raises(ValueError) as ve:
+        query_disks(DISKS, **kwargs)
+
+    assert str(ve.value).startswith(error)
+
+
+def test__cursor_for_different_order():
+    cursor = query_disks(DISKS, order_by=["size"], limit=1)[1]
+
+    with pytest.raises(ValueError) as ve:
+        query_disks(DISKS, order_by=["-size"], cursor=cursor)
+
+    assert str(ve.value) == "Cursor was returned for a different `order_by`"
@@ -0,0 +1,188 @@
+import os
+
+import pytest
+
+from truenas_installer import disks as disks_module
+from truenas_installer.disks import Disk, DiskInventory, ZFSMember, _scan_disks, mounted_disks
+from truenas_installer.executor import use_executor
+from truenas_installer.simulation import DEFAULT_RESPONSES, Response, SimulatedExecutor
+from truenas_installer.uevent import Uevent
+
+
+class FakeListener:
+    def __init__(self):
+        self.events = []
+
+    def receive_queued(self):
+        events, self.events = self.events, []
+        return events
+
+
+def block_event(action, devpath, devtype):
+    return Uevent(action, devpath, {"SUBSYSTEM": "block", "DEVTYPE": devtype})
+
+
+class FakeScanner:
+    def __init__(self):
+        self.present = {"vdx": 10_000_000_000, "vdy": 20_000_000_000}
+        self.scans = []
+
+    async def __call__(self, names=None, callback=None):
+        self.scans.append(names)
+        disks = {name: Disk(name, size, "Model", "", [], False) for name, size in self.present.items()
+                 if names is None or name in names}
+        for disk in disks.values():
+            if callback is not None:
+                callback(disk)
+
+        return disks
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    scanner = FakeScanner()
+    monkeypatch.setattr(disks_module, "_scan_disks", scanner)
+    monkeypatch.setattr(disks_module, "mounted_disks", set)
+    return scanner
+
+
+@pytest.mark.asyncio
+async def test__inventory_is_cached(scanner):
+    inventory = DiskInventory()
+    inventory.listener = FakeListener()
+
+    assert [disk.name for disk in await inventory.disks()] == ["vdx", "vdy"]
+    assert [disk.name for disk in await inventory.disks()] == ["vdx", "vdy"]
+    assert scanner.scans == [None]
+    assert inventory.generation == 0
+
+
+@pytest.mark.asyncio
+async def test__inventory_refreshes_changed_disks(scanner):
+    inventory = DiskInventory()
+    inventory.listener = FakeListener()
+    await inventory.disks()
+
+    inventory.listener.events = [
+        block_event("change", "/devices/pci0000:00/virtio1/block/vdx/vdx3", "partition"),
+        block_event("change", "/devices/pci0000:00/virtio1/block/vdx", "disk"),
+        Uevent("add", "/devices/virtual/net/eth1", {"SUBSYSTEM": "net"}),
+    ]
+    await inventory.disks()
+
+    assert scanner.scans == [None, {"vdx"}]
+    assert inventory.generation == 2
+
+    del scanner.present["vdy"]
+    inventory.listener.events = [block_event("remove", "/devices/pci0000:00/virtio2/block/vdy", "disk")]
+
+    assert [disk.name for disk in await inventory.disks()] == ["vdx"]
+    assert scanner.scans == [None, {"vdx"}, {"vdy"}]
+
+
+@pytest.mark.asyncio
+async def test__inventory_rescans_when_events_are_dropped(scanner):
+    inventory = DiskInventory()
+    inventory.listener = FakeListener()
+    await inventory.disks()
+
+    inventory.listener.receive_queued = lambda: None
+    await inventory.disks()
+
+    assert scanner.scans == [None, None]
+
+
+@pytest.mark.asyncio
+async def test__inventory_reports_disks(scanner, monkeypatch):
+    monkeypatch.setattr(disks_module, "mounted_disks", lambda: {"vdz"})
+    scanner.present["vdz"] = 30_000_000_000
+    inventory = DiskInventory()
+    inventory.listener = FakeListener()
+
+    reported = []
+    await inventory.disks(lambda disk: reported.append(disk.name))
+    assert reported == ["vdx", "vdy"]
+
+    inventory.listener.events = [block_event("change", "/devices/pci0000:00/virtio1/block/vdx", "disk")]
+    reported = []
+    await inventory.disks(lambda disk: reported.append(disk.name))
+    # Cached disks are reported before the changed ones are re-scanned
+    assert reported == ["vdy", "vdx"]
+
+
+@pytest.mark.asyncio
+async def test__scan_disks(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path), [
+        Response(r"^blkid -p -o export .+/sdc1$", stdout="TYPE=ext4\nLABEL=data\n"),
+        Response(r"^blkid ", 2),
+    ] + DEFAULT_RESPONSES)
+    disks = [
+        executor.add_disk("nvme0n1", 16 * 1024 ** 3, "Samsung SSD 980",
+                          [ZFSMember("nvme0n1p1", "boot-pool"), ZFSMember("nvme0n1p2", "tank")]),
+        executor.add_disk("sda", 32 * 1024 ** 3),
+        executor.add_disk("sdd", 32 * 1024 ** 3, zfs_members=[
+            ZFSMember("sdd3", "boot-pool", "5764350912338712816", 1234, 0x12345678, "exported"),
+        ]),
+    ]
+    executor.add_disk("sdb", 1024 ** 3)
+    executor.add_disk("loop0", 32 * 1024 ** 3)
+    executor.add_disk("sdc", 32 * 1024 ** 3)
+    # A partition udev has not processed yet
+    os.makedirs(tmp_path / "sys/block/sdc/sdc1")
+    (tmp_path / "sys/block/sdc/sdc1/partition").write_text("1\n")
+
+    reported = []
+    with use_executor(executor):
+        scanned = await _scan_disks(callback=lambda disk: reported.append(disk))
+
+    assert sorted(scanned) == ["nvme0n1", "sda", "sdc", "sdd"]
+    assert sorted(reported, key=lambda disk: disk.name) == [scanned[name] for name in sorted(scanned)]
+    assert scanned["nvme0n1"] == disks[0]
+    assert scanned["nvme0n1"].label == 'zfs-"boot-pool", zfs-"tank"'
+    assert scanned["sda"] == disks[1]
+    assert scanned["sdc"].label == "ext4-data"
+    assert scanned["sdd"] == disks[2]
+    assert scanned["sdd"].zfs_members[0].pool_guid == "5764350912338712816"
+    assert [command for command in executor.commands if command.startswith("blkid")] == [
+        f"blkid -p -o export {tmp_path}/dev/sdc1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test__scan_disks_details(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    added = executor.add_disk("sda", 32 * 1024 ** 3, rotational=True)
+    (tmp_path / "sys/block/sda/device/wwid").write_text("naa.5000c500a1b2c3d4\n")
+    (tmp_path / "sys/block/sda/device/enclosure_device:Slot 07").mkdir()
+
+    with use_executor(executor):
+        disk = (await _scan_disks())["sda"]
+
+    assert disk.rotational
+    assert disk.serial == added.serial
+    assert disk.wwn == "naa.5000c500a1b2c3d4"
+    assert disk.nvme_namespace is None
+    assert disk.enclosure_slot == "Slot 07"
+    assert (disk.logical_block_size, disk.physical_block_size) == (512, 4096)
+
+
+def test__mounted_disks(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    root = tmp_path
+    (root / "proc/self").mkdir(parents=True)
+    (root / "proc/self/mountinfo").write_text(
+        "22 1 0:21 / /proc rw,nosuid shared:12 - proc proc rw\n"
+        "36 35 98:0 / /mnt rw,noatime shared:1 - ext4 /dev/disk/by-label/data rw\n"
+        "37 35 0:40 / /mnt/tank rw shared:2 - zfs tank rw\n"
+    )
+    (root / "dev/disk/by-label").mkdir(parents=True)
+    (root / "dev/disk/by-label/data").symlink_to("../../sdb2")
+    (root / "sys/class/block").mkdir(parents=True)
+    for disk, partition in [("sda", None), ("sdb", "sdb2")]:
+        (root / "sys/block" / disk / (partition or "")).mkdir(parents=True, exist_ok=True)
+        if partition is not None:
+            (root / "sys/block" / disk / partition / "partition").write_text("2\n")
+            (root / "sys/class/block" / partition).symlink_to(f"../../block/{disk}/{partition}")
+
+    with use_executor(executor):
+        assert mounted_disks() == {"sdb"}
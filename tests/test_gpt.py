@@ -0,0 +1,94 @@
+import os
+import shutil
+import subprocess
+import zlib
+
+import pytest
+
+from truenas_installer.gpt import (
+    BIOS_BOOT_GUID, EFI_SYSTEM_GUID, LEGACY_BIOS_BOOTABLE, ZFS_GUID, read_partition_table, write_boot_partition_table,
+)
+
+SIZE = 2 * 1024 ** 3
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "disk.img"
+    with open(path, "wb") as f:
+        f.truncate(SIZE)
+
+    return str(path)
+
+
+def test__write_boot_partition_table(image):
+    written = write_boot_partition_table(image, False)
+    table = read_partition_table(image)
+
+    assert table == written
+    assert [(p.number, p.type_guid, p.first_lba, p.last_lba, p.attributes) for p in table.partitions] == [
+        (1, BIOS_BOOT_GUID, 4096, 6143, LEGACY_BIOS_BOOTABLE),
+        (2, EFI_SYSTEM_GUID, 6144, 1054719, 0),
+        (3, ZFS_GUID, 1054720, SIZE // 512 - 34, 0),
+    ]
+    assert not table.pmbr_boot
+
+
+def test__write_boot_partition_table__pmbr_boot(image):
+    write_boot_partition_table(image, True)
+
+    with open(image, "rb") as f:
+        mbr = f.read(512)
+
+    assert mbr[446] == 0x80
+    assert mbr[450] == 0xEE
+    assert mbr[510:512] == b"\x55\xaa"
+    assert read_partition_table(image).pmbr_boot
+
+
+def test__backup_header(image):
+    written = write_boot_partition_table(image, False)
+
+    # Corrupt the primary header, the backup one should be used
+    with open(image, "r+b") as f:
+        f.seek(512)
+        f.write(b"\0" * 512)
+
+    assert read_partition_table(image).partitions == written.partitions
+
+
+def test__entries_crc(image):
+    write_boot_partition_table(image, False)
+
+    with open(image, "rb") as f:
+        f.seek(512)
+        header = f.read(92)
+        entries = f.read(128 * 128 + 420)[420:]
+
+    assert int.from_bytes(header[88:92], "little") == zlib.crc32(entries)
+
+
+def test__image_too_small(tmp_path):
+    path = tmp_path / "disk.img"
+    with open(path, "wb") as f:
+        f.truncate(256 * 1024 ** 2)
+
+    with pytest.raises(ValueError):
+        write_boot_partition_table(str(path), False)
+
+
+@pytest.mark.skipif(os.geteuid() != 0 or shutil.which("losetup") is None, reason="Requires root and losetup")
+def test__loop_device(image):
+    try:
+        device = subprocess.run(["losetup", "-fP", "--show", image], capture_output=True, check=True,
+                                text=True).stdout.strip()
+    except subprocess.CalledProcessError:
+        pytest.skip("Unable to set up a loop device")
+
+    try:
+        written = write_boot_partition_table(device, False)
+
+        assert read_partition_table(device) == written
+        assert read_partition_table(image) == written
+    finally:
+        subprocess.run(["losetup", "-d", device])
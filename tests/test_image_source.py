@@ -0,0 +1,155 @@
+import os
+
+from aiohttp import web
+import pytest
+import pytest_asyncio
+
+from truenas_installer.executor import host_path, use_executor
+from truenas_installer.image_source import HTTPImageSource
+from truenas_installer.simulation import SimulatedExecutor
+from truenas_installer.staging import STAGING_PATH
+from truenas_installer.verify import ImageVerificationError, generate_manifest
+
+CHUNK_SIZE = 64 * 1024
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "TrueNAS.update"
+    path.write_bytes(os.urandom(CHUNK_SIZE * 10 + 1234))
+    return path
+
+
+@pytest_asyncio.fixture
+async def server(image):
+    requests = []
+    corrupt = set()
+    state = {"manifest": generate_manifest(str(image), CHUNK_SIZE)}
+    app = web.Application()
+
+    async def handle_image(request):
+        requests.append(request.headers.get("Range"))
+        if (range_ := request.headers.get("Range")) in corrupt:
+            corrupt.remove(range_)
+            start, end = map(int, range_.removeprefix("bytes=").split("-"))
+            return web.Response(status=206, body=b"\0" * (end - start + 1), headers={
+                "Content-Range": f"bytes {start}-{end}/{image.stat().st_size}",
+            })
+
+        return web.FileResponse(image)
+
+    async def handle_manifest(request):
+        if state["manifest"] is None:
+            raise web.HTTPNotFound()
+
+        return web.json_response(state["manifest"])
+
+    async def handle_chunked(request):
+        response = web.StreamResponse()
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        if request.method != "HEAD":
+            await response.write(image.read_bytes())
+
+        await response.write_eof()
+        return response
+
+    async def handle_ranges_ignored(request):
+        requests.append(request.headers.get("Range"))
+        return web.Response(body=image.read_bytes(), headers={"Accept-Ranges": "bytes"})
+
+    app.router.add_get("/TrueNAS.update", handle_image)
+    app.router.add_get("/ranges-ignored/TrueNAS.update", handle_ranges_ignored)
+    app.router.add_get("/ranges-ignored/TrueNAS.update.manifest.json", handle_manifest)
+    app.router.add_get("/chunked/TrueNAS.update", handle_chunked)
+    app.router.add_get("/TrueNAS.update.manifest.json", handle_manifest)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    state.update(url=f"http://127.0.0.1:{port}/TrueNAS.update", requests=requests, corrupt=corrupt)
+    yield state
+
+    await runner.cleanup()
+
+
+@pytest.fixture
+def executor(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path / "root"))
+    os.makedirs(tmp_path / "root" / "dev" / "shm")
+    with use_executor(executor):
+        yield executor
+
+
+@pytest.mark.asyncio
+async def test__download(server, image, executor):
+    source = HTTPImageSource(server["url"])
+    progress = []
+
+    path = await source.image_path(lambda p, message: progress.append(p))
+
+    assert open(path, "rb").read() == image.read_bytes()
+    assert len([range_ for range_ in server["requests"] if range_ is not None]) == 11
+    assert progress[-1] == 1
+    # The image is only downloaded once
+    assert await source.image_path() == path
+    assert len(server["requests"]) == 12
+    # Not where the image stager copies the image on the installation media to
+    assert path != host_path(STAGING_PATH)
+
+
+@pytest.mark.asyncio
+async def test__download_without_manifest(server, image, executor):
+    server["manifest"] = None
+
+    path = await HTTPImageSource(server["url"]).image_path()
+
+    assert open(path, "rb").read() == image.read_bytes()
+    assert len(server["requests"]) == 2
+
+
+@pytest.mark.asyncio
+async def test__corrupt_chunk_is_downloaded_again(server, image, executor):
+    range_ = f"bytes={CHUNK_SIZE * 3}-{CHUNK_SIZE * 4 - 1}"
+    server["corrupt"].add(range_)
+
+    path = await HTTPImageSource(server["url"]).image_path()
+
+    assert open(path, "rb").read() == image.read_bytes()
+    assert server["requests"].count(range_) == 2
+
+
+@pytest.mark.asyncio
+async def test__corrupt_image(server, image, executor, tmp_path):
+    server["manifest"]["chunks"][5] = "0" * 64
+
+    with pytest.raises(ImageVerificationError) as ve:
+        await HTTPImageSource(server["url"]).image_path()
+
+    assert str(ve.value) == f"Corrupt chunk received at offset {CHUNK_SIZE * 5}"
+    assert server["requests"].count(f"bytes={CHUNK_SIZE * 5}-{CHUNK_SIZE * 6 - 1}") == 3
+    assert not (tmp_path / "root" / "dev" / "shm" / "TrueNAS.download.update").exists()
+
+
+@pytest.mark.asyncio
+async def test__download_without_content_length(server, executor):
+    url = server["url"].replace("/TrueNAS.update", "/chunked/TrueNAS.update")
+
+    with pytest.raises(OSError) as ve:
+        await HTTPImageSource(url).image_path()
+
+    assert str(ve.value) == f"Unable to download {url}: the server did not report the image size"
+
+
+@pytest.mark.asyncio
+async def test__download_ranges_ignored(server, image, executor):
+    url = server["url"].replace("/TrueNAS.update", "/ranges-ignored/TrueNAS.update")
+
+    path = await HTTPImageSource(url).image_path()
+
+    assert open(path, "rb").read() == image.read_bytes()
+    # The image is downloaded again in a single request once the server answers a range request with the whole image
+    assert server["requests"][-1] is None
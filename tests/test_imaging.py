@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from truenas_installer.executor import use_executor
+from truenas_installer.gpt import read_partition_table
+from truenas_installer.imaging import ImagingResult, imaging_install
+from truenas_installer.simulation import DEFAULT_RESPONSES, Response, SimulatedExecutor
+from truenas_installer.utils import get_partitions
+
+SIZE = 16 * 1024 ** 3
+
+
+async def run_imaging(executor, groups):
+    messages = []
+    with use_executor(executor):
+        results = await imaging_install(groups, False, None, None, "",
+                                        lambda name, progress, message: messages.append((name, message)))
+
+    return results, messages
+
+
+@pytest.mark.asyncio
+async def test__imaging_install(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb", "sdc"]]
+
+    results, messages = await run_imaging(executor, [[disks[0]], disks[1:]])
+
+    assert results == [ImagingResult("boot-pool-sda", ["sda"]), ImagingResult("boot-pool-sdb-sdc", ["sdb", "sdc"])]
+    assert ("boot-pool-sda", "Installation completed") in messages
+    assert ("boot-pool-sdb-sdc", "Installation completed") in messages
+    assert all(len(read_partition_table(str(tmp_path / "dev" / disk.name)).partitions) == 3 for disk in disks)
+
+    # The image is mounted only once
+    assert len([command for command in executor.commands if command.startswith("mount ")]) == 1
+    zpool_create = [command for command in executor.commands if command.startswith("zpool create")]
+    assert len(zpool_create) == 2
+    assert all(" -t boot-pool-sd" in command and " -R " in command for command in zpool_create)
+    assert all(command.split()[-1] != "boot-pool" for command in zpool_create)
+    assert {"zpool export -f boot-pool-sda", "zpool export -f boot-pool-sdb-sdc"} <= set(executor.commands)
+    assert sorted(installer.params["pool_name"] for installer in executor.installers) == [
+        "boot-pool-sda", "boot-pool-sdb-sdc",
+    ]
+    # The installed systems boot from the name the pools have on disk
+    assert all(installer.params["boot_pool_name"] == "boot-pool" for installer in executor.installers)
+    assert executor.commands[-1].startswith("umount -f ")
+
+
+@pytest.mark.asyncio
+async def test__imaging_install_target_failure(tmp_path):
+    executor = SimulatedExecutor(
+        str(tmp_path),
+        [Response(r"^zpool create .* boot-pool .*/sdb3$", 1, stderr="I/O error")] + DEFAULT_RESPONSES,
+    )
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb"]]
+
+    results, messages = await run_imaging(executor, [[disks[0]], [disks[1]]])
+
+    assert results[0].error is None
+    assert results[1].error.endswith("failed:\nI/O error")
+    assert "zpool export -f boot-pool-sda" in executor.commands
+    assert "zpool export -f boot-pool-sdb" not in executor.commands
+
+
+@pytest.mark.asyncio
+async def test__imaging_install_target_unexpected_error(tmp_path, monkeypatch):
+    async def failing_get_partitions(device, partitions):
+        if device.endswith("/sda"):
+            raise OSError("Unexpected")
+
+        # The other target is still installing when the first one fails
+        await asyncio.sleep(0.1)
+        return await get_partitions(device, partitions)
+
+    monkeypatch.setattr("truenas_installer.imaging.get_partitions", failing_get_partitions)
+    executor = SimulatedExecutor(str(tmp_path))
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb"]]
+
+    results, messages = await run_imaging(executor, [[disks[0]], [disks[1]]])
+
+    assert results[0].error == "OSError('Unexpected')"
+    assert results[1].error is None
+    # The image is only unmounted after the other target completed
+    assert executor.commands.index("zpool export -f boot-pool-sdb") < len(executor.commands) - 1
+    assert executor.commands[-1].startswith("umount -f ")
+
+
+@pytest.mark.asyncio
+async def test__imaging_install_unsupported_installer(tmp_path, monkeypatch):
+    monkeypatch.setattr("truenas_installer.imaging.installer_supports", lambda src, parameter: False)
+    executor = SimulatedExecutor(str(tmp_path))
+    disks = [executor.add_disk("sda", SIZE)]
+
+    results, messages = await run_imaging(executor, [disks])
+
+    assert results[0].error == "The installer on the installation media does not support imaging installations"
+    assert executor.installers == []
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) is None
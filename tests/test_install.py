@@ -0,0 +1,101 @@
+import asyncio
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer.disks import Disk, ZFSMember
+from truenas_installer.executor import use_executor
+from truenas_installer.install import add_disk_stages, conflicting_boot_pool_disks, discard_disk
+from truenas_installer.simulation import SimulatedExecutor
+from truenas_installer.stages import StageGraph
+
+
+def disk(name):
+    return Disk(name, 16_000_000_000, "Model", "", [], False)
+
+
+@pytest.mark.asyncio
+async def test__disk_stages__concurrent():
+    running = 0
+    max_running = 0
+    messages = []
+
+    async def operation(disk, *args, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    with patch("truenas_installer.install.format_disk", operation):
+        with patch("truenas_installer.install.wipe_disk", operation):
+            with patch("truenas_installer.install.MAX_CONCURRENT_DISKS", 3):
+                graph = StageGraph()
+                stages = add_disk_stages(
+                    graph,
+                    [disk("sda"), disk("sdb"), disk("sdc")],
+                    [disk("sdd"), disk("sde")],
+                    False,
+                    lambda progress, message: messages.append(message),
+                )
+                await graph.run()
+
+    assert stages == ["format sda", "format sdb", "format sdc", "wipe sdd", "wipe sde"]
+    assert max_running == 3
+    assert sorted(messages) == [
+        "Formatting disk sda",
+        "Formatting disk sdb",
+        "Formatting disk sdc",
+        "Wiping disk sdd",
+        "Wiping disk sde",
+    ]
+
+
+@pytest.mark.asyncio
+async def test__disk_stages__failure_cancels_other_disks():
+    cancelled = []
+
+    async def format_disk(disk, *args, **kwargs):
+        if disk.name == "sda":
+            raise subprocess.CalledProcessError(1, ["sgdisk"], "", "error")
+
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(disk.name)
+            raise
+
+    with patch("truenas_installer.install.format_disk", format_disk):
+        graph = StageGraph()
+        add_disk_stages(graph, [disk("sda"), disk("sdb")], [], False, lambda progress, message: None)
+        with pytest.raises(subprocess.CalledProcessError):
+            await graph.run()
+
+    assert cancelled == ["sdb"]
+
+
+def test__conflicting_boot_pool_disks():
+    disks = [
+        Disk("sda", 16_000_000_000, "Model", "", [ZFSMember("sda3", "boot-pool", "1", 10, None, "exported")], False),
+        Disk("sdb", 16_000_000_000, "Model", "", [ZFSMember("sdb3", "boot-pool", "2", 20, None, "active")], False),
+        Disk("sdc", 16_000_000_000, "Model", "", [ZFSMember("sdc3", "boot-pool", "3", 30, None, "destroyed")], False),
+        Disk("sdd", 16_000_000_000, "Model", "", [ZFSMember("sdd1", "tank")], False),
+        Disk("sde", 16_000_000_000, "Model", "", [ZFSMember("sde3", "boot-pool")], False),
+    ]
+
+    assert [disk.name for disk in conflicting_boot_pool_disks(disks, ["sda"])] == ["sdb", "sde"]
+
+
+@pytest.mark.asyncio
+async def test__discard_disk__unsupported_disk_is_not_zeroed(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    hdd = executor.add_disk("sda", 16 * 1024 ** 3, rotational=True)
+    messages = []
+
+    with use_executor(executor):
+        with patch("truenas_installer.install.discard_device") as discard_device:
+            await discard_disk(hdd, False, lambda progress, message: messages.append(message))
+
+    discard_device.assert_not_called()
+    assert messages == ["Disk sda does not support discard, only erasing its signatures"]
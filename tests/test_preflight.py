@@ -0,0 +1,153 @@
+import errno
+import time
+
+import pytest
+
+from truenas_installer import preflight
+from truenas_installer.disks import Disk
+from truenas_installer.exception import InstallError
+from truenas_installer.gpt import read_partition_table
+from truenas_installer.preflight import DATA_SAMPLES, EFI_SAMPLES, check_surface, surface_regions
+from truenas_installer.simulation import SimulatedExecutor, simulate_install
+
+SIZE = 16 * 1024 ** 3
+
+
+def test__surface_regions():
+    regions = surface_regions(512, SIZE)
+
+    assert len(regions) == 2 + EFI_SAMPLES + DATA_SAMPLES + 1
+    assert (regions[0].name, regions[0].offset, regions[0].length) == ("primary GPT", 0, 34 * 512)
+    assert regions[1].name == "BIOS boot partition"
+    assert regions[-1].name == "backup GPT"
+    assert regions[-1].offset + regions[-1].length == SIZE
+    assert all(region.offset % 512 == 0 and region.length % 512 == 0 for region in regions)
+    assert all(a.offset + a.length <= b.offset for a, b in zip(regions, regions[1:]))
+
+
+@pytest.fixture
+def disk(tmp_path):
+    with open(tmp_path / "sda", "wb") as f:
+        f.truncate(SIZE)
+
+    return Disk("sda", SIZE, "Model", "", [], False)
+
+
+@pytest.fixture
+def device(disk, tmp_path, monkeypatch):
+    monkeypatch.setattr(Disk, "device", property(lambda self: str(tmp_path / self.name)))
+    return str(tmp_path / disk.name)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("write", [False, True])
+async def test__check_surface(disk, device, write):
+    region = surface_regions(512, SIZE)[-2]
+    with open(device, "r+b") as f:
+        f.seek(region.offset)
+        f.write(b"existing data")
+
+    await check_surface(disk, write, lambda progress, message: None)
+
+    with open(device, "rb") as f:
+        f.seek(region.offset)
+        assert f.read(13) == b"existing data"
+
+
+@pytest.mark.asyncio
+async def test__check_surface__io_error(disk, device, monkeypatch):
+    read = preflight._read
+    calls = []
+
+    def failing_read(fd, buffer, offset):
+        calls.append(offset)
+        if len(calls) == 3:
+            raise OSError(errno.EIO, "Input/output error")
+
+        read(fd, buffer, offset)
+
+    monkeypatch.setattr(preflight, "_read", failing_read)
+
+    with pytest.raises(InstallError) as ve:
+        await check_surface(disk, False, lambda progress, message: None)
+
+    assert ve.value.message == (
+        f"Disk sda failed I/O at offset {calls[2]} (EFI system partition): Input/output error, it is likely failing"
+    )
+
+
+@pytest.mark.asyncio
+async def test__check_surface__timeout(disk, device, monkeypatch):
+    monkeypatch.setattr(preflight, "_read", lambda fd, buffer, offset: time.sleep(1))
+
+    start = time.monotonic()
+    with pytest.raises(InstallError) as ve:
+        await check_surface(disk, False, lambda progress, message: None, timeout=0.1)
+
+    assert time.monotonic() - start < 0.5
+    assert ve.value.message == (
+        "Disk sda did not complete I/O at offset 0 (primary GPT) within 0.1 seconds, it is likely failing"
+    )
+
+
+@pytest.mark.asyncio
+async def test__check_surface__timeout_restores_data(disk, device, monkeypatch):
+    with open(device, "r+b") as f:
+        f.write(b"existing data")
+
+    read = preflight._read
+    calls = []
+
+    def slow_read(fd, buffer, offset):
+        calls.append(offset)
+        if len(calls) == 2:
+            # Reading back the pattern written over the primary GPT
+            time.sleep(0.5)
+
+        read(fd, buffer, offset)
+
+    monkeypatch.setattr(preflight, "_read", slow_read)
+
+    with pytest.raises(InstallError):
+        await check_surface(disk, True, lambda progress, message: None, timeout=0.1)
+
+    with open(device, "rb") as f:
+        assert f.read(13) == b"existing data"
+
+
+@pytest.mark.asyncio
+async def test__failing_disk_is_not_formatted(tmp_path, monkeypatch):
+    executor = SimulatedExecutor(str(tmp_path))
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb"]]
+
+    def failing_read(fd, buffer, offset):
+        raise OSError(errno.EIO, "Input/output error")
+
+    monkeypatch.setattr(preflight, "_read", failing_read)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, disks, [])
+
+    assert ve.value.message.endswith("(primary GPT): Input/output error, it is likely failing")
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) is None
+    assert read_partition_table(str(tmp_path / "dev" / "sdb")) is None
+
+
+@pytest.mark.asyncio
+async def test__resumed_installation_is_not_checked(tmp_path, monkeypatch):
+    executor = SimulatedExecutor(str(tmp_path), installer_error="Post-install step failed")
+    disks = [executor.add_disk("sda", SIZE)]
+
+    with pytest.raises(InstallError):
+        await simulate_install(executor, disks, [], preflight="write")
+
+    def write(fd, buffer, offset):
+        raise AssertionError("The boot pool of the resumed installation was overwritten")
+
+    monkeypatch.setattr(preflight, "_write", write)
+    executor.installer_error = None
+    messages = []
+    await simulate_install(executor, disks, [], lambda progress, message: messages.append(message), resume=True,
+                           preflight="write")
+
+    assert "Checking disk sda" not in messages
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from truenas_installer.disks import Disk, ZFSMember
+from truenas_installer.executor import use_executor
+from truenas_installer.probe import probe_disk, recommend_boot_disks
+from truenas_installer.simulation import SimulatedExecutor
+
+SIZE = 16 * 1024 ** 3
+
+
+@pytest.fixture
+def executor(tmp_path):
+    return SimulatedExecutor(str(tmp_path))
+
+
+def test__probe_disk(executor):
+    disk = executor.add_disk("sda", SIZE)
+
+    with use_executor(executor):
+        probe = probe_disk(disk)
+
+    assert probe.error is None
+    assert probe.transport == "unknown"
+    assert not probe.rotational
+    assert 0 < probe.latency_p50_us <= probe.latency_p99_us
+    assert probe.throughput > 0
+
+
+def test__probe_tiny_disk(executor):
+    disk = executor.add_disk("sda", 512)
+
+    with use_executor(executor):
+        probe = probe_disk(disk)
+
+    assert probe.error == "Disk is smaller than 4096 bytes"
+    assert probe.latency_p50_us is None
+
+
+@pytest.mark.asyncio
+async def test__recommend_boot_disks(executor):
+    disks = [
+        executor.add_disk("sda", SIZE, rotational=True),
+        executor.add_disk("sdb", SIZE, zfs_members=[ZFSMember("sdb1", "tank")]),
+        executor.add_disk("sdc", SIZE, zfs_members=[ZFSMember("sdc3", "boot-pool")]),
+        Disk("sdd", SIZE, "Missing Disk", "", [], False),
+        executor.add_disk("vda", SIZE),
+    ]
+
+    with use_executor(executor):
+        probes = await recommend_boot_disks(disks)
+
+    assert {probe.name for probe in probes[:2]} == {"sdc", "vda"}
+    assert [probe.name for probe in probes[2:]] == ["sda", "sdb", "sdd"]
+    assert probes[2].rotational
+    assert probes[3].in_use
+    assert probes[4].error == "No such file or directory"
+    assert [probe.transport for probe in probes if probe.name == "vda"] == ["virtio"]
+
+
+@pytest.mark.asyncio
+async def test__recommend_boot_disks_timeout(executor, monkeypatch):
+    disks = [executor.add_disk("sda", SIZE), executor.add_disk("sdb", SIZE)]
+    release = threading.Event()
+
+    def probe_disk_(disk):
+        if disk.name == "sda":
+            # The disk never completes its I/O
+            release.wait()
+
+        return probe_disk(disk)
+
+    monkeypatch.setattr("truenas_installer.probe.probe_disk", probe_disk_)
+    try:
+        with use_executor(executor):
+            start = time.monotonic()
+            probes = await recommend_boot_disks(disks, 0.5)
+            elapsed = time.monotonic() - start
+    finally:
+        release.set()
+
+    assert elapsed < 5
+    assert [(probe.name, probe.error) for probe in probes] == [("sdb", None), ("sda", "timeout")]
@@ -0,0 +1,263 @@
+import json
+
+import pytest
+
+from truenas_installer.disks import ZFSMember
+from truenas_installer.exception import InstallError
+from truenas_installer.executor import use_executor
+from truenas_installer.gpt import read_partition_table, write_boot_partition_table
+from truenas_installer.journal import InstallJournal
+from truenas_installer.simulation import (FakeInstallerProcess, Response, SimulatedExecutor, DEFAULT_RESPONSES,
+                                          simulate_install, simulate_upgrade)
+from truenas_installer.trace import get_last_trace
+from truenas_installer.verify import generate_manifest
+
+SIZE = 16 * 1024 ** 3
+
+
+@pytest.fixture
+def executor(tmp_path):
+    return SimulatedExecutor(str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test__install(executor, tmp_path):
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb", "sdc"]]
+    messages = []
+
+    await simulate_install(executor, disks[:2], disks[2:], lambda progress, message: messages.append(message))
+
+    assert sorted(messages[:2]) == ["Checking disk sda", "Checking disk sdb"]
+    assert sorted(messages[2:5]) == ["Formatting disk sda", "Formatting disk sdb", "Wiping disk sdc"]
+    assert messages[5:] == [
+        "Creating boot pool",
+        "Copying files",
+        "Copying files",
+        "Configuring system",
+        "Installing bootloader",
+    ]
+
+    assert [len(read_partition_table(str(tmp_path / "dev" / name)).partitions) for name in ["sda", "sdb"]] == [3, 3]
+    assert read_partition_table(str(tmp_path / "dev" / "sdc")) is None
+
+    zpool_create = [command for command in executor.commands if command.startswith("zpool create")][0]
+    assert zpool_create.endswith(f"boot-pool mirror {tmp_path}/dev/sda3 {tmp_path}/dev/sdb3")
+    assert executor.commands[-1] == "zpool export -f boot-pool"
+    assert executor.installers[0].params["disks"] == ["sda", "sdb"]
+    assert executor.installers[0].params["pool_name"] == "boot-pool"
+
+    stages = {event["name"]: event for event in get_last_trace().to_chrome()["traceEvents"]
+              if event.get("cat") == "stage"}
+    assert set(stages) == {"hostid", "serial", "verify_image", "launch_installer", "preflight", "format sda",
+                           "format sdb", "wipe sdc", "find_partitions", "create_boot_pool", "run_installer",
+                           "export_pool"}
+    # Nothing is written before all the destination disks are checked
+    assert stages["preflight"]["ts"] + stages["preflight"]["dur"] <= stages["wipe sdc"]["ts"]
+    # truenas_install is launched while the disks are being formatted
+    assert stages["launch_installer"]["ts"] < stages["format sda"]["ts"] + stages["format sda"]["dur"]
+    assert stages["create_boot_pool"]["ts"] + stages["create_boot_pool"]["dur"] <= stages["run_installer"]["ts"]
+    # The trace is written into the simulated root
+    trace = json.loads((tmp_path / "tmp" / "truenas_installer_trace.json").read_text())
+    assert {event["name"] for event in trace["traceEvents"] if event.get("cat") == "stage"} == set(stages)
+
+    assert not (tmp_path / "run" / "truenas_installer.lock").exists()
+
+
+@pytest.mark.asyncio
+async def test__installer_error(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path), installer_error="Post-install step failed")
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [])
+
+    assert ve.value.message == "Post-install step failed"
+    assert executor.commands[-1] == "zpool export -f boot-pool"
+
+
+@pytest.mark.asyncio
+async def test__command_error(tmp_path):
+    executor = SimulatedExecutor(
+        str(tmp_path),
+        [Response(r"^zpool create ", 1, stderr="cannot create 'boot-pool': I/O error")] + DEFAULT_RESPONSES,
+    )
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [])
+
+    assert ve.value.message.endswith("failed:\ncannot create 'boot-pool': I/O error")
+
+
+@pytest.mark.asyncio
+async def test__corrupt_image(executor, tmp_path):
+    disk = executor.add_disk("sda", SIZE)
+    image = tmp_path / "cdrom" / "TrueNAS.update"
+    image.write_bytes(b"\0" * 4096)
+    manifest = generate_manifest(str(image), 1024)
+    image.write_bytes(b"\0" * 2048 + b"\1" + b"\0" * 2047)
+    (tmp_path / "cdrom" / "TrueNAS.update.manifest.json").write_text(json.dumps(manifest))
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [])
+
+    assert ve.value.message == "Installation image is corrupt: 1 corrupt chunk(s) found at offset(s) 2048"
+    assert not any(command.startswith("zpool create") for command in executor.commands)
+
+
+@pytest.mark.asyncio
+async def test__worker_is_stopped_on_failure(tmp_path):
+    executor = SimulatedExecutor(
+        str(tmp_path),
+        [Response(r"^zpool create ", 1, stderr="I/O error", delay=0.3)] + DEFAULT_RESPONSES,
+    )
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError):
+        await simulate_install(executor, [disk], [])
+
+    assert executor.installers[0].params is None
+    assert executor.installers[0].returncode == -9
+    assert executor.commands[-1].startswith("umount -f ")
+
+
+@pytest.mark.asyncio
+async def test__resume(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path), installer_error="Post-install step failed")
+    disks = [executor.add_disk(name, SIZE) for name in ["sda", "sdb"]]
+
+    with pytest.raises(InstallError):
+        await simulate_install(executor, disks, [])
+
+    with use_executor(executor):
+        journal = InstallJournal.load()
+
+    assert journal.resumable
+    assert journal.error == "Post-install step failed"
+    assert journal.pool_state == "exported"
+    assert set(journal.completed) == {"hostid", "verify_image", "format sda", "format sdb", "find_partitions",
+                                      "create_boot_pool"}
+
+    table = read_partition_table(str(tmp_path / "dev" / "sda"))
+    assert journal.partition_guids["sda"] == str(table.partitions[2].guid)
+
+    executor.installer_error = None
+    executor.commands.clear()
+    await simulate_install(executor, disks, [], resume=True)
+
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) == table
+    assert not any(command.startswith("zpool create") for command in executor.commands)
+    assert "zpool import -f -N 5764350912338712816" in executor.commands
+    assert "zfs destroy -r boot-pool/ROOT/25.10" in executor.commands
+    assert executor.installers[1].params["disks"] == ["sda", "sdb"]
+    assert executor.commands[-1] == "zpool export -f boot-pool"
+    assert not (tmp_path / "run" / "truenas_installer_journal.json").exists()
+
+
+@pytest.mark.asyncio
+async def test__resume_modified_disk(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path), installer_error="Post-install step failed")
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError):
+        await simulate_install(executor, [disk], [])
+
+    write_boot_partition_table(str(tmp_path / "dev" / "sda"), False, False)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [], resume=True)
+
+    assert ve.value.message == "Disk sda was modified after the failed installation, unable to resume it"
+
+
+@pytest.mark.asyncio
+async def test__nothing_to_resume(executor):
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [], resume=True)
+
+    assert ve.value.message == "There is no failed installation to resume"
+
+
+@pytest.mark.asyncio
+async def test__upgrade(executor, tmp_path):
+    disks = [executor.add_disk(name, SIZE, zfs_members=[ZFSMember(f"{name}3", "boot-pool")]) for name in ["sda", "sdb"]]
+
+    await simulate_upgrade(executor, disks, "25.10")
+
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) is None
+    assert not any(command.startswith(("zpool create", "zfs destroy")) for command in executor.commands)
+    assert f"zpool import -f -N -d {tmp_path}/dev/sda3 -d {tmp_path}/dev/sdb3 boot-pool" in executor.commands
+    assert "zfs create -o mountpoint=legacy -o canmount=noauto boot-pool/ROOT/25.10" in executor.commands
+    assert any(command.startswith("mount -t zfs -o ro boot-pool/ROOT/25.04 ") for command in executor.commands)
+    params = executor.installers[0].params
+    assert params["upgrade"] is True
+    assert params["dataset_name"] == "boot-pool/ROOT/25.10"
+    assert params["old_root"] is not None
+    assert executor.commands[-1] == "zpool export -f boot-pool"
+
+
+@pytest.mark.asyncio
+async def test__upgrade_error(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path), installer_error="Post-install step failed")
+    disk = executor.add_disk("sda", SIZE, zfs_members=[ZFSMember("sda3", "boot-pool")])
+
+    with pytest.raises(InstallError):
+        await simulate_upgrade(executor, [disk], "25.10")
+
+    assert executor.commands[-2:] == ["zfs destroy -r boot-pool/ROOT/25.10", "zpool export -f boot-pool"]
+
+
+@pytest.mark.asyncio
+async def test__upgrade_unsupported_installer(executor, monkeypatch):
+    monkeypatch.setattr("truenas_installer.install.installer_supports", lambda src, parameter: False)
+    disk = executor.add_disk("sda", SIZE, zfs_members=[ZFSMember("sda3", "boot-pool")])
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_upgrade(executor, [disk], "25.10")
+
+    assert ve.value.message == "The installer on the installation media does not support upgrades"
+    assert not any(command.startswith("zfs create") for command in executor.commands)
+
+
+@pytest.mark.asyncio
+async def test__installer_rejects_unknown_params():
+    process = FakeInstallerProcess([(0, 0.5, "Installing")])
+    process.stdin.write(json.dumps({
+        "authentication_method": None,
+        "disks": ["sda"],
+        "json": True,
+        "pool_name": "boot-pool",
+        "post_install": None,
+        "sql": None,
+        "src": "/mnt",
+        "preserve_datasets": True,
+    }).encode("utf-8"))
+    process.stdin.close()
+
+    assert await process.wait() == 1
+    assert "preserve_datasets" in json.loads(await process.stdout.readline())["error"]
+
+
+@pytest.mark.asyncio
+async def test__upgrade_without_boot_pool(executor):
+    disk = executor.add_disk("sda", SIZE, zfs_members=[ZFSMember("sda1", "tank")])
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_upgrade(executor, [disk], "25.10")
+
+    assert ve.value.message == "Disk sda does not contain a boot-pool"
+    assert executor.commands == []
+
+
+@pytest.mark.asyncio
+async def test__upgrade_different_boot_pools(executor):
+    disks = [executor.add_disk(name, SIZE, zfs_members=[ZFSMember(f"{name}3", "boot-pool", guid, 100)])
+             for name, guid in [("sda", "5764350912338712816"), ("sdb", "13461730478839121337")]]
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_upgrade(executor, disks, "25.10")
+
+    assert ve.value.message == "Disks sda, sdb contain different boot-pools"
+    assert executor.commands == []
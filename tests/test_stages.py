@@ -0,0 +1,105 @@
+import asyncio
+import functools
+
+import pytest
+
+from truenas_installer.stages import StageGraph
+
+
+@pytest.mark.asyncio
+async def test__run():
+    graph = StageGraph()
+    log = []
+
+    def stage(name, delay, result=None):
+        async def fn():
+            log.append(f"start {name}")
+            await asyncio.sleep(delay)
+            log.append(f"end {name}")
+            return result
+
+        return fn
+
+    graph.add("a", stage("a", 0.02, 1))
+    graph.add("b", stage("b", 0.01, 2))
+    graph.add("c", stage("c", 0, 3), ["a", "b"])
+    graph.add("d", stage("d", 0), ["b"])
+
+    await graph.run()
+
+    assert log == ["start a", "start b", "end b", "start d", "end d", "end a", "start c", "end c"]
+    assert graph.results == {"a": 1, "b": 2, "c": 3, "d": None}
+    assert graph.completed == ["b", "d", "a", "c"]
+
+
+@pytest.mark.asyncio
+async def test__failure():
+    graph = StageGraph()
+    cancelled = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("error")
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def dependent():
+        cancelled.append("dependent has run")
+
+    graph.add("fail", fail)
+    graph.add("slow", slow)
+    graph.add("dependent", dependent, ["fail"])
+
+    with pytest.raises(ValueError):
+        await graph.run()
+
+    assert cancelled == ["slow"]
+    assert graph.completed == []
+
+
+@pytest.mark.asyncio
+async def test__unknown_stage():
+    graph = StageGraph()
+    graph.add("a", asyncio.sleep, ["b"])
+
+    with pytest.raises(ValueError) as ve:
+        await graph.run()
+
+    assert str(ve.value) == "Stage 'a' requires unknown stage 'b'"
+
+
+@pytest.mark.asyncio
+async def test__cycle():
+    graph = StageGraph()
+    graph.add("a", asyncio.sleep, ["c"])
+    graph.add("b", asyncio.sleep, ["a"])
+    graph.add("c", asyncio.sleep, ["b"])
+
+    with pytest.raises(ValueError) as ve:
+        await graph.run()
+
+    assert str(ve.value) == "Stage dependency cycle: a -> c -> b -> a"
+
+
+@pytest.mark.asyncio
+async def test__restore():
+    completed = []
+    graph = StageGraph(lambda name, result: completed.append((name, result)))
+
+    async def fail():
+        raise ValueError("error")
+
+    graph.add("a", fail)
+    graph.add("b", functools.partial(asyncio.sleep, 0), ["a"])
+    graph.restore("a", 1)
+
+    await graph.run()
+
+    assert graph.results == {"a": 1, "b": None}
+    assert graph.completed == ["a", "b"]
+    assert completed == [("b", None)]
@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer.staging import ImageStager
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "TrueNAS.update"
+    path.write_bytes(b"squashfs" * 1024 * 1024)
+    return path
+
+
+@pytest.mark.asyncio
+async def test__copy(image, tmp_path):
+    stager = ImageStager(str(image), str(tmp_path / "staged"))
+
+    with patch("truenas_installer.staging._memory_available", lambda: 10 * 1024 ** 3):
+        stager.start()
+        assert await stager.image_path() == str(tmp_path / "staged")
+
+    assert stager.status() == {"state": "staged", "staged_bytes": 8 * 1024 ** 2, "total_bytes": 8 * 1024 ** 2,
+                               "error": None}
+    assert (tmp_path / "staged").read_bytes() == image.read_bytes()
+
+
+@pytest.mark.asyncio
+async def test__read_into_page_cache(image, tmp_path):
+    stager = ImageStager(str(image), str(tmp_path / "staged"))
+
+    with patch("truenas_installer.staging._memory_available", lambda: 1024 ** 3):
+        stager.start()
+        await stager.task
+        assert await stager.image_path() == str(image)
+
+    assert stager.status()["state"] == "cached"
+    assert stager.status()["staged_bytes"] == 8 * 1024 ** 2
+    assert not (tmp_path / "staged").exists()
+
+
+@pytest.mark.asyncio
+async def test__missing_image(tmp_path):
+    stager = ImageStager(str(tmp_path / "missing"), str(tmp_path / "staged"))
+
+    stager.start()
+
+    assert await stager.image_path() == str(tmp_path / "missing")
+    assert stager.status()["state"] == "failed"
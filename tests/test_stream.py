@@ -0,0 +1,130 @@
+import gzip
+import shutil
+import subprocess
+import uuid
+
+import pytest
+
+from truenas_installer.exception import InstallError
+from truenas_installer.executor import Executor, use_executor
+from truenas_installer.gpt import read_partition_table
+from truenas_installer.install import receive_stream
+from truenas_installer.simulation import DMU_BACKUP_MAGIC, STREAM_HEADER, SimulatedExecutor, simulate_install
+
+SIZE = 16 * 1024 ** 3
+
+
+def stream(snapshot="build/ROOT/25.10@install", size=8 * 1024 ** 2):
+    header = STREAM_HEADER.pack(0, 0, DMU_BACKUP_MAGIC, 0, 0, 2, 0, 1, 0, snapshot.encode("utf-8"))
+    return header + b"\xAA" * (size - len(header))
+
+
+@pytest.mark.asyncio
+async def test__receive_stream(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    path = tmp_path / "TrueNAS.zfs.gz"
+    path.write_bytes(gzip.compress(stream()))
+    progress = []
+
+    with use_executor(executor):
+        dataset = await receive_stream(str(path), "boot-pool/ROOT", lambda p, message: progress.append(p))
+
+    assert dataset == "boot-pool/ROOT/25.10"
+    assert executor.receivers[0].received == 8 * 1024 ** 2
+    assert progress[-1] == 1
+    assert progress == sorted(progress)
+
+
+@pytest.mark.asyncio
+async def test__receive_invalid_stream(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    path = tmp_path / "TrueNAS.zfs"
+    path.write_bytes(b"\0" * 1024)
+
+    with use_executor(executor):
+        with pytest.raises(InstallError) as ve:
+            await receive_stream(str(path), "boot-pool/ROOT", lambda p, message: None)
+
+    assert ve.value.message == "Failed to receive boot environment: cannot receive: invalid stream (bad magic number)"
+
+
+@pytest.mark.asyncio
+async def test__receive_corrupt_compressed_stream(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    path = tmp_path / "TrueNAS.zfs.gz"
+    path.write_bytes(gzip.compress(stream())[:-1024])
+
+    with use_executor(executor):
+        with pytest.raises(InstallError) as ve:
+            await receive_stream(str(path), "boot-pool/ROOT", lambda p, message: None)
+
+    assert ve.value.message.startswith("Failed to receive boot environment: gzip: ")
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is not available")
+async def test__install_stream(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    disk = executor.add_disk("sda", SIZE)
+    subprocess.run(["zstd", "-q", "-o", str(tmp_path / "cdrom" / "TrueNAS.zfs.zst")], input=stream(), check=True)
+
+    await simulate_install(executor, [disk], [], payload="stream")
+
+    assert "zpool set bootfs=boot-pool/ROOT/25.10 boot-pool" in executor.commands
+    assert executor.installers[0].params["dataset_name"] == "boot-pool/ROOT/25.10"
+    assert executor.installers[0].params["skip_copy"] is True
+
+
+@pytest.mark.asyncio
+async def test__install_stream_unsupported_installer(tmp_path, monkeypatch):
+    monkeypatch.setattr("truenas_installer.install.installer_supports", lambda src, parameter: False)
+    executor = SimulatedExecutor(str(tmp_path))
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [], payload="stream")
+
+    assert ve.value.message == "The installer on the installation media does not support `payload: stream`"
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) is None
+    assert executor.installers[0].params is None
+
+
+@pytest.mark.asyncio
+async def test__install_stream_missing(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    disk = executor.add_disk("sda", SIZE)
+
+    with pytest.raises(InstallError) as ve:
+        await simulate_install(executor, [disk], [], payload="stream")
+
+    assert ve.value.message == ("The installation media does not contain the boot environment stream "
+                                "/cdrom/TrueNAS.zfs.zst")
+    assert read_partition_table(str(tmp_path / "dev" / "sda")) is None
+    assert not [command for command in executor.commands if command.startswith("zpool create")]
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which("zpool") is None, reason="ZFS is not available")
+async def test__receive_stream_file_backed_pool(tmp_path):
+    pool = f"test-{uuid.uuid4().hex[:8]}"
+    vdev = tmp_path / "vdev"
+    with open(vdev, "wb") as f:
+        f.truncate(256 * 1024 ** 2)
+
+    subprocess.run(["zpool", "create", "-O", "mountpoint=none", pool, str(vdev)], check=True)
+    try:
+        subprocess.run(["zfs", "create", "-p", f"{pool}/build/25.10"], check=True)
+        subprocess.run(["zfs", "create", f"{pool}/ROOT"], check=True)
+        subprocess.run(["zfs", "snapshot", f"{pool}/build/25.10@install"], check=True)
+        with open(tmp_path / "TrueNAS.zfs.gz", "wb") as f:
+            send = subprocess.run(["zfs", "send", f"{pool}/build/25.10@install"], stdout=subprocess.PIPE, check=True)
+            f.write(gzip.compress(send.stdout))
+
+        with use_executor(Executor()):
+            dataset = await receive_stream(str(tmp_path / "TrueNAS.zfs.gz"), f"{pool}/ROOT", lambda p, message: None)
+
+        assert dataset == f"{pool}/ROOT/25.10"
+        assert subprocess.run(["zfs", "get", "-H", "-o", "value", "mountpoint", dataset], capture_output=True,
+                              text=True, check=True).stdout.strip() == "legacy"
+    finally:
+        subprocess.run(["zpool", "destroy", "-f", pool])
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from truenas_installer.trace import InstallTrace, get_last_trace, instant, span, tracing
+from truenas_installer.utils import run
+
+
+@pytest.mark.asyncio
+async def test__trace():
+    trace = InstallTrace()
+    with tracing(trace):
+        with span("stage", "stage"):
+            await run(["echo", "hello"])
+            await asyncio.create_task(run(["true"]), name="other task")
+            instant("progress", "progress", progress=0.5, message="Halfway")
+
+        with pytest.raises(ValueError):
+            with span("failing", "stage"):
+                raise ValueError("error")
+
+    assert get_last_trace() is trace
+
+    chrome = trace.to_chrome()
+    events = {event["name"]: event for event in chrome["traceEvents"] if event["ph"] != "M"}
+    assert events["echo"]["args"] == {"argv": ["echo", "hello"], "returncode": 0, "stdout_bytes": 6, "stderr_bytes": 0}
+    assert events["echo"]["ts"] >= events["stage"]["ts"]
+    assert events["echo"]["ts"] + events["echo"]["dur"] <= events["stage"]["ts"] + events["stage"]["dur"]
+    assert events["true"]["tid"] != events["echo"]["tid"]
+    assert events["progress"]["args"] == {"progress": 0.5, "message": "Halfway"}
+    assert events["failing"]["args"] == {"error": "ValueError('error')"}
+    assert {"name": "thread_name", "ph": "M", "pid": trace.pid, "tid": events["true"]["tid"],
+            "args": {"name": "other task"}} in chrome["traceEvents"]
+
+
+@pytest.mark.asyncio
+async def test__no_trace():
+    with span("stage", "stage") as args:
+        await run(["true"])
+
+    assert args == {}
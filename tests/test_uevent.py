@@ -0,0 +1,124 @@
+import asyncio
+import os
+import socket
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer import utils
+from truenas_installer.executor import host_path, use_executor
+from truenas_installer.simulation import SimulatedExecutor
+from truenas_installer.uevent import UDEV_HEADER, UDEV_MAGIC, Uevent, parse_kernel_uevent, parse_udev_uevent
+from truenas_installer.utils import get_partitions
+
+
+def test__parse_kernel_uevent():
+    event = parse_kernel_uevent(
+        b"add@/devices/virtual/block/loop0/loop0p3\0ACTION=add\0DEVPATH=/devices/virtual/block/loop0/loop0p3\0"
+        b"SUBSYSTEM=block\0DEVNAME=loop0p3\0DEVTYPE=partition\0PARTN=3\0SEQNUM=4242\0"
+    )
+
+    assert event.action == "add"
+    assert event.devpath == "/devices/virtual/block/loop0/loop0p3"
+    assert event.subsystem == "block"
+    assert event.devname == "loop0p3"
+    assert event.properties["PARTN"] == "3"
+
+
+def test__parse_kernel_uevent__udev_message():
+    assert parse_kernel_uevent(b"libudev\0\xfe\xed\xca\xfe") is None
+
+
+def test__parse_udev_uevent():
+    properties = b"ACTION=change\0DEVPATH=/devices/virtual/block/loop0/loop0p3\0SUBSYSTEM=block\0DEVNAME=/dev/loop0p3\0"
+    header = UDEV_HEADER.pack(b"libudev\0", socket.htonl(UDEV_MAGIC), UDEV_HEADER.size, UDEV_HEADER.size,
+                              len(properties), 0, 0, 0, 0)
+
+    event = parse_udev_uevent(header + properties)
+
+    assert event.action == "change"
+    assert event.devpath == "/devices/virtual/block/loop0/loop0p3"
+    assert event.subsystem == "block"
+    assert event.devname == "/dev/loop0p3"
+
+
+def test__parse_udev_uevent__kernel_message():
+    assert parse_udev_uevent(b"add@/devices/virtual/block/loop0\0ACTION=add\0DEVPATH=/devices/virtual/block/loop0\0"
+                             b"SUBSYSTEM=block\0DEVNAME=loop0\0SEQNUM=4242\0") is None
+
+
+class FakeUeventListener:
+    """
+    Reports the partitions of `disk` as added (and creates them in sysfs) on the second `receive`, after an event for
+    another disk whose name starts with the same letters.
+    """
+
+    def __init__(self, disk, partitions):
+        self.disk = disk
+        self.partitions = partitions
+        self.received = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def receive(self, timeout):
+        self.received += 1
+        await asyncio.sleep(0.01)
+        if self.received == 1:
+            return [_block_uevent(f"{self.disk}a", f"{self.disk}a1")]
+
+        events = []
+        for number in self.partitions:
+            partition = f"{self.disk}{number}"
+            os.makedirs(sysfs := host_path(f"/sys/block/{self.disk}/{partition}"))
+            with open(os.path.join(sysfs, "partition"), "w") as f:
+                f.write(f"{number}\n")
+
+            events.append(_block_uevent(self.disk, partition))
+
+        return events
+
+
+def _block_uevent(disk, partition):
+    return Uevent("add", f"/devices/virtual/block/{disk}/{partition}", {"SUBSYSTEM": "block"})
+
+
+@pytest.mark.asyncio
+async def test__get_partitions__returns_on_uevent(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    executor.add_disk("sda", 1024 ** 3)
+    listener = FakeUeventListener("sda", [1, 2])
+
+    with use_executor(executor):
+        with (
+            patch("truenas_installer.utils.UeventListener", lambda: listener),
+            patch("truenas_installer.utils._scan_sysfs_partitions", wraps=utils._scan_sysfs_partitions) as scan,
+        ):
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            partitions = await get_partitions(host_path("/dev/sda"), [1, 2], 10)
+            elapsed = loop.time() - start
+
+    assert partitions == {1: str(tmp_path / "dev" / "sda1"), 2: str(tmp_path / "dev" / "sda2")}
+    # Well before the fallback poll (once per second) would have found them
+    assert elapsed < 0.5
+    assert listener.received == 2
+    # The `sdaa1` event does not make sysfs be scanned again
+    assert scan.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test__get_partitions__fallback_ignores_other_disks(tmp_path):
+    executor = SimulatedExecutor(str(tmp_path))
+    executor.add_disk("sda", 1024 ** 3)
+    executor.add_disk("sdaa", 1024 ** 3)
+    (tmp_path / "dev" / "sdaa1").touch()
+    (tmp_path / "dev" / "sda2").touch()
+
+    with use_executor(executor):
+        partitions = await get_partitions(host_path("/dev/sda"), [1, 2])
+
+    assert partitions == {1: None, 2: str(tmp_path / "dev" / "sda2")}
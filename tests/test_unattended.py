@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from truenas_installer.disks import Disk, ZFSMember
+from truenas_installer.exception import InstallError
+from truenas_installer.installer import Installer
+from truenas_installer.unattended import load_answer_file, resolve_answers, run_unattended, select_disks
+
+GiB = 1024 ** 3
+DISKS = [
+    Disk("nvme0n1", 512 * GiB, "Samsung SSD 980", "", [], False),
+    Disk("nvme1n1", 256 * GiB, "Samsung SSD 980", "", [], False),
+    Disk("nvme2n1", 256 * GiB, "WD SN570", "", [], False),
+    Disk("sda", 32 * GiB, "SATADOM", "", [ZFSMember("sda3", "boot-pool")], False),
+    Disk("sdb", 64 * GiB, "USB Stick", "", [], True),
+]
+AUTHENTICATION = {"username": "truenas_admin", "password": "password"}
+
+
+@pytest.mark.parametrize("selector,names", [
+    ({"name": "^nvme", "order": "smallest", "count": 2}, ["nvme1n1", "nvme2n1"]),
+    ({"name": "^nvme", "order": "largest"}, ["nvme0n1"]),
+    ({"model": "^Samsung", "count": 2}, ["nvme0n1", "nvme1n1"]),
+    ({"max_size": 64 * GiB, "removable": False}, ["sda"]),
+    ({"min_size": 100 * GiB, "order": "smallest", "count": 3}, ["nvme1n1", "nvme2n1", "nvme0n1"]),
+])
+def test__select_disks(selector, names):
+    assert [disk.name for disk in select_disks(DISKS, selector)] == names
+
+
+def test__select_disks_not_enough():
+    with pytest.raises(InstallError) as ve:
+        select_disks(DISKS, {"name": "^nvme", "count": 4})
+
+    assert ve.value.message == 'Disk selector {"name": "^nvme", "count": 4} matches 3 disk(s), 4 required'
+
+
+def test__resolve_answers():
+    params = resolve_answers({
+        "disks": {"name": "^nvme", "order": "smallest", "count": 2},
+        "wipe_disks": "boot_pools",
+        "wipe_mode": "discard",
+        "set_pmbr": False,
+        "authentication": AUTHENTICATION,
+        "when_done": "reboot",
+        "tnc": {"enabled": False},
+    }, DISKS)
+
+    assert params == {
+        "disks": ["nvme1n1", "nvme2n1"],
+        "wipe_disks": ["sda"],
+        "wipe_mode": "discard",
+        "set_pmbr": False,
+        "authentication": AUTHENTICATION,
+    }
+
+
+@pytest.mark.parametrize("answers,error", [
+    ({"disks": ["sdc"], "set_pmbr": False, "authentication": None}, "Disk 'sdc' does not exist"),
+    ({"disks": ["sda"], "authentication": None}, "Invalid answer file: 'set_pmbr' is a required property"),
+    ({"disks": ["sda"], "set_pmbr": False, "authentication": {"username": "admin", "password": "password"}},
+     "Invalid answer file: 'admin' is not one of ['truenas_admin', 'root']"),
+    ({"disks": {"size": 1}, "set_pmbr": False, "authentication": None}, "Invalid answer file: "),
+    ({"disks": ["sda"], "wipe_disks": ["sdb"], "set_pmbr": False, "authentication": None, "upgrade": True},
+     "`wipe_disks` and `resume` can't be used with `upgrade`"),
+    ({"disks": ["sda"], "set_pmbr": False, "authentication": None, "upgrade": True, "resume": True},
+     "`wipe_disks` and `resume` can't be used with `upgrade`"),
+])
+def test__resolve_answers_invalid(answers, error):
+    with pytest.raises(InstallError) as ve:
+        resolve_answers(answers, DISKS)
+
+    assert ve.value.message.startswith(error)
+
+
+def test__load_yaml_answer_file(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "answers.yaml"
+    path.write_text("disks:\n  name: ^nvme\n  count: 2\nset_pmbr: false\nauthentication: null\n")
+
+    assert load_answer_file(str(path)) == {
+        "disks": {"name": "^nvme", "count": 2},
+        "set_pmbr": False,
+        "authentication": None,
+    }
+
+
+def test__load_invalid_answer_file(tmp_path):
+    path = tmp_path / "answers.json"
+    path.write_text("{")
+
+    with pytest.raises(InstallError) as ve:
+        load_answer_file(str(path))
+
+    assert ve.value.message.startswith("Invalid answer file: ")
+
+
+@pytest.mark.asyncio
+async def test__run_unattended_unexpected_error(tmp_path, monkeypatch, capsys):
+    class FakeStager:
+        def start(self):
+            pass
+
+        async def stop(self):
+            pass
+
+    async def list_disks():
+        raise RuntimeError("Unexpected")
+
+    monkeypatch.setattr("truenas_installer.unattended.image_stager", FakeStager())
+    monkeypatch.setattr("truenas_installer.unattended.list_disks", list_disks)
+    path = tmp_path / "answers.json"
+    path.write_text(json.dumps({"disks": ["sda"], "set_pmbr": False, "authentication": None}))
+
+    assert await run_unattended(Installer("25.10", {}, "TrueNAS", None), str(path)) == 1
+    assert capsys.readouterr().err == "Installation failed: RuntimeError('Unexpected')\n"
@@ -0,0 +1,41 @@
+import pytest
+
+from truenas_installer.verify import ImageVerificationError, generate_manifest, verify_image
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "TrueNAS.update"
+    path.write_bytes(bytes(range(256)) * 4096 + b"tail")
+    return path
+
+
+def test__verify_image(image):
+    manifest = generate_manifest(str(image), 64 * 1024)
+    progress = []
+
+    verify_image(str(image), manifest, progress.append)
+
+    assert len(manifest["chunks"]) == 17
+    assert progress[-1] == 1
+
+
+def test__verify_image__corrupt_chunk(image):
+    manifest = generate_manifest(str(image), 64 * 1024)
+    with open(image, "r+b") as f:
+        f.seek(3 * 64 * 1024 + 100)
+        f.write(b"x")
+
+    with pytest.raises(ImageVerificationError) as ve:
+        verify_image(str(image), manifest)
+
+    assert str(ve.value) == "1 corrupt chunk(s) found at offset(s) 196608"
+
+
+def test__verify_image__size_mismatch(image):
+    manifest = generate_manifest(str(image), 64 * 1024)
+    with open(image, "ab") as f:
+        f.write(b"x")
+
+    with pytest.raises(ImageVerificationError):
+        verify_image(str(image), manifest)
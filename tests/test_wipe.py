@@ -0,0 +1,126 @@
+import errno
+import os
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer.gpt import read_partition_table, write_boot_partition_table
+from truenas_installer.wipe import ZFS_LABEL_SIZE, discard_device, wipe_signatures
+
+SIZE = 2 * 1024 ** 3
+MARKER = b"\xaa" * 512
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "disk.img"
+    with open(path, "wb") as f:
+        f.truncate(SIZE)
+
+    return str(path)
+
+
+def write(image, offset, data=MARKER):
+    with open(image, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def read(image, offset, length=len(MARKER)):
+    with open(image, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def test__wipe_signatures(image):
+    table = write_boot_partition_table(image, False)
+    data = table.partitions[2]
+    data_start = data.first_lba * 512
+    data_size = data.sectors * 512
+    aligned_size = data_size // ZFS_LABEL_SIZE * ZFS_LABEL_SIZE
+
+    zfs_labels = [
+        data_start + 16 * 1024,
+        data_start + ZFS_LABEL_SIZE + 16 * 1024,
+        data_start + aligned_size - 2 * ZFS_LABEL_SIZE + 16 * 1024,
+        data_start + aligned_size - ZFS_LABEL_SIZE + 16 * 1024,
+    ]
+    ext4_superblock = table.partitions[1].first_lba * 512 + 1024
+    user_data = data_start + 512 * 1024 ** 2
+    for offset in zfs_labels + [ext4_superblock, user_data]:
+        write(image, offset)
+
+    report = wipe_signatures(image)
+
+    assert read_partition_table(image) is None
+    for offset in zfs_labels + [ext4_superblock]:
+        assert read(image, offset) == b"\0" * len(MARKER)
+
+    # Only the signature regions are touched
+    assert read(image, user_data) == MARKER
+    assert report.bytes_wiped < SIZE // 100
+
+    signatures = sum([region.signatures for region in report.regions], [])
+    assert "GPT primary header and entries" in signatures
+    assert "GPT backup header and entries" in signatures
+    assert "partition 3: ZFS label L3" in signatures
+    assert "partition 2: ext2/3/4 superblock" in signatures
+
+
+def test__wipe_signatures__regions_are_aligned(image):
+    write_boot_partition_table(image, False)
+
+    report = wipe_signatures(image)
+
+    for region in report.regions:
+        assert region.offset % (1024 ** 2) == 0
+        assert region.length % 512 == 0
+        assert region.offset + region.length <= SIZE
+
+    assert all(a.offset + a.length < b.offset for a, b in zip(report.regions, report.regions[1:]))
+
+
+def test__discard_device__image_file_is_zeroed(tmp_path):
+    path = str(tmp_path / "disk.img")
+    with open(path, "wb") as f:
+        f.truncate(8 * 1024 ** 2)
+
+    write(path, 0)
+    write(path, 5 * 1024 ** 2)
+
+    progress = []
+    with patch("truenas_installer.wipe.DISCARD_CHUNK_SIZE", 2 * 1024 ** 2):
+        assert discard_device(path, progress=progress.append) == "zero"
+
+    assert progress == [0.25, 0.5, 0.75, 1.0]
+    assert read(path, 0, 8 * 1024 ** 2) == b"\0" * 8 * 1024 ** 2
+
+
+def test__discard_device__no_zero_fallback(tmp_path):
+    path = str(tmp_path / "disk.img")
+    with open(path, "wb") as f:
+        f.truncate(8 * 1024 ** 2)
+
+    write(path, 0)
+
+    with pytest.raises(OSError) as e:
+        discard_device(path, zero=False)
+
+    assert e.value.errno == errno.EOPNOTSUPP
+    assert read(path, 0) == MARKER
+
+
+def test__wipe_signatures__only_falls_back_when_direct_io_is_unsupported(image):
+    open_ = os.open
+
+    def open_direct_failing(path, flags, *args):
+        if flags & os.O_DIRECT:
+            raise OSError(errno.EIO, "I/O error")
+
+        return open_(path, flags, *args)
+
+    with patch("os.open", open_direct_failing):
+        with pytest.raises(OSError) as ve:
+            wipe_signatures(image)
+
+    assert ve.value.errno == errno.EIO
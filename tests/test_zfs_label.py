@@ -0,0 +1,73 @@
+import os
+
+from truenas_installer.simulation import pack_nvlist, write_zfs_labels
+from truenas_installer.zfs_label import LABEL_SIZE, VDEV_PHYS_OFFSET, ZFSLabel, label_offsets, read_zfs_label
+
+CONFIG = {
+    "version": 5000,
+    "name": "boot-pool",
+    "state": 1,
+    "txg": 1234,
+    "pool_guid": 5764350912338712816,
+    "errata": 0,
+    "hostid": 0x12345678,
+    "hostname": "truenas",
+    "top_guid": 42,
+    "guid": 42,
+    "vdev_children": 1,
+    "vdev_tree": {"type": "disk", "id": 0, "guid": 42, "path": "/dev/sda3"},
+    "features_for_read": {},
+}
+
+
+def test__label_offsets():
+    size = 100 * LABEL_SIZE + 4096
+    assert label_offsets(size) == [0, LABEL_SIZE, 98 * LABEL_SIZE, 99 * LABEL_SIZE]
+
+
+def test__read_zfs_label(tmp_path):
+    write_zfs_labels(path := str(tmp_path / "sda3"), 16 * LABEL_SIZE + 4096, CONFIG)
+
+    assert read_zfs_label(path) == ZFSLabel("boot-pool", 5764350912338712816, 42, 1234, 0x12345678, "exported")
+
+
+def test__read_zfs_label__highest_txg(tmp_path):
+    write_zfs_labels(path := str(tmp_path / "sda3"), 16 * LABEL_SIZE, CONFIG)
+    offsets = label_offsets(16 * LABEL_SIZE)
+    with open(path, "r+b") as f:
+        # Labels at the end of the device were updated later
+        for offset in offsets[2:]:
+            f.seek(offset + VDEV_PHYS_OFFSET)
+            f.write(pack_nvlist(CONFIG | {"txg": 1240, "state": 0}))
+
+        # The first label is corrupt
+        f.seek(offsets[0] + VDEV_PHYS_OFFSET)
+        f.write(os.urandom(4096))
+
+    assert read_zfs_label(path).txg == 1240
+    assert read_zfs_label(path).state == "active"
+
+
+def test__read_zfs_label__not_a_member(tmp_path):
+    with open(path := str(tmp_path / "sda3"), "wb") as f:
+        f.truncate(16 * LABEL_SIZE)
+
+    assert read_zfs_label(path) is None
+
+
+def test__read_zfs_label__spare(tmp_path):
+    # Spares only have vdev configuration, they do not belong to any pool
+    write_zfs_labels(path := str(tmp_path / "sda3"), 16 * LABEL_SIZE, {"version": 5000, "state": 3, "guid": 42})
+
+    assert read_zfs_label(path) is None
+
+
+def test__read_zfs_label__truncated(tmp_path):
+    write_zfs_labels(path := str(tmp_path / "sda3"), 16 * LABEL_SIZE, CONFIG)
+    with open(path, "r+b") as f:
+        for offset in label_offsets(16 * LABEL_SIZE):
+            # Pair size points past the end of the nvlist
+            f.seek(offset + VDEV_PHYS_OFFSET + 12)
+            f.write(b"\x00\x10\x00\x00")
+
+    assert read_zfs_label(path) is None
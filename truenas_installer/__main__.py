@@ -1,6 +1,7 @@
 import argparse
 import asyncio
 import json
+import sys
 
 from aiohttp import web
 
@@ -10,12 +11,15 @@ from .installer import Installer
 from .installer_menu import InstallerMenu
 from .server import InstallerRPCServer
 from .server.doc import generate_api_doc
+from .unattended import run_unattended
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--doc", action="store_true")
     parser.add_argument("--server", action="store_true")
+    parser.add_argument("--unattended", metavar="ANSWER_FILE",
+                        help="Install the system as described by a JSON or YAML answer file, without any prompts")
     args = parser.parse_args()
 
     with open("/etc/version") as f:
@@ -41,8 +45,11 @@ def main():
         app.router.add_routes([
             web.get("/ws", rpc_server.handle_http_request),
         ])
+        app.on_startup.append(rpc_server.on_startup)
         app.on_shutdown.append(rpc_server.on_shutdown)
         web.run_app(app, port=8080)
+    elif args.unattended:
+        sys.exit(asyncio.run(run_unattended(installer, args.unattended)))
     else:
         loop = asyncio.get_event_loop()
         loop.create_task(InstallerMenu(installer).run())
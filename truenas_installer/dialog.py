@@ -24,7 +24,7 @@ async def dialog(args, check=False):
     return subprocess.CompletedProcess(args, process.returncode, stderr=stderr)
 
 
-async def dialog_checklist(title, text, items):
+async def dialog_checklist(title, text, items, selected=()):
     result = await dialog(
         [
             "--clear",
@@ -33,7 +33,7 @@ async def dialog_checklist(title, text, items):
         ] +
         sum(
             [
-                [k, v, "off"]
+                [k, v, "on" if k in selected else "off"]
                 for k, v in items.items()
             ],
             [],
@@ -0,0 +1,136 @@
+import base64
+import functools
+import json
+import re
+
+from .disks import Disk
+
+__all__ = ["FILTER_OPERATORS", "QUERY_FIELDS", "query_disks"]
+
+# Disk attributes that can be filtered and sorted by
+QUERY_FIELDS = ["name", "size", "model", "label", "removable", "transport", "rotational", "serial", "wwn",
+                "nvme_namespace", "enclosure_slot", "logical_block_size", "physical_block_size"]
+FILTER_OPERATORS = {
+    "=": lambda value, operand: value == operand,
+    "!=": lambda value, operand: value != operand,
+    ">": lambda value, operand: value is not None and value > operand,
+    ">=": lambda value, operand: value is not None and value >= operand,
+    "<": lambda value, operand: value is not None and value < operand,
+    "<=": lambda value, operand: value is not None and value <= operand,
+    "~": lambda value, operand: value is not None and re.search(operand, str(value)) is not None,
+    "in": lambda value, operand: value in operand,
+    "nin": lambda value, operand: value not in operand,
+}
+DEFAULT_LIMIT = 100
+
+
+def query_disks(disks: list[Disk], filters: list[list] = (), order_by: list[str] = (), limit: int = DEFAULT_LIMIT,
+                cursor: str | None = None) -> tuple[list[Disk], str | None, int]:
+    """
+    Filters, sorts and paginates `disks`.
+
+    `filters` is a list of `[field, operator, value]` conditions that must all match (see `FILTER_OPERATORS`).
+    `order_by` is a list of fields, prefixed with `-` for descending order. Disks are always sorted by `name` last,
+    missing (`None`) values sort last.
+
+    Returns at most `limit` disks that follow `cursor`, the cursor to pass to get the next page (`None` if this is the
+    last page) and the number of the disks that match `filters`. Cursors point to the sort key of the last disk
+    returned, not to its position, so pages do not skip or repeat disks if some are added or removed in between.
+    Raises `ValueError` if a filter, the sort order or the cursor is invalid.
+    """
+    for condition in filters:
+        field, operator, operand = condition
+        _check_field(field)
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Invalid filter operator {operator!r}")
+
+        if operator == "~":
+            try:
+                re.compile(operand)
+            except (re.error, TypeError) as e:
+                raise ValueError(f"Invalid regular expression {operand!r}: {e}")
+
+    order = [(field.removeprefix("-"), field.startswith("-")) for field in order_by]
+    for field, descending in order:
+        _check_field(field)
+
+    if "name" not in [field for field, descending in order]:
+        order.append(("name", False))
+
+    try:
+        matching = [
+            disk for disk in disks
+            if all(FILTER_OPERATORS[operator](getattr(disk, field), operand) for field, operator, operand in filters)
+        ]
+    except TypeError as e:
+        raise ValueError(f"Invalid filter value: {e}")
+
+    keys = {disk.name: _SortKey([getattr(disk, field) for field, descending in order], order) for disk in matching}
+    matching.sort(key=lambda disk: keys[disk.name])
+
+    if cursor is not None:
+        after = _SortKey(_decode_cursor(cursor, list(order_by), len(order)), order)
+        try:
+            matching_after = [disk for disk in matching if after < keys[disk.name]]
+        except TypeError:
+            raise ValueError("Invalid cursor")
+    else:
+        matching_after = matching
+
+    page = matching_after[:limit]
+    next_cursor = None
+    if len(matching_after) > limit:
+        next_cursor = _encode_cursor(keys[page[-1].name].values, list(order_by))
+
+    return page, next_cursor, len(matching)
+
+
+@functools.total_ordering
+class _SortKey:
+    def __init__(self, values, order):
+        self.values = values
+        self.order = order
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for a, b, (field, descending) in zip(self.values, other.values, self.order):
+            if a == b:
+                continue
+
+            # Missing values sort last in both directions
+            if a is None:
+                return False
+            if b is None:
+                return True
+
+            return a > b if descending else a < b
+
+        return False
+
+
+def _check_field(field):
+    if field not in QUERY_FIELDS:
+        raise ValueError(f"Invalid field {field!r}")
+
+
+def _encode_cursor(values, order_by):
+    return base64.urlsafe_b64encode(json.dumps({"order_by": order_by, "after": values}).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor, order_by, fields):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after = decoded["after"]
+        cursor_order_by = decoded["order_by"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(after, list) or len(after) != fields:
+        raise ValueError("Invalid cursor")
+
+    if cursor_order_by != order_by:
+        raise ValueError("Cursor was returned for a different `order_by`")
+
+    return after
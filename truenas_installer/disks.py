@@ -1,18 +1,35 @@
+import asyncio
 from dataclasses import dataclass
-import json
+import os
 import re
+from typing import Callable
 
+from .executor import host_path
+from .trace import span
+from .uevent import UDEV_GROUP, UeventListener
 from .utils import run
+from .zfs_label import read_zfs_label
 
-__all__ = ["list_disks"]
+__all__ = ["TRANSPORTS", "Disk", "DiskInventory", "ZFSMember", "disk_inventory", "disk_transport", "list_disks"]
 
 MIN_DISK_SIZE = 8_000_000_000
+EXCLUDED_PREFIXES = ("dm", "loop", "md", "sr", "st")
+UDEV_DATA_PATH = "/run/udev/data"
+# Maximum number of concurrent `blkid` probes for the devices udev has no information about
+MAX_CONCURRENT_PROBES = 8
+TRANSPORTS = ["nvme", "sas", "sata", "virtio", "mmc", "usb", "unknown"]
 
 
 @dataclass
 class ZFSMember:
     name: str
     pool: str
+    # Read from the ZFS label, `None` if the label could not be read
+    pool_guid: str | None = None
+    txg: int | None = None
+    hostid: int | None = None
+    # One of: active, exported, destroyed, potentially_active, ...
+    state: str | None = None
 
 
 @dataclass
@@ -23,63 +40,395 @@ class Disk:
     label: str
     zfs_members: list[ZFSMember]
     removable: bool
+    # One of `TRANSPORTS`
+    transport: str = "unknown"
+    rotational: bool = False
+    serial: str | None = None
+    wwn: str | None = None
+    # Namespace ID of NVMe disks
+    nvme_namespace: int | None = None
+    # Name of the SES enclosure slot the disk is in
+    enclosure_slot: str | None = None
+    logical_block_size: int = 512
+    physical_block_size: int = 512
 
     @property
     def device(self):
-        return f"/dev/{self.name}"
+        return host_path(f"/dev/{self.name}")
 
 
-async def list_disks():
-    # need to settle so that lsblk output is stable
-    await run(["udevadm", "settle"])
+class DiskInventory:
+    """
+    In-process cache of the disks `list_disks` returns. It is built once (with a full sysfs scan) and then kept
+    current by a udev block subsystem monitor: every processed uevent bumps `generation` and marks its disk as changed,
+    and only the changed disks are re-scanned the next time the inventory is read.
 
-    with open("/etc/mtab") as f:
-        mtab = f.read()
+    Mounts do not generate uevents, so mounted disks are filtered out each time the inventory is read. If the udev
+    monitor can not be opened, every read is a full scan.
+    """
 
-    disks = []
-    for disk in json.loads(
-        (await run(["lsblk", "-b", "-fJ", "-o", "name,fstype,label,rm,size,model"])).stdout
-    )["blockdevices"]:
-        if disk["name"].startswith(("dm", "loop", "md", "sr", "st")):
-            continue
-        elif disk["size"] < MIN_DISK_SIZE:
-            continue
-        elif re.search(fr"/dev/{disk['name']}p?[0-9]+", mtab):
+    def __init__(self):
+        # Incremented every time udev reports a change of a block device
+        self.generation = 0
+        self.listener = None
+        self.lock = asyncio.Lock()
+        # All the disks that are not filtered out by their name or size, by name
+        self.cache = None
+        self.changed = set()
+
+    async def disks(self, callback: Callable | None = None) -> list[Disk]:
+        """
+        Returns the inventory. If `callback` is set, it is called with every disk as soon as it is known: immediately
+        for the disks that are cached, and as the scan of each disk completes for the others.
+        """
+        async with self.lock:
+            if self.listener is None:
+                try:
+                    self.listener = UeventListener(UDEV_GROUP).__enter__()
+                except OSError:
+                    pass
+
+            if self.listener is not None:
+                self._receive_events()
+
+            mounted = await asyncio.to_thread(mounted_disks)
+
+            def report(disk):
+                if callback is not None and disk.name not in mounted:
+                    callback(disk)
+
+            if self.cache is None or self.listener is None:
+                # The monitor is opened before scanning, so a change during the scan marks the disk for a re-scan
+                # and is not lost
+                self.changed.clear()
+                with span("scan_disks", "disks"):
+                    self.cache = await _scan_disks(callback=report)
+            else:
+                changed, self.changed = self.changed, set()
+                for name in changed:
+                    self.cache.pop(name, None)
+
+                for name, disk in sorted(self.cache.items()):
+                    report(disk)
+
+                if changed:
+                    with span("scan_disks", "disks", changed=sorted(changed)):
+                        self.cache.update(await _scan_disks(changed, report))
+
+            # we sort the disks by name because `nvme` comes before `sd*`
+            # and our appliances have nvme boot drives so by putting nvme
+            # devices up top in the installer, it provides a convenience
+            # for other departments
+            return [disk for name, disk in sorted(self.cache.items()) if name not in mounted]
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.__exit__(None, None, None)
+            self.listener = None
+
+        self.cache = None
+
+    def _receive_events(self):
+        if (events := self.listener.receive_queued()) is None:
+            # Events were dropped, anything could have changed
+            self.generation += 1
+            self.cache = None
+            return
+
+        for event in events:
+            if event.subsystem != "block":
+                continue
+
+            name = os.path.basename(event.devpath)
+            if event.properties.get("DEVTYPE") == "partition":
+                name = os.path.basename(os.path.dirname(event.devpath))
+
+            self.generation += 1
+            self.changed.add(name)
+
+
+disk_inventory = DiskInventory()
+
+
+async def list_disks(callback: Callable | None = None):
+    """
+    Returns the disks that the system can be installed to, sorted by name. `callback` is called with each disk as soon
+    as it is enumerated (see `DiskInventory.disks`).
+    """
+    return await disk_inventory.disks(callback)
+
+
+def mounted_disks() -> set[str]:
+    """
+    Returns the names of the disks that have a mounted partition, from a single pass over `/proc/self/mountinfo`.
+    """
+    disks = set()
+    try:
+        with open(host_path("/proc/self/mountinfo")) as f:
+            mountinfo = f.read()
+    except FileNotFoundError:
+        return disks
+
+    for line in mountinfo.splitlines():
+        # `... - fstype source super_options`
+        if len(fields := line.split(" - ", 1)[-1].split()) < 2 or not fields[1].startswith("/dev/"):
             continue
 
-        zfs_members = []
-        if disk["fstype"] is not None:
-            label = disk["fstype"]
+        # Sources may be symlinks (i.e. `/dev/disk/by-label/...`)
+        name = os.path.basename(os.path.realpath(host_path(fields[1].replace("\\040", " "))))
+        sysfs = host_path(f"/sys/class/block/{name}")
+        if os.path.exists(os.path.join(sysfs, "partition")):
+            disks.add(os.path.basename(os.path.dirname(os.path.realpath(sysfs))))
+
+    return disks
+
+
+async def _scan_disks(names=None, callback=None):
+    """
+    Scans the disks `names` (all the disks if `None`) in sysfs. Returns the ones that can be installed to (mounted
+    ones included), by name.
+
+    Each disk is scanned independently, `callback` (if set) is called with every disk as soon as its scan completes.
+    """
+    if names is None:
+        # need to settle so that the udev database is stable
+        await run(["udevadm", "settle"])
+        names = os.listdir(host_path("/sys/block"))
+
+    disks = {}
+    # Filesystem signatures are only probed for the devices that are not in the udev database
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+
+    async def scan(name):
+        if (disk := await _scan_disk(name, semaphore)) is not None:
+            disks[disk.name] = disk
+            if callback is not None:
+                callback(disk)
+
+    # Scans are started in name order, so `nvme` disks are reported first
+    await asyncio.gather(*[scan(name) for name in sorted(names) if not name.startswith(EXCLUDED_PREFIXES)])
+    return disks
+
+
+async def _scan_disk(name, semaphore):
+    disk = await asyncio.to_thread(_read_block_device, name)
+    if disk is None or disk["size"] < MIN_DISK_SIZE:
+        return None
+
+    await asyncio.gather(*[
+        _probe_filesystem(device, semaphore)
+        for device in [disk] + disk["children"]
+        if not device["udev"]
+    ])
+
+    # Pool membership is read from the ZFS labels of the partitions that are (or might be) ZFS pool members
+    await asyncio.gather(*[
+        asyncio.to_thread(_read_zfs_member, partition)
+        for partition in disk["children"]
+        if partition["fstype"] in (None, "zfs_member")
+    ])
+
+    label, zfs_members = _disk_label(disk)
+    return Disk(
+        disk["name"],
+        disk["size"],
+        disk["model"] or "Unknown Model",
+        label,
+        zfs_members,
+        disk["rm"],
+        **disk["details"],
+    )
+
+
+def _disk_label(disk):
+    """
+    Describes the contents of the scanned `disk`: its filesystem, its ZFS pool memberships or the most relevant
+    filesystem of its partitions. Returns the description and the ZFS pool members.
+    """
+    zfs_members = []
+    if disk["fstype"] is not None:
+        label = disk["fstype"]
+    else:
+        children = disk["children"]
+        if zfs_members := [ZFSMember(child["name"], child["label"], **child.get("zfs", {}))
+                           for child in children
+                           if child["fstype"] == "zfs_member"]:
+            label = ", ".join([f"zfs-\"{zfs_member.pool}\"" for zfs_member in zfs_members])
         else:
-            children = disk.get("children", [])
-            if zfs_members := [ZFSMember(child["name"], child["label"])
-                               for child in children
-                               if child["fstype"] == "zfs_member"]:
-                label = ", ".join([f"zfs-\"{zfs_member.pool}\"" for zfs_member in zfs_members])
+            for fstype in ["ext4", "xfs"]:
+                if labels := [child for child in children if child["fstype"] == fstype]:
+                    label = f"{fstype}-{labels[0]['label']}"
+                    break
             else:
-                for fstype in ["ext4", "xfs"]:
-                    if labels := [child for child in children if child["fstype"] == fstype]:
-                        label = f"{fstype}-{labels[0]['label']}"
-                        break
+                if labels := [child for child in children if child["fstype"] is not None]:
+                    label = "-".join(filter(None, [labels[0]["fstype"], labels[0]["label"]]))
                 else:
-                    if labels := [child for child in children if child["fstype"] is not None]:
-                        label = "-".join(filter(None, [labels[0]["fstype"], labels[0]["label"]]))
-                    else:
-                        label = ""
-
-        disks.append(
-            Disk(
-                disk["name"],
-                disk["size"],
-                disk["model"] or "Unknown Model",
-                label,
-                zfs_members,
-                disk["rm"]
-            )
-        )
-
-    # we sort the disks by name because `nvme` comes before `sd*`
-    # and our appliances have nvme boot drives so by putting nvme
-    # devices up top in the installer, it provides a convenience
-    # for other departments
-    return sorted(disks, key=lambda x: x.name)
+                    label = ""
+
+    return label, zfs_members
+
+
+def disk_transport(name: str, sysfs: str, removable: bool) -> str:
+    """
+    Returns the transport (one of `TRANSPORTS`) of the disk `name` from its sysfs path `sysfs`.
+    """
+    if name.startswith("nvme"):
+        return "nvme"
+
+    path = os.path.realpath(sysfs)
+    if "/usb" in path:
+        return "usb"
+    elif name.startswith("mmcblk"):
+        return "mmc"
+    elif "/virtio" in path or name.startswith("vd"):
+        return "virtio"
+    elif "/ata" in path:
+        return "sata"
+    elif "/end_device-" in path or "/sas" in path:
+        return "sas"
+    elif removable:
+        return "usb"
+
+    return "unknown"
+
+
+def _read_block_device(name):
+    sysfs = host_path(f"/sys/block/{name}")
+    try:
+        disk = _read_udev_device(sysfs, name)
+        disk["size"] = int(_read_attribute(sysfs, "size")) * 512
+        disk["rm"] = _read_attribute(sysfs, "removable") == "1"
+        if disk["model"] is None:
+            try:
+                disk["model"] = _normalize_whitespace(_read_attribute(sysfs, "device/model")) or None
+            except FileNotFoundError:
+                pass
+
+        partitions = []
+        with os.scandir(sysfs) as entries:
+            for entry in entries:
+                if entry.name.startswith(name) and os.path.exists(os.path.join(entry.path, "partition")):
+                    partitions.append((int(_read_attribute(entry.path, "partition")), entry))
+
+        disk["children"] = [_read_udev_device(entry.path, entry.name)
+                            for number, entry in sorted(partitions, key=lambda partition: partition[0])]
+
+        disk["details"] = {
+            "transport": disk_transport(name, sysfs, disk["rm"]),
+            "rotational": _read_optional_attribute(sysfs, "queue/rotational") == "1",
+            "serial": disk.pop("serial") or _read_optional_attribute(sysfs, "device/serial") or None,
+            "wwn": disk.pop("wwn") or _read_optional_attribute(sysfs, "wwid") or
+            _read_optional_attribute(sysfs, "device/wwid") or None,
+            "nvme_namespace": _nvme_namespace(name, sysfs),
+            "enclosure_slot": _enclosure_slot(sysfs),
+            "logical_block_size": int(_read_optional_attribute(sysfs, "queue/logical_block_size") or 512),
+            "physical_block_size": int(_read_optional_attribute(sysfs, "queue/physical_block_size") or 512),
+        }
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        # The device disappeared while it was being read
+        return None
+
+    return disk
+
+
+def _read_udev_device(sysfs, name):
+    device = {"name": name, "fstype": None, "label": None, "model": None, "serial": None, "wwn": None, "udev": False}
+    try:
+        with open(host_path(f"{UDEV_DATA_PATH}/b{_read_attribute(sysfs, 'dev')}")) as f:
+            udev_data = f.read()
+    except FileNotFoundError:
+        return device
+
+    properties = dict(
+        line[2:].split("=", 1) for line in udev_data.splitlines() if line.startswith("E:") and "=" in line
+    )
+    device["udev"] = True
+    device["fstype"] = properties.get("ID_FS_TYPE") or None
+    # Like lsblk, prefer the unmangled values of the properties udev has escaped
+    if (label := properties.get("ID_FS_LABEL_ENC")) is not None:
+        device["label"] = _unescape_udev(label) or None
+    else:
+        device["label"] = properties.get("ID_FS_LABEL") or None
+
+    if (model := properties.get("ID_MODEL_ENC")) is not None:
+        device["model"] = _normalize_whitespace(_unescape_udev(model)) or None
+    else:
+        device["model"] = properties.get("ID_MODEL") or None
+
+    device["serial"] = properties.get("ID_SERIAL_SHORT") or None
+    device["wwn"] = properties.get("ID_WWN_WITH_EXTENSION") or properties.get("ID_WWN") or None
+    return device
+
+
+def _nvme_namespace(name, sysfs):
+    if not name.startswith("nvme"):
+        return None
+
+    if (nsid := _read_optional_attribute(sysfs, "nsid")) is not None:
+        return int(nsid)
+
+    if match := re.search(r"n([0-9]+)$", name):
+        return int(match.group(1))
+
+    return None
+
+
+def _enclosure_slot(sysfs):
+    # SES enclosures link their slots to the SCSI devices as `enclosure_device:<slot name>`
+    try:
+        with os.scandir(os.path.join(sysfs, "device")) as entries:
+            for entry in entries:
+                if entry.name.startswith("enclosure_device:"):
+                    return entry.name.removeprefix("enclosure_device:")
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+
+
+def _read_zfs_member(partition):
+    try:
+        label = read_zfs_label(host_path(f"/dev/{partition['name']}"))
+    except OSError:
+        # Keep what udev (or blkid) knows about the partition
+        return
+
+    if label is not None:
+        partition["fstype"] = "zfs_member"
+        partition["label"] = label.pool
+        partition["zfs"] = {
+            "pool_guid": str(label.pool_guid),
+            "txg": label.txg,
+            "hostid": label.hostid,
+            "state": label.state,
+        }
+
+
+async def _probe_filesystem(device, semaphore):
+    async with semaphore:
+        result = await run(["blkid", "-p", "-o", "export", host_path(f"/dev/{device['name']}")], check=False)
+
+    if result.returncode == 0:
+        properties = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+        device["fstype"] = properties.get("TYPE")
+        device["label"] = properties.get("LABEL")
+
+
+def _read_attribute(sysfs, attribute):
+    with open(os.path.join(sysfs, attribute)) as f:
+        return f.read().strip()
+
+
+def _read_optional_attribute(sysfs, attribute):
+    try:
+        return _read_attribute(sysfs, attribute)
+    except OSError:
+        return None
+
+
+def _unescape_udev(value):
+    # udev escapes unsafe characters as `\xNN`
+    return re.sub(rb"\\x([0-9a-fA-F]{2})", lambda m: bytes([int(m.group(1), 16)]),
+                  value.encode("utf-8")).decode("utf-8", "replace")
+
+
+def _normalize_whitespace(value):
+    return " ".join(value.split())
@@ -0,0 +1,76 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import subprocess
+
+from .gpt import reread_partition_table
+
+__all__ = ["Executor", "get_executor", "host_path", "use_executor"]
+
+
+class Executor:
+    """
+    Everything the installation pipeline does to the host system goes through an executor: running commands,
+    launching the `truenas_install` process, making the kernel re-read partition tables and accessing host paths
+    like `/dev`, `/sys` or `/cdrom` (relative to `root`).
+
+    This executor operates on the real system. `truenas_installer.simulation` provides one that does not need any
+    hardware.
+    """
+
+    root = "/"
+
+    async def run(self, args: list[str]) -> tuple[int, bytes, bytes]:
+        """
+        Runs a command and returns its exit code, stdout and stderr.
+        """
+        process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        return process.returncode, stdout, stderr
+
+    async def spawn(self, args: list[str], cwd: str, merge_stderr: bool = True):
+        """
+        Launches a long-running process with piped stdin, stdout and stderr (if `merge_stderr` is set, stderr is
+        redirected to stdout). The returned object must behave like `asyncio.subprocess.Process`.
+        """
+        return await asyncio.create_subprocess_exec(
+            *args,
+            cwd=cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        )
+
+    def reread_partition_table(self, device: str):
+        reread_partition_table(device)
+
+
+_current = contextvars.ContextVar("executor", default=Executor())
+
+
+def get_executor() -> Executor:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use_executor(executor: Executor):
+    """
+    Makes `executor` the current executor for the body of the `with` statement (including the asyncio tasks and
+    threads started from it).
+    """
+    token = _current.set(executor)
+    try:
+        yield executor
+    finally:
+        _current.reset(token)
+
+
+def host_path(path: str) -> str:
+    """
+    Translates an absolute host path (i.e. `/sys/block`) to the current executor's root.
+    """
+    if (root := get_executor().root) == "/":
+        return path
+
+    return os.path.join(root, path.lstrip("/"))
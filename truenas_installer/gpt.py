@@ -0,0 +1,302 @@
+from dataclasses import dataclass, field
+import errno
+import fcntl
+import os
+import stat
+import struct
+import time
+import uuid
+import zlib
+
+__all__ = ["Partition", "PartitionTable", "boot_disk_layout", "device_geometry", "read_partition_table",
+           "reread_partition_table", "write_boot_partition_table", "write_partition_table"]
+
+BLKRRPART = 0x125F
+BLKSSZGET = 0x1268
+BLKGETSIZE64 = 0x80081272
+
+BIOS_BOOT_GUID = uuid.UUID("21686148-6449-6E6F-744E-656564454649")
+EFI_SYSTEM_GUID = uuid.UUID("C12A7328-F81F-11D2-BA4B-00A0C93EC93B")
+ZFS_GUID = uuid.UUID("6A898CC3-1DD2-11B2-99A6-080020736631")
+# Attribute bit 2 is "legacy BIOS bootable"
+LEGACY_BIOS_BOOTABLE = 1 << 2
+
+SIGNATURE = b"EFI PART"
+REVISION = 0x00010000
+HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+ENTRY = struct.Struct("<16s16sQQQ72s")
+NUM_ENTRIES = 128
+MBR_ENTRY = struct.Struct("<B3sB3sII")
+PROTECTIVE_MBR_TYPE = 0xEE
+
+MiB = 1024 ** 2
+
+
+@dataclass
+class Partition:
+    number: int
+    type_guid: uuid.UUID
+    first_lba: int
+    last_lba: int
+    name: str = ""
+    attributes: int = 0
+    guid: uuid.UUID = field(default_factory=uuid.uuid4)
+
+    @property
+    def sectors(self):
+        return self.last_lba - self.first_lba + 1
+
+
+@dataclass
+class PartitionTable:
+    sector_size: int
+    total_sectors: int
+    partitions: list[Partition]
+    disk_guid: uuid.UUID = field(default_factory=uuid.uuid4)
+    pmbr_boot: bool = False
+
+    @property
+    def entries_sectors(self):
+        return (NUM_ENTRIES * ENTRY.size + self.sector_size - 1) // self.sector_size
+
+    @property
+    def first_usable_lba(self):
+        return 2 + self.entries_sectors
+
+    @property
+    def last_usable_lba(self):
+        return self.total_sectors - 2 - self.entries_sectors
+
+
+def boot_disk_layout(sector_size: int, total_sectors: int, pmbr_boot: bool) -> PartitionTable:
+    """
+    Returns the TrueNAS boot disk layout: a 1 MiB BIOS boot partition, a 512 MiB EFI system partition (even if it is
+    not used, it allows the user to switch to UEFI later) and a ZFS data partition spanning the rest of the disk.
+
+    This is the same layout `sgdisk -a4096 -n1:0:+1024K`, `sgdisk -n2:0:+524288K` and `sgdisk -n3:0:0` produce.
+    """
+    table = PartitionTable(sector_size, total_sectors, [], pmbr_boot=pmbr_boot)
+    default_alignment = max(MiB // sector_size, 1)
+
+    lba = table.first_usable_lba
+    for number, type_guid, name, alignment, size, attributes in [
+        (1, BIOS_BOOT_GUID, "BIOS boot partition", 4096, 1024 * 1024, LEGACY_BIOS_BOOTABLE),
+        (2, EFI_SYSTEM_GUID, "EFI system partition", default_alignment, 524288 * 1024, 0),
+        (3, ZFS_GUID, "Solaris /usr & Mac ZFS", default_alignment, None, 0),
+    ]:
+        first_lba = (lba + alignment - 1) // alignment * alignment
+        if size is None:
+            last_lba = table.last_usable_lba
+        else:
+            last_lba = first_lba + size // sector_size - 1
+
+        if last_lba > table.last_usable_lba or last_lba < first_lba:
+            raise ValueError(f"Disk is too small to hold partition {number}")
+
+        table.partitions.append(Partition(number, type_guid, first_lba, last_lba, name, attributes))
+        lba = last_lba + 1
+
+    return table
+
+
+def write_boot_partition_table(device: str, pmbr_boot: bool, reread: bool = True) -> PartitionTable:
+    """
+    Lays out the TrueNAS boot disk partitions on `device` (a block device or a plain image file) in one pass and,
+    if `reread` is set, makes the kernel re-read the partition table.
+    """
+    fd = os.open(device, os.O_RDWR)
+    try:
+        sector_size, size = device_geometry(fd)
+        table = boot_disk_layout(sector_size, size // sector_size, pmbr_boot)
+        _write(fd, table)
+    finally:
+        os.close(fd)
+
+    if reread:
+        reread_partition_table(device)
+
+    return table
+
+
+def write_partition_table(device: str, table: PartitionTable):
+    """
+    Writes protective MBR, primary and backup GPT headers and partition entries for `table` to `device`.
+    """
+    fd = os.open(device, os.O_RDWR)
+    try:
+        _write(fd, table)
+    finally:
+        os.close(fd)
+
+
+def read_partition_table(device: str) -> PartitionTable | None:
+    """
+    Reads the GPT from `device`. Falls back to the backup header if the primary one is corrupt. Returns `None` if
+    neither is valid.
+    """
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        sector_size, size = device_geometry(fd)
+        total_sectors = size // sector_size
+        if total_sectors < 3:
+            return None
+
+        mbr = os.pread(fd, sector_size, 0)
+        pmbr_boot = False
+        if mbr[510:512] == b"\x55\xaa":
+            status, _, type_, _, _, _ = MBR_ENTRY.unpack_from(mbr, 446)
+            pmbr_boot = type_ == PROTECTIVE_MBR_TYPE and status == 0x80
+
+        for header_lba in [1, total_sectors - 1]:
+            if (table := _read(fd, sector_size, total_sectors, header_lba)) is not None:
+                table.pmbr_boot = pmbr_boot
+                return table
+    finally:
+        os.close(fd)
+
+    return None
+
+
+def reread_partition_table(device: str, tries=5):
+    """
+    Asks the kernel to re-read the partition table of `device`. Does nothing for plain image files.
+    """
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        if not stat.S_ISBLK(os.fstat(fd).st_mode):
+            return
+
+        for i in range(tries):
+            try:
+                fcntl.ioctl(fd, BLKRRPART)
+            except OSError as e:
+                # udev might still be probing the device after it was written
+                if e.errno == errno.EBUSY and i < tries - 1:
+                    time.sleep(0.2)
+                    continue
+
+                # The device does not support partitions (i.e. a loop device without partition scanning)
+                if e.errno == errno.EINVAL:
+                    return
+
+                raise
+            else:
+                break
+    finally:
+        os.close(fd)
+
+
+def device_geometry(fd) -> tuple[int, int]:
+    """
+    Returns `(logical sector size, size in bytes)` of the block device or the image file opened as `fd`.
+    """
+    if stat.S_ISBLK(os.fstat(fd).st_mode):
+        sector_size = struct.unpack("i", fcntl.ioctl(fd, BLKSSZGET, b"\0" * 4))[0]
+        size = struct.unpack("Q", fcntl.ioctl(fd, BLKGETSIZE64, b"\0" * 8))[0]
+        return sector_size, size
+    else:
+        return 512, os.fstat(fd).st_size
+
+
+def _write(fd, table):
+    sector_size = table.sector_size
+    entries = _entries(table)
+    entries_crc = zlib.crc32(entries)
+    backup_entries_lba = table.total_sectors - 1 - table.entries_sectors
+
+    primary = bytearray(table.first_usable_lba * sector_size)
+    primary[0:sector_size] = _protective_mbr(table)
+    primary[sector_size:2 * sector_size] = _header(table, 1, table.total_sectors - 1, 2, entries_crc)
+    primary[2 * sector_size:2 * sector_size + len(entries)] = entries
+
+    backup = bytearray((table.entries_sectors + 1) * sector_size)
+    backup[0:len(entries)] = entries
+    backup[-sector_size:] = _header(table, table.total_sectors - 1, 1, backup_entries_lba, entries_crc)
+
+    os.pwrite(fd, primary, 0)
+    os.pwrite(fd, backup, backup_entries_lba * sector_size)
+    os.fsync(fd)
+
+
+def _protective_mbr(table):
+    mbr = bytearray(table.sector_size)
+    mbr[446:446 + MBR_ENTRY.size] = MBR_ENTRY.pack(
+        0x80 if table.pmbr_boot else 0x00,
+        b"\x00\x02\x00",
+        PROTECTIVE_MBR_TYPE,
+        b"\xff\xff\xff",
+        1,
+        min(table.total_sectors - 1, 0xFFFFFFFF),
+    )
+    mbr[510:512] = b"\x55\xaa"
+    return mbr
+
+
+def _header(table, current_lba, backup_lba, entries_lba, entries_crc):
+    fields = [
+        SIGNATURE, REVISION, HEADER.size, 0, 0, current_lba, backup_lba, table.first_usable_lba,
+        table.last_usable_lba, table.disk_guid.bytes_le, entries_lba, NUM_ENTRIES, ENTRY.size, entries_crc,
+    ]
+    fields[3] = zlib.crc32(HEADER.pack(*fields))
+
+    header = bytearray(table.sector_size)
+    header[:HEADER.size] = HEADER.pack(*fields)
+    return header
+
+
+def _entries(table):
+    entries = bytearray(NUM_ENTRIES * ENTRY.size)
+    for partition in table.partitions:
+        ENTRY.pack_into(
+            entries,
+            (partition.number - 1) * ENTRY.size,
+            partition.type_guid.bytes_le,
+            partition.guid.bytes_le,
+            partition.first_lba,
+            partition.last_lba,
+            partition.attributes,
+            partition.name.encode("utf-16-le")[:72],
+        )
+
+    return entries
+
+
+def _read(fd, sector_size, total_sectors, header_lba):
+    header = os.pread(fd, sector_size, header_lba * sector_size)
+    if len(header) < HEADER.size:
+        return None
+
+    fields = list(HEADER.unpack_from(header))
+    (signature, _, header_size, header_crc, _, current_lba, _, _, _, disk_guid, entries_lba, num_entries,
+     entry_size, entries_crc) = fields
+    if signature != SIGNATURE or header_size != HEADER.size or current_lba != header_lba:
+        return None
+
+    fields[3] = 0
+    if zlib.crc32(HEADER.pack(*fields)) != header_crc:
+        return None
+
+    if entry_size != ENTRY.size:
+        return None
+
+    entries = os.pread(fd, num_entries * entry_size, entries_lba * sector_size)
+    if zlib.crc32(entries) != entries_crc:
+        return None
+
+    partitions = []
+    for number in range(1, num_entries + 1):
+        type_guid, guid, first_lba, last_lba, attributes, name = ENTRY.unpack_from(entries, (number - 1) * entry_size)
+        if type_guid == b"\0" * 16:
+            continue
+
+        partitions.append(Partition(
+            number,
+            uuid.UUID(bytes_le=type_guid),
+            first_lba,
+            last_lba,
+            name.decode("utf-16-le", "ignore").rstrip("\0"),
+            attributes,
+            uuid.UUID(bytes_le=guid),
+        ))
+
+    return PartitionTable(sector_size, total_sectors, partitions, uuid.UUID(bytes_le=disk_guid))
@@ -0,0 +1,297 @@
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable
+
+import aiohttp
+
+from .executor import host_path
+from .staging import image_stager
+from .trace import span
+from .verify import DEFAULT_CHUNK_SIZE, MANIFEST_SUFFIX, ImageVerificationError, load_manifest, verify_image
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["HTTPImageSource", "ImageSource", "LocalImageSource", "get_image_source", "set_image_source"]
+
+# Kernel command line parameter that makes PXE-booted installers download the update image
+CMDLINE_IMAGE_URL = "truenas_installer.image_url"
+# Where `HTTPImageSource` downloads the image to. Not `staging.STAGING_PATH`: the image stager may be copying the image
+# on the installation media there at the same time.
+DOWNLOAD_PATH = "/dev/shm/TrueNAS.download.update"
+HTTP_CONNECTIONS = 4
+HTTP_READ_SIZE = 1024 ** 2
+HTTP_RETRIES = 3
+
+
+class ImageSource(ABC):
+    """
+    Where the update image comes from.
+    """
+
+    @abstractmethod
+    async def image_path(self, callback: Callable | None = None) -> str:
+        """
+        Makes the image available locally and returns its path.
+        """
+
+    @abstractmethod
+    async def verify(self, callback: Callable):
+        """
+        Verifies the image against its manifest (if there is one). Raises `ImageVerificationError` if it is corrupt.
+        """
+
+
+class LocalImageSource(ImageSource):
+    """
+    The image on the installation media, staged into memory by `image_stager`.
+    """
+
+    def __init__(self, stager=image_stager):
+        self.stager = stager
+
+    async def image_path(self, callback=None):
+        return await self.stager.image_path()
+
+    async def verify(self, callback):
+        if (manifest := await asyncio.to_thread(load_manifest, host_path(self.stager.source))) is None:
+            return
+
+        image = await self.image_path()
+        callback(0, "Verifying installation image")
+        stop = threading.Event()
+        try:
+            with span("verify_image", "image", path=image):
+                await asyncio.to_thread(verify_image, image, manifest, None, stop)
+        finally:
+            stop.set()
+
+
+class HTTPImageSource(ImageSource):
+    """
+    Downloads the image from `url` into tmpfs. The image is fetched in ranges over `connections` parallel
+    connections. If there is a manifest next to the image (`url` + `MANIFEST_SUFFIX`), each range is one manifest
+    chunk, and it is hashed while it is being received and downloaded again if it does not match.
+
+    The image is downloaded once, by the first caller of `image_path` or `verify`.
+    """
+
+    def __init__(self, url: str, destination: str = DOWNLOAD_PATH, connections: int = HTTP_CONNECTIONS):
+        self.url = url
+        self.destination = destination
+        self.connections = connections
+        self.callbacks = []
+        self.task = None
+        self.downloaded = 0
+        self.size = 0
+
+    async def image_path(self, callback=None):
+        if callback is not None:
+            self.callbacks.append(callback)
+
+        # A failed download is started over
+        if self.task is None or (self.task.done() and (self.task.cancelled() or self.task.exception() is not None)):
+            self.task = asyncio.ensure_future(self._download())
+
+        try:
+            await asyncio.shield(self.task)
+        finally:
+            if callback is not None:
+                self.callbacks.remove(callback)
+
+        return host_path(self.destination)
+
+    async def verify(self, callback):
+        # Chunks are verified while they are being downloaded
+        await self.image_path(callback)
+
+    async def _download(self):
+        try:
+            await self._fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise OSError(f"Unable to download {self.url}: {e!r}") from e
+
+    async def _fetch(self):
+        async with aiohttp.ClientSession(raise_for_status=True) as session:
+            manifest = await self._manifest(session)
+
+            async with session.head(self.url) as response:
+                if (content_length := response.headers.get("Content-Length")) is None:
+                    raise OSError(f"Unable to download {self.url}: the server did not report the image size")
+
+                size = int(content_length)
+                ranges_supported = response.headers.get("Accept-Ranges") == "bytes"
+
+            if manifest is not None and manifest["size"] != size:
+                raise ImageVerificationError(f"Image size is {size} bytes, expected {manifest['size']} bytes")
+
+            destination = host_path(self.destination)
+            free = os.statvfs(os.path.dirname(destination))
+            if free.f_bavail * free.f_frsize < size:
+                raise OSError(f"Not enough space in {os.path.dirname(destination)} to download the image")
+
+            chunk_size = manifest["chunk_size"] if manifest is not None else DEFAULT_CHUNK_SIZE
+            self.size = size
+            if ranges_supported:
+                try:
+                    await self._fetch_ranges(session, destination, size, chunk_size, manifest)
+                    return
+                except _RangesIgnored:
+                    logger.warning("%r ignores the Range header, downloading it over a single connection", self.url)
+
+            await self._fetch_ranges(session, destination, size, None, manifest)
+
+    async def _fetch_ranges(self, session, destination, size, chunk_size, manifest):
+        # `chunk_size` is `None` if the image is fetched in a single request
+        if chunk_size is not None:
+            ranges = [(offset, min(offset + chunk_size, size)) for offset in range(0, size, chunk_size)]
+        else:
+            ranges = [(0, size)]
+
+        self.downloaded = 0
+        semaphore = asyncio.Semaphore(self.connections)
+        fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        tasks = []
+        try:
+            os.ftruncate(fd, size)
+            with span("download_image", "image", url=self.url, size=size, ranges=len(ranges)):
+                tasks = [
+                    asyncio.ensure_future(
+                        self._fetch_range(session, semaphore, fd, start, end, chunk_size is not None, manifest)
+                    )
+                    for start, end in ranges
+                ]
+                await asyncio.gather(*tasks)
+        except BaseException:
+            # Make sure no other range is still being written
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            os.close(fd)
+            os.unlink(destination)
+            raise
+        else:
+            os.close(fd)
+
+    async def _manifest(self, session):
+        try:
+            async with session.get(self.url + MANIFEST_SUFFIX) as response:
+                return await response.json(content_type=None)
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return None
+
+            raise
+
+    async def _fetch_range(self, session, semaphore, fd, start, end, ranges_supported, manifest):
+        async with semaphore:
+            for attempt in range(1, HTTP_RETRIES + 1):
+                received = 0
+                try:
+                    headers = {"Range": f"bytes={start}-{end - 1}"} if ranges_supported else {}
+                    async with session.get(self.url, headers=headers) as response:
+                        if ranges_supported and response.status != 206:
+                            # The server sends the whole image instead of the requested range
+                            raise _RangesIgnored()
+
+                        hashes = _ChunkHasher(manifest, start)
+                        async for data in response.content.iter_chunked(HTTP_READ_SIZE):
+                            if received + len(data) > end - start:
+                                raise ImageVerificationError(f"Received more data than requested at offset {start}")
+
+                            hashes.update(data)
+                            os.pwrite(fd, data, start + received)
+                            received += len(data)
+                            self._progress(len(data))
+
+                        if received != end - start:
+                            raise aiohttp.ClientPayloadError(f"Incomplete response at offset {start}")
+
+                        hashes.finish()
+                        return
+                except (aiohttp.ClientError, asyncio.TimeoutError, ImageVerificationError) as e:
+                    self._progress(-received)
+                    if attempt == HTTP_RETRIES:
+                        raise
+
+                    logger.warning("Error downloading %r at offset %d (attempt %d): %r", self.url, start, attempt, e)
+
+    def _progress(self, delta):
+        self.downloaded += delta
+        for callback in self.callbacks:
+            callback(self.downloaded / self.size, "Downloading installation image")
+
+
+class _RangesIgnored(Exception):
+    pass
+
+
+class _ChunkHasher:
+    """
+    Hashes the data received from `offset` on and compares the hashes with the manifest at each chunk boundary.
+    """
+
+    def __init__(self, manifest, offset):
+        self.manifest = manifest
+        self.offset = offset
+        self.hash = self._new()
+
+    def _new(self):
+        return hashlib.new(self.manifest["algorithm"]) if self.manifest is not None else None
+
+    def update(self, data):
+        if self.manifest is None:
+            return
+
+        chunk_size = self.manifest["chunk_size"]
+        while data:
+            remaining = chunk_size - self.offset % chunk_size
+            self.hash.update(data[:remaining])
+            self.offset += len(data[:remaining])
+            data = data[remaining:]
+            if self.offset % chunk_size == 0:
+                self._check(self.offset - chunk_size)
+
+    def finish(self):
+        if self.manifest is not None and self.offset % self.manifest["chunk_size"] != 0:
+            self._check(self.offset - self.offset % self.manifest["chunk_size"])
+
+    def _check(self, chunk_offset):
+        index = chunk_offset // self.manifest["chunk_size"]
+        if self.hash.hexdigest() != self.manifest["chunks"][index]:
+            raise ImageVerificationError(f"Corrupt chunk received at offset {chunk_offset}")
+
+        self.hash = self._new()
+
+
+_source = None
+
+
+def get_image_source() -> ImageSource:
+    """
+    Returns the current image source: the one set with `set_image_source`, `HTTPImageSource` if the
+    `truenas_installer.image_url` kernel command line parameter is present, otherwise `LocalImageSource`.
+    """
+    global _source
+
+    if _source is None:
+        _source = LocalImageSource()
+        try:
+            with open(host_path("/proc/cmdline")) as f:
+                for param in f.read().split():
+                    if param.startswith(f"{CMDLINE_IMAGE_URL}="):
+                        _source = HTTPImageSource(param.split("=", 1)[1])
+        except FileNotFoundError:
+            pass
+
+    return _source
+
+
+def set_image_source(source: ImageSource | None):
+    global _source
+
+    _source = source
@@ -0,0 +1,194 @@
+import asyncio
+from dataclasses import dataclass
+import functools
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Callable
+
+from .disks import Disk
+from .exception import InstallError
+from .executor import host_path
+from .install import (BOOT_POOL, MAX_CONCURRENT_DISKS, InstallerWorker, add_disk_stages, create_boot_pool,
+                      update_image_path, verify_update_image)
+from .installer_protocol import installer_supports
+from .lock import installation_lock
+from .preflight import check_surface
+from .serial import serial_sql
+from .stages import StageGraph
+from .trace import InstallTrace, span, tracing
+from .utils import get_partitions, run
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ImagingResult", "imaging_install"]
+
+
+@dataclass
+class ImagingResult:
+    # Name of the installation target, also the name the target's boot pool was imported under
+    name: str
+    disks: list[str]
+    error: str | None = None
+
+
+async def imaging_install(groups: list[list[Disk]], set_pmbr: bool, authentication: dict | None,
+                          post_install: dict | None, sql: str | None, callback: Callable) -> list[ImagingResult]:
+    """
+    Imaging station mode: installs the system to each group of disks independently and concurrently. Each group gets
+    its own boot pool that is imported under a temporary name and altroot, and exported at the end, so that the disks
+    can be moved to the systems they are meant for.
+
+    The update image is verified and mounted once for all the groups. `callback` is called with the target name
+    (see `ImagingResult`), progress and message. A failure of one group does not affect the others.
+    """
+    seen = set()
+    for disk in sum(groups, []):
+        if disk.name in seen:
+            raise InstallError(f"Disk {disk.name} is selected for multiple targets")
+
+        seen.add(disk.name)
+
+    with installation_lock:
+        trace = InstallTrace()
+
+        def traced_callback(target, progress, message):
+            trace.instant("progress", "progress", target=target, progress=progress, message=message)
+            callback(target, progress, message)
+
+        try:
+            with tracing(trace):
+                return await _imaging_install(groups, set_pmbr, authentication, post_install, sql, traced_callback)
+        finally:
+            try:
+                trace.write()
+            except OSError:
+                pass
+
+
+async def _imaging_install(groups, set_pmbr, authentication, post_install, sql, callback):
+    src = None
+    mounted = False
+
+    async def mount():
+        nonlocal src, mounted
+
+        src = tempfile.mkdtemp()
+        await run(["mount", await update_image_path(), src, "-t", "squashfs", "-o", "loop"])
+        mounted = True
+
+        # The boot pools are imported under temporary names, the installer must configure the system to boot from
+        # `BOOT_POOL` (the name the pools have on disk) instead
+        if not installer_supports(src, "boot_pool_name"):
+            raise InstallError("The installer on the installation media does not support imaging installations")
+
+    async def prepare():
+        if not os.path.exists(host_path("/etc/hostid")):
+            await run(["zgenhostid"])
+
+        await verify_update_image(lambda progress, message: None)
+        await asyncio.shield(mounted_image)
+        return {"src": src, "sql": await serial_sql() if sql is None else sql}
+
+    # Shared by all the targets, so that the image is only verified and mounted once
+    mounted_image = asyncio.ensure_future(mount())
+    prepared = asyncio.ensure_future(prepare())
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DISKS)
+
+    async def install_target(disks):
+        result = ImagingResult(f"{BOOT_POOL}-{'-'.join(disk.name for disk in disks)}", [disk.name for disk in disks])
+        try:
+            with span(result.name, "target"):
+                await _install_target(result.name, disks, set_pmbr, authentication, post_install,
+                                      functools.partial(callback, result.name), mounted_image, prepared,
+                                      semaphore)
+        except InstallError as e:
+            result.error = e.message
+            callback(result.name, 1, f"Error: {e.message}")
+        except Exception as e:
+            # The other targets keep installing from the shared image
+            logger.error("Unhandled exception installing %r", result.name, exc_info=True)
+            result.error = repr(e)
+            callback(result.name, 1, f"Error: {e!r}")
+        else:
+            callback(result.name, 1, "Installation completed")
+
+        return result
+
+    targets = [asyncio.ensure_future(install_target(disks)) for disks in groups]
+    try:
+        return await asyncio.gather(*targets)
+    finally:
+        # The image is only unmounted after every target stopped using it
+        for future in targets + [prepared, mounted_image]:
+            if not future.done():
+                future.cancel()
+
+        await asyncio.gather(*targets, prepared, mounted_image, return_exceptions=True)
+        if mounted:
+            await run(["umount", "-f", src])
+
+        if src is not None:
+            os.rmdir(src)
+
+
+async def _install_target(name, disks, set_pmbr, authentication, post_install, callback, mounted_image, prepared,
+                          semaphore):
+    graph = StageGraph()
+    worker = InstallerWorker(name)
+    altroot = tempfile.mkdtemp()
+    pool_created = False
+
+    async def check_installer():
+        await asyncio.shield(mounted_image)
+
+    async def prepare():
+        return await asyncio.shield(prepared)
+
+    async def check_disks():
+        await asyncio.gather(*[check_surface(disk, False, callback) for disk in disks])
+
+    async def find_partitions():
+        partitions = []
+        for disk in disks:
+            if (found := (await get_partitions(disk.device, [3]))[3]) is None:
+                raise InstallError(f"Failed to find data partition on {disk.name}")
+
+            partitions.append(found)
+
+        return partitions
+
+    async def create_pool():
+        nonlocal pool_created
+        callback(0, "Creating boot pool")
+        await create_boot_pool(graph.results["find_partitions"], name, altroot)
+        pool_created = True
+
+    async def install_system():
+        # `name` is only the in-core name of the pool, the installed system imports it as `BOOT_POOL`
+        await worker.run([disk.name for disk in disks], authentication, post_install, graph.results["prepare"]["sql"],
+                         callback, {"boot_pool_name": BOOT_POOL})
+
+    graph.add("prepare", prepare)
+    # Nothing is written to the disks unless the installer can complete the installation
+    graph.add("check_installer", check_installer)
+    graph.add("preflight", check_disks, ["check_installer"])
+    disk_stages = add_disk_stages(graph, disks, [], set_pmbr, callback, semaphore=semaphore, requires=["preflight"])
+    graph.add("find_partitions", find_partitions, disk_stages)
+    graph.add("create_boot_pool", create_pool, ["prepare", "find_partitions"])
+    graph.add("launch_installer", lambda: worker.start(graph.results["prepare"]["src"]), ["prepare"])
+    graph.add("run_installer", install_system, ["create_boot_pool", "launch_installer"])
+
+    try:
+        try:
+            await graph.run()
+        finally:
+            await worker.stop()
+            if pool_created:
+                with span("export_pool", "stage"):
+                    await run(["zpool", "export", "-f", name])
+
+            os.rmdir(altroot)
+    except subprocess.CalledProcessError as e:
+        raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
@@ -1,90 +1,553 @@
 import asyncio
+import errno
+import functools
 import json
 import os
+import re
 import subprocess
 import tempfile
 from typing import Callable
 
-from .disks import Disk
+from .disks import Disk, ZFSMember
 from .exception import InstallError
+from .executor import get_executor, host_path
+from .gpt import read_partition_table, write_boot_partition_table
+from .journal import InstallJournal
 from .lock import installation_lock
+from .preflight import check_surface
+from .serial import serial_sql
+from .stages import StageGraph
+from .image_source import get_image_source
+from .installer_protocol import INSTALLER_EXTENSIONS, installer_supports
+from .trace import InstallTrace, span, tracing
 from .utils import get_partitions, run
+from .verify import ImageVerificationError
+from .wipe import WipeReport, discard_device, discard_supported, wipe_signatures
 
-__all__ = ["InstallError", "install"]
+__all__ = ["InstallError", "PAYLOADS", "boot_pool_members", "conflicting_boot_pool_disks", "install", "upgrade"]
 
 BOOT_POOL = "boot-pool"
+# Maximum number of disks that are formatted or wiped at the same time
+MAX_CONCURRENT_DISKS = 4
+# Prebuilt boot environment (compressed `zfs send` stream) shipped next to the update image
+STREAM_PATH = "/cdrom/TrueNAS.zfs.zst"
+STREAM_DECOMPRESSORS = {
+    ".gz": ["gzip", "-dc"],
+    ".xz": ["xz", "-dc"],
+    ".zst": ["zstd", "-dc"],
+}
+STREAM_CHUNK_SIZE = 1024 ** 2
+PAYLOADS = ["image", "stream"]
 
 
 async def install(destination_disks: list[Disk], wipe_disks: list[Disk], set_pmbr: bool, authentication: dict | None,
-                  post_install: dict | None, sql: str | None, callback: Callable):
+                  post_install: dict | None, sql: str | None, callback: Callable, wipe_mode: str = "signatures",
+                  resume: bool = False, payload: str = "image", preflight: str = "read"):
+    """
+    Installs the system. If `sql` is `None`, serial console settings are detected and saved to the installed system.
+
+    Before anything is written, the destination disks are checked (`preflight`, see `PREFLIGHT_MODES`) so that a
+    failing disk is rejected in seconds rather than halfway through the installation. Resumed installations are not
+    checked again.
+
+    If `payload` is `stream`, the boot environment is received from the `zfs send` stream at `STREAM_PATH` instead
+    of being copied file by file from the update image, `truenas_install` only performs the post-install steps.
+
+    If `resume` is `True`, continues the last failed installation: the disks are not formatted again and the existing
+    boot pool is re-imported, only the stages that did not complete are run. `destination_disks` must be the same as
+    in the failed installation, its `set_pmbr` and `wipe_mode` are used.
+    """
     with installation_lock:
+        if resume:
+            journal = await load_resumable_journal(destination_disks)
+        else:
+            InstallJournal.remove()
+            journal = InstallJournal([disk.name for disk in destination_disks], [disk.name for disk in wipe_disks],
+                                     set_pmbr, wipe_mode)
+
         try:
-            if not os.path.exists("/etc/hostid"):
-                await run(["zgenhostid"])
-
-            for disk in destination_disks:
-                callback(0, f"Formatting disk {disk.name}")
-                await format_disk(disk, set_pmbr, callback)
-
-            for disk in wipe_disks:
-                callback(0, f"Wiping disk {disk.name}")
-                await wipe_disk(disk, callback)
-
-            disk_parts = list()
-            part_num = 3
-            for disk in destination_disks:
-                found = (await get_partitions(disk.device, [part_num]))[part_num]
-                if found is None:
-                    raise InstallError(f"Failed to find data partition on {disk.name}")
-                else:
-                    disk_parts.append(found)
+            await _traced(callback, functools.partial(
+                _install, destination_disks, wipe_disks, journal.set_pmbr, authentication, post_install, sql,
+                wipe_mode=journal.wipe_mode, journal=journal, resume=resume, payload=payload, preflight=preflight,
+            ))
+        except InstallError as e:
+            if journal.completed:
+                journal.error = e.message
+                journal.save()
+
+            raise
+        else:
+            InstallJournal.remove()
+
+
+async def upgrade(disks: list[Disk], version: str, post_install: dict | None, sql: str | None, callback: Callable):
+    """
+    Upgrades the system installed on `disks`: imports their existing boot pool and installs `version` into a new
+    boot environment next to the existing ones (so it is possible to roll back to them). The disks are not
+    partitioned and the boot pool is not re-created. The configuration is migrated from the active boot environment.
+    """
+    for disk in disks:
+        if not boot_pool_members(disk):
+            raise InstallError(f"Disk {disk.name} does not contain a {BOOT_POOL}")
+
+    # Stale boot pools (i.e. from a disk that was once a part of another system) have a different GUID
+    if len({zfs_member.pool_guid for disk in disks for zfs_member in boot_pool_members(disk)} - {None}) > 1:
+        raise InstallError(f"Disks {', '.join(disk.name for disk in disks)} contain different {BOOT_POOL}s")
+
+    with installation_lock:
+        await _traced(callback, functools.partial(_upgrade, disks, version, post_install, sql))
+
+
+def boot_pool_members(disk: Disk) -> list[ZFSMember]:
+    # Destroyed pools are never imported
+    return [zfs_member for zfs_member in disk.zfs_members
+            if zfs_member.pool == BOOT_POOL and zfs_member.state != "destroyed"]
+
+
+def conflicting_boot_pool_disks(disks: list[Disk], destination_disks: list[str]) -> list[Disk]:
+    """
+    Returns the disks that are not in `destination_disks` but contain a `boot-pool`. The presence of multiple
+    `boot-pool`s with different GUIDs leads to boot pool import error, so these disks have to be wiped.
+    """
+    return [disk for disk in disks if disk.name not in destination_disks and boot_pool_members(disk)]
+
+
+async def _traced(callback, fn):
+    trace = InstallTrace()
+
+    def traced_callback(progress, message):
+        trace.instant("progress", "progress", progress=progress, message=message)
+        callback(progress, message)
+
+    try:
+        with tracing(trace):
+            await fn(callback=traced_callback)
+    finally:
+        try:
+            trace.write()
+        except OSError:
+            pass
+
+
+async def load_resumable_journal(destination_disks: list[Disk]) -> InstallJournal:
+    """
+    Loads the journal of the last failed installation and checks that it can be resumed on `destination_disks`.
+    """
+    if (journal := InstallJournal.load()) is None or not journal.resumable:
+        raise InstallError("There is no failed installation to resume")
+
+    if journal.disks != [disk.name for disk in destination_disks]:
+        raise InstallError(f"The failed installation was performed on {', '.join(journal.disks)}")
+
+    for disk in destination_disks:
+        if (guid := journal.partition_guids.get(disk.name)) is None:
+            continue
+
+        table = await asyncio.to_thread(read_partition_table, disk.device)
+        if table is None or guid not in [str(partition.guid) for partition in table.partitions]:
+            raise InstallError(f"Disk {disk.name} was modified after the failed installation, unable to resume it")
+
+    return journal
+
+
+async def _install(destination_disks, wipe_disks, set_pmbr, authentication, post_install, sql, *, callback,
+                   wipe_mode, journal, resume, payload, preflight):
+    graph = StageGraph(journal.stage_completed)
+    worker = InstallerWorker()
+
+    async def hostid():
+        if not os.path.exists(host_path("/etc/hostid")):
+            await run(["zgenhostid"])
+
+    async def serial():
+        # If the installer was booted with serial mode enabled, we should save these values to the installed system
+        return await serial_sql() if sql is None else sql
+
+    async def check_disks():
+        await asyncio.gather(*[check_surface(disk, preflight == "write", callback) for disk in destination_disks])
+
+    async def find_partitions():
+        disk_parts = list()
+        part_num = 3
+        for disk in destination_disks:
+            found = (await get_partitions(disk.device, [part_num]))[part_num]
+            if found is None:
+                raise InstallError(f"Failed to find data partition on {disk.name}")
+            else:
+                disk_parts.append(found)
+
+        return disk_parts
+
+    async def create_pool():
+        callback(0, "Creating boot pool")
+        await create_boot_pool(graph.results["find_partitions"])
+        journal.pool_state = "created"
+        journal.pool_guid = (await run(["zpool", "get", "-H", "-o", "value", "guid", BOOT_POOL])).stdout.strip()
+
+    async def import_pool():
+        callback(0, "Importing boot pool")
+        # There might be other (i.e. previously installed) pools with the same name, so import by GUID if possible
+        await import_boot_pool(journal.pool_guid or BOOT_POOL)
+        journal.pool_state = "imported"
+        # Remove the boot environments that the failed `truenas_install` has left behind
+        await destroy_boot_environments()
+
+    async def check_installer():
+        # An installer that does not support `skip_copy` would copy the update image over the received dataset
+        if not worker.supports("skip_copy"):
+            raise InstallError("The installer on the installation media does not support `payload: stream`")
+
+        if not os.path.exists(host_path(STREAM_PATH)):
+            raise InstallError(f"The installation media does not contain the boot environment stream {STREAM_PATH}")
+
+    async def receive():
+        callback(0, "Receiving boot environment")
+        try:
+            dataset = await receive_stream(host_path(STREAM_PATH), f"{BOOT_POOL}/ROOT", callback)
+        except OSError as e:
+            raise InstallError(f"Unable to receive the boot environment: {e}")
+
+        await run(["zpool", "set", f"bootfs={dataset}", BOOT_POOL])
+        return dataset
+
+    async def install_system():
+        await worker.run(
+            [disk.name for disk in destination_disks],
+            authentication,
+            post_install,
+            graph.results["serial"],
+            callback,
+            {"dataset_name": graph.results["receive_stream"], "skip_copy": True} if payload == "stream" else None,
+        )
+
+    graph.add("hostid", hostid)
+    graph.add("serial", serial)
+    # The image is verified and `truenas_install` is launched while the disks are being formatted
+    graph.add("verify_image", functools.partial(verify_update_image, callback))
+    graph.add("launch_installer", worker.start)
+    disk_stages_requires = []
+    if preflight != "none" and not resume:
+        # Nothing is destroyed until all the destination disks have passed the check. A resumed installation has
+        # already passed it, and checking again (in write mode) would overwrite the boot pool it is about to import
+        graph.add("preflight", check_disks)
+        disk_stages_requires.append("preflight")
+
+    if payload == "stream":
+        # Nothing is destroyed unless the installer can complete the installation
+        graph.add("check_installer", check_installer, ["launch_installer"])
+        disk_stages_requires.append("check_installer")
+
+    disk_stages = add_disk_stages(graph, destination_disks, wipe_disks, set_pmbr, callback, wipe_mode,
+                                  requires=disk_stages_requires)
+    graph.add("find_partitions", find_partitions, [f"format {disk.name}" for disk in destination_disks])
+    graph.add("create_boot_pool", create_pool, ["hostid", "verify_image", "find_partitions"] + disk_stages)
+    run_installer_requires = ["create_boot_pool", "launch_installer", "serial"]
+    if payload == "stream":
+        graph.add("receive_stream", receive, ["create_boot_pool"])
+        run_installer_requires.append("receive_stream")
+
+    if resume:
+        for name, result in journal.completed.items():
+            if name in graph.stages:
+                graph.restore(name, result)
+
+        if "create_boot_pool" in journal.completed:
+            graph.add("import_boot_pool", import_pool)
+            run_installer_requires.append("import_boot_pool")
+            if payload == "stream":
+                graph.stages["receive_stream"].requires.append("import_boot_pool")
+
+    graph.add("run_installer", install_system, run_installer_requires)
+
+    try:
+        try:
+            await graph.run()
+        finally:
+            await worker.stop()
+            if journal.pool_state in ("created", "imported"):
+                with span("export_pool", "stage"):
+                    await run(["zpool", "export", "-f", BOOT_POOL])
+                    journal.pool_state = "exported"
+    except subprocess.CalledProcessError as e:
+        raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
+
+
+async def _upgrade(disks, version, post_install, sql, *, callback):
+    graph = StageGraph()
+    worker = InstallerWorker()
+    dataset = f"{BOOT_POOL}/ROOT/{version}"
+    state = {"imported": False, "created": False, "old_root": None}
+
+    async def serial():
+        return await serial_sql() if sql is None else sql
+
+    async def import_pool():
+        callback(0, "Importing boot pool")
+        # Only look for the pool on the selected disks, other disks might contain other boot pools
+        await import_boot_pool(BOOT_POOL, [host_path(f"/dev/{zfs_member.name}")
+                                           for disk in disks for zfs_member in boot_pool_members(disk)])
+        state["imported"] = True
+
+    async def create_boot_environment():
+        if (await run(["zfs", "list", "-H", "-o", "name", dataset], check=False)).returncode == 0:
+            raise InstallError(f"Boot environment {version} already exists")
+
+        await run(["zfs", "create", "-o", "mountpoint=legacy", "-o", "canmount=noauto", dataset])
+        state["created"] = True
+
+    async def mount_old_root():
+        # The configuration is migrated from the currently active boot environment
+        bootfs = (await run(["zpool", "get", "-H", "-o", "value", "bootfs", BOOT_POOL])).stdout.strip()
+        if bootfs in ("", "-"):
+            raise InstallError(f"{BOOT_POOL} does not have an active boot environment")
+
+        old_root = tempfile.mkdtemp()
+        try:
+            await run(["mount", "-t", "zfs", "-o", "ro", bootfs, old_root])
+        except subprocess.CalledProcessError:
+            os.rmdir(old_root)
+            raise
+
+        state["old_root"] = old_root
+
+    async def check_installer():
+        # An installer that does not support `upgrade` would install a fresh system into the new boot environment
+        if not worker.supports("upgrade"):
+            raise InstallError("The installer on the installation media does not support upgrades")
 
-            callback(0, "Creating boot pool")
-            await create_boot_pool(disk_parts)
-            try:
-                await run_installer(
-                    [disk.name for disk in destination_disks],
-                    authentication,
-                    post_install,
-                    sql,
-                    callback,
-                )
-            finally:
-                await run(["zpool", "export", "-f", BOOT_POOL])
-        except subprocess.CalledProcessError as e:
-            raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
+    async def install_system():
+        await worker.run(
+            [disk.name for disk in disks],
+            None,
+            post_install,
+            graph.results["serial"],
+            callback,
+            {"dataset_name": dataset, "old_root": state["old_root"], "upgrade": True},
+        )
 
+    graph.add("serial", serial)
+    graph.add("verify_image", functools.partial(verify_update_image, callback))
+    graph.add("launch_installer", worker.start)
+    graph.add("import_boot_pool", import_pool)
+    graph.add("check_installer", check_installer, ["launch_installer"])
+    graph.add("create_boot_environment", create_boot_environment,
+              ["import_boot_pool", "verify_image", "check_installer"])
+    graph.add("mount_old_root", mount_old_root, ["import_boot_pool"])
+    graph.add("run_installer", install_system,
+              ["create_boot_environment", "mount_old_root", "launch_installer", "serial"])
 
-async def wipe_disk(disk: Disk, callback: Callable):
-    for zfs_member in disk.zfs_members:
-        if (result := await run(["zpool", "labelclear", "-f", f"/dev/{zfs_member.name}"],
-                                check=False)).returncode != 0:
-            callback(0, f"Warning: unable to wipe ZFS label from {zfs_member.name}: {result.stderr.rstrip()}")
-        pass
+    try:
+        try:
+            await graph.run()
+        finally:
+            await worker.stop()
+            if state["old_root"] is not None:
+                await run(["umount", "-f", state["old_root"]])
+                os.rmdir(state["old_root"])
+
+            if state["created"] and "run_installer" not in graph.completed:
+                # Leave the existing boot environments exactly as they were
+                await run(["zfs", "destroy", "-r", dataset])
+
+            if state["imported"]:
+                with span("export_pool", "stage"):
+                    await run(["zpool", "export", "-f", BOOT_POOL])
+    except subprocess.CalledProcessError as e:
+        raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
+
+
+async def receive_stream(path: str, target: str, callback: Callable) -> str:
+    """
+    Receives the `zfs send` stream at `path` (compressed according to its extension, see `STREAM_DECOMPRESSORS`)
+    under `target` dataset, keeping the last component of the sent dataset name. Progress is reported by the stream
+    bytes consumed. Returns the name of the received dataset.
+    """
+    executor = get_executor()
+    total = os.path.getsize(path)
+    decompress = STREAM_DECOMPRESSORS.get(os.path.splitext(path)[1])
+
+    with span("zfs_recv", "command", path=path, stream_bytes=total) as trace_args:
+        processes = [await executor.spawn(
+            ["zfs", "recv", "-v", "-u", "-e", "-o", "mountpoint=legacy", "-o", "canmount=noauto", target], "/",
+        )]
+        if decompress is not None:
+            processes.insert(0, await executor.spawn(decompress, "/", merge_stderr=False))
+
+        async def feed():
+            sink = processes[0].stdin
+            received = 0
+            percent = -1
+            with open(path, "rb") as f:
+                while chunk := await asyncio.to_thread(f.read, STREAM_CHUNK_SIZE):
+                    sink.write(chunk)
+                    await sink.drain()
+                    received += len(chunk)
+                    if (new_percent := received * 100 // total) != percent:
+                        percent = new_percent
+                        callback(received / total, "Receiving boot environment")
+
+            sink.close()
+
+        async def relay():
+            # The decompressed stream is piped from the decompressor into `zfs recv`
+            while chunk := await processes[0].stdout.read(STREAM_CHUNK_SIZE):
+                processes[1].stdin.write(chunk)
+                await processes[1].stdin.drain()
+
+            processes[1].stdin.close()
+
+        async def collect(process):
+            return await (process.stdout if process is processes[-1] else process.stderr).read()
+
+        outputs = asyncio.gather(*[collect(process) for process in processes])
+        copy = [asyncio.ensure_future(feed())] + ([asyncio.ensure_future(relay())] if decompress is not None else [])
+        try:
+            await asyncio.gather(*copy)
+        except BaseException as e:
+            for task in copy:
+                task.cancel()
+
+            await asyncio.gather(*copy, return_exceptions=True)
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+
+            # If one of the processes has failed, its error is reported below
+            if not isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                await asyncio.gather(outputs, *[process.wait() for process in processes], return_exceptions=True)
+                raise
+
+        outputs = [output.decode("utf-8", "ignore") for output in await outputs]
+        for process in processes:
+            await process.wait()
+
+        trace_args.update(returncodes=[process.returncode for process in processes])
+
+    # Processes that were killed because the other one has failed (returncode < 0) are reported last
+    if failed := sorted([(process.returncode < 0, output) for process, output in zip(processes, outputs)
+                         if process.returncode != 0], key=lambda failure: failure[0]):
+        raise InstallError(f"Failed to receive boot environment: {failed[0][1].strip()}")
+
+    if (match := re.search(r" into (\S+)@", outputs[-1])) is None:
+        raise InstallError(f"Unexpected zfs recv output: {outputs[-1].strip()}")
+
+    return match.group(1)
+
+
+async def verify_update_image(callback: Callable):
+    """
+    Verifies the update image against the manifest shipped next to it. Does nothing if there is no manifest.
+    """
+    try:
+        await get_image_source().verify(callback)
+    except ImageVerificationError as e:
+        raise InstallError(f"Installation image is corrupt: {e}")
+    except OSError as e:
+        raise InstallError(f"Unable to verify installation image: {e}")
+
+
+async def update_image_path(callback: Callable | None = None) -> str:
+    """
+    Returns the local path of the update image, downloading it first if it comes from the network.
+    """
+    try:
+        return await get_image_source().image_path(callback)
+    except ImageVerificationError as e:
+        raise InstallError(f"Installation image is corrupt: {e}")
+    except OSError as e:
+        raise InstallError(f"Unable to get installation image: {e}")
+
+
+def add_disk_stages(graph: StageGraph, destination_disks: list[Disk], wipe_disks: list[Disk], set_pmbr: bool,
+                    callback: Callable, wipe_mode: str = "signatures", semaphore: asyncio.Semaphore | None = None,
+                    requires: list[str] = ()) -> list[str]:
+    """
+    Adds a `format <disk>` stage for each of `destination_disks` and a `wipe <disk>` stage for each of `wipe_disks`
+    to `graph`, all of them requiring the `requires` stages. At most `MAX_CONCURRENT_DISKS` disks (or as many as
+    `semaphore` allows) are processed at the same time. Returns the names of the added stages.
+    """
+    semaphore = semaphore or asyncio.Semaphore(MAX_CONCURRENT_DISKS)
+
+    async def format_one(disk):
+        async with semaphore:
+            callback(0, f"Formatting disk {disk.name}")
+            return await format_disk(disk, set_pmbr, callback, wipe_mode)
+
+    async def wipe_one(disk):
+        async with semaphore:
+            callback(0, f"Wiping disk {disk.name}")
+            await wipe_disk(disk, callback, wipe_mode=wipe_mode)
+
+    stages = []
+    for prefix, disks, fn in [("format", destination_disks, format_one), ("wipe", wipe_disks, wipe_one)]:
+        for disk in disks:
+            graph.add(f"{prefix} {disk.name}", functools.partial(fn, disk), requires)
+            stages.append(f"{prefix} {disk.name}")
 
-    if (result := await run(["wipefs", "-a", disk.device], check=False)).returncode != 0:
-        callback(0, f"Warning: unable to wipe partition table for {disk.name}: {result.stderr.rstrip()}")
+    return stages
 
-    await run(["sgdisk", "-Z", disk.device], check=False)
 
+async def wipe_disk(disk: Disk, callback: Callable, reread: bool = True,
+                    wipe_mode: str = "signatures") -> WipeReport | None:
+    if wipe_mode in ("discard", "secure_discard"):
+        await discard_disk(disk, wipe_mode == "secure_discard", callback)
 
-async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable):
-    await wipe_disk(disk, callback)
+    try:
+        with span("wipe_signatures", "disk", disk=disk.name) as args:
+            report = await asyncio.to_thread(wipe_signatures, disk.device)
+            args["bytes_wiped"] = report.bytes_wiped
 
-    # Create BIOS boot partition
-    await run(["sgdisk", "-a4096", "-n1:0:+1024K", "-t1:EF02", "-A1:set:2", disk.device])
+        if reread:
+            await asyncio.to_thread(get_executor().reread_partition_table, disk.device)
 
-    # Create EFI partition (Even if not used, allows user to switch to UEFI later)
-    await run(["sgdisk", "-n2:0:+524288K", "-t2:EF00", disk.device])
+        return report
+    except OSError as e:
+        callback(0, f"Warning: unable to wipe {disk.name}: {e}")
 
-    # Create data partition
-    await run(["sgdisk", "-n3:0:0", "-t3:BF01", disk.device])
+
+async def discard_disk(disk: Disk, secure: bool, callback: Callable):
+    loop = asyncio.get_running_loop()
+
+    def progress(fraction):
+        loop.call_soon_threadsafe(callback, fraction, f"Discarding disk {disk.name}")
+
+    # Zeroing a whole disk that can not discard would take hours on a large HDD, so such disks only have their
+    # signatures erased
+    if not discard_supported(disk.device):
+        callback(0, f"Disk {disk.name} does not support discard, only erasing its signatures")
+        return
+
+    try:
+        with span("discard_disk", "disk", disk=disk.name) as args:
+            args["method"] = await asyncio.to_thread(discard_device, disk.device, secure, progress, False)
+    except OSError as e:
+        if e.errno == errno.EOPNOTSUPP:
+            callback(0, f"Disk {disk.name} rejected discard, only erasing its signatures")
+            return
+
+        raise InstallError(f"Failed to discard {disk.name}: {e}")
+
+
+async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable, wipe_mode: str = "signatures") -> str:
+    """
+    Partitions `disk` for the boot pool. Returns the GUID of the data partition.
+    """
+    # Writing the new partition table makes the kernel re-read it anyway
+    await wipe_disk(disk, callback, reread=False, wipe_mode=wipe_mode)
+
+    # Create BIOS boot, EFI (even if not used, allows user to switch to UEFI later) and data partitions, all in a
+    # single partition table write
+    try:
+        with span("write_partition_table", "disk", disk=disk.name):
+            table = await asyncio.to_thread(write_boot_partition_table, disk.device, set_pmbr, False)
+            await asyncio.to_thread(get_executor().reread_partition_table, disk.device)
+    except (OSError, ValueError) as e:
+        raise InstallError(f"Failed to partition {disk.name}: {e}")
 
     # Bad hardware is bad, but we've seen a few users
-    # state that by the time we run `parted` command
-    # down below OR the caller of this function tries
-    # to do something with the partition(s), they won't
-    # be present. This is almost _exclusively_ related
+    # state that by the time the caller of this function
+    # tries to do something with the partition(s), they
+    # won't be present. This is almost _exclusively_ related
     # to bad hardware, but we will wait up to 30 seconds
     # for the partitions to show up in sysfs.
     disk_parts = await get_partitions(disk.device, [1, 2, 3], tries=30)
@@ -92,14 +555,22 @@ async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable):
         if part_device is None:
             raise InstallError(f"Failed to find partition number {partnum} on {disk.name}")
 
-    if set_pmbr:
-        await run(["parted", "-s", disk.device, "disk_set", "pmbr_boot", "on"], check=False)
+    return str(table.partitions[-1].guid)
 
 
-async def create_boot_pool(devices):
+async def create_boot_pool(devices, temp_name: str | None = None, altroot: str | None = None):
+    """
+    Creates the boot pool on `devices`. If `temp_name` is specified, the pool is named `BOOT_POOL` on disk, but is
+    imported as `temp_name` (so that multiple boot pools can exist on the same system).
+    """
+    pool = temp_name or BOOT_POOL
     await run(
         [
             "zpool", "create", "-f",
+        ] +
+        (["-t", temp_name] if temp_name is not None else []) +
+        (["-R", altroot] if altroot is not None else []) +
+        [
             "-o", "ashift=12",
             "-o", "cachefile=none",
             "-o", "compatibility=grub2",
@@ -116,39 +587,99 @@ async def create_boot_pool(devices):
         (["mirror"] if len(devices) > 1 else []) +
         devices
     )
-    await run(["zfs", "create", "-o", "canmount=off", f"{BOOT_POOL}/ROOT"])
-    await run(["zfs", "create", "-o", "canmount=off", "-o", "mountpoint=legacy", f"{BOOT_POOL}/grub"])
+    await run(["zfs", "create", "-o", "canmount=off", f"{pool}/ROOT"])
+    await run(["zfs", "create", "-o", "canmount=off", "-o", "mountpoint=legacy", f"{pool}/grub"])
+
+
+async def import_boot_pool(pool: str = BOOT_POOL, devices: list[str] = ()):
+    """
+    Imports the boot pool by name or GUID, unless it is already imported. If `devices` are specified, the pool is
+    only searched for on them.
+    """
+    if (await run(["zpool", "list", "-H", "-o", "name", BOOT_POOL], check=False)).returncode == 0:
+        return
+
+    await run(["zpool", "import", "-f", "-N"] + sum([["-d", device] for device in devices], []) + [pool])
+
+
+async def destroy_boot_environments():
+    datasets = (await run(["zfs", "list", "-H", "-o", "name", "-d", "1", f"{BOOT_POOL}/ROOT"])).stdout.split()
+    for dataset in datasets:
+        if dataset != f"{BOOT_POOL}/ROOT":
+            await run(["zfs", "destroy", "-r", dataset])
 
 
 async def run_installer(disks, authentication, post_install, sql, callback):
-    with tempfile.TemporaryDirectory() as src:
-        await run(["mount", "/cdrom/TrueNAS.update", src, "-t", "squashfs", "-o", "loop"])
-        try:
-            params = {
-                "authentication_method": authentication,
-                "disks": disks,
-                "json": True,
-                "pool_name": BOOT_POOL,
-                "post_install": post_install,
-                "sql": sql,
-                "src": src,
-            }
-            process = await asyncio.create_subprocess_exec(
-                "python3", "-m", "truenas_install",
-                cwd=src,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
+    worker = InstallerWorker()
+    try:
+        await worker.start()
+        await worker.run(disks, authentication, post_install, sql, callback)
+    finally:
+        await worker.stop()
+
+
+class InstallerWorker:
+    """
+    Mounts the update image and launches `truenas_install` from it. The process imports itself and then waits for
+    the installation parameters on stdin, so it can be started early (while the disks are still being formatted)
+    and be handed the parameters as soon as the boot pool exists.
+    """
+
+    def __init__(self, pool_name=BOOT_POOL):
+        self.pool_name = pool_name
+        self.src = None
+        self.own_src = False
+        self.mounted = False
+        self.process = None
+
+    async def start(self, src: str | None = None):
+        """
+        Mounts the update image and launches `truenas_install`. If `src` is specified, the image already mounted
+        there is used instead (and is not unmounted by `stop`).
+        """
+        if src is None:
+            self.src = tempfile.mkdtemp()
+            self.own_src = True
+            await run(["mount", await update_image_path(), self.src, "-t", "squashfs", "-o", "loop"])
+            self.mounted = True
+        else:
+            self.src = src
+
+        self.process = await get_executor().spawn(["python3", "-m", "truenas_install"], self.src)
+
+    async def run(self, disks, authentication, post_install, sql, callback, extra_params: dict | None = None):
+        """
+        Hands the parameters to `truenas_install` (see `INSTALLER_PARAMS_SCHEMA`) and waits for it to complete.
+        Raises `InstallError` if `extra_params` contain an extension the installer of the update image does not
+        support.
+        """
+        for parameter in INSTALLER_EXTENSIONS:
+            if parameter in (extra_params or {}) and not self.supports(parameter):
+                raise InstallError(f"The installer on the installation media does not support `{parameter}`")
+
+        params = {
+            "authentication_method": authentication,
+            "disks": disks,
+            "json": True,
+            "pool_name": self.pool_name,
+            "post_install": post_install,
+            "sql": sql,
+            "src": self.src,
+            **(extra_params or {}),
+        }
+        process = self.process
+        with span("truenas_install", "command", argv=["python3", "-m", "truenas_install"]) as trace_args:
             process.stdin.write(json.dumps(params).encode("utf-8"))
             process.stdin.close()
             error = None
             stderr = ""
+            output_bytes = 0
             while True:
                 line = await process.stdout.readline()
                 if not line:
                     break
 
+                output_bytes += len(line)
                 line = line.decode("utf-8", "ignore")
 
                 try:
@@ -164,12 +695,36 @@ async def run_installer(disks, authentication, post_install, sql, callback):
                         raise ValueError(f"Invalid truenas_install JSON: {data!r}")
             await process.wait()
 
-            if error is not None:
-                result = error
-            else:
-                result = stderr
+            trace_args.update(returncode=process.returncode, stdout_bytes=output_bytes)
 
-            if process.returncode != 0:
-                raise InstallError(result or f"Abnormal installer process termination with code {process.returncode}")
-        finally:
-            await run(["umount", "-f", src])
+        if error is not None:
+            result = error
+        else:
+            result = stderr
+
+        if process.returncode != 0:
+            raise InstallError(result or f"Abnormal installer process termination with code {process.returncode}")
+
+    def supports(self, parameter: str) -> bool:
+        """
+        Returns `True` if the launched `truenas_install` supports the extension `parameter`.
+        """
+        return installer_supports(self.src, parameter)
+
+    async def stop(self):
+        """
+        Kills the process if it is still running (i.e. the installation was cancelled) and unmounts the image.
+        """
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+        if self.mounted:
+            await run(["umount", "-f", self.src])
+            self.mounted = False
+
+        if self.own_src:
+            os.rmdir(self.src)
+            self.own_src = False
+
+        self.src = None
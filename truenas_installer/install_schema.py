@@ -0,0 +1,88 @@
+from .install import PAYLOADS
+from .preflight import PREFLIGHT_MODES
+from .wipe import WIPE_MODES
+
+__all__ = ["AUTHENTICATION_SCHEMA", "INSTALL_SCHEMA", "POST_INSTALL_SCHEMA"]
+
+AUTHENTICATION_SCHEMA = {
+    "type": ["object", "null"],
+    "required": ["username", "password"],
+    "additionalProperties": False,
+    "properties": {
+        "username": {
+            "type": "string",
+            "enum": ["truenas_admin", "root"],
+        },
+        "password": {
+            "type": "string",
+            "minLength": 6,
+        },
+    },
+}
+
+POST_INSTALL_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "network_interfaces": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name"],
+                "additionalProperties": False,
+                "properties": {
+                    "name": {"type": "string"},
+                    "aliases": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["type", "address", "netmask"],
+                            "additionalProperties": False,
+                            "properties": {
+                                "type": {"type": "string"},
+                                "address": {"type": "string"},
+                                "netmask": {"type": "integer"},
+                            },
+                        },
+                    },
+                    "ipv4_dhcp": {"type": "boolean"},
+                    "ipv6_auto": {"type": "boolean"},
+                },
+            },
+        },
+    },
+}
+
+
+INSTALL_SCHEMA = {
+    "type": "object",
+    "required": ["disks", "set_pmbr", "authentication"],
+    "additionalProperties": False,
+    "properties": {
+        "wipe_disks": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "disks": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "set_pmbr": {"type": "boolean"},
+        "wipe_mode": {
+            "type": "string",
+            "enum": WIPE_MODES,
+        },
+        "resume": {"type": "boolean"},
+        "upgrade": {"type": "boolean"},
+        "payload": {
+            "type": "string",
+            "enum": PAYLOADS,
+        },
+        "preflight": {
+            "type": "string",
+            "enum": PREFLIGHT_MODES,
+        },
+        "authentication": AUTHENTICATION_SCHEMA,
+        "post_install": POST_INSTALL_SCHEMA,
+    },
+}
@@ -7,8 +7,11 @@ import humanfriendly
 from .dialog import dialog_checklist, dialog_menu, dialog_msgbox, dialog_password, dialog_yesno
 from .disks import Disk, list_disks
 from .exception import InstallError
-from .install import install
-from .serial import serial_sql
+from .install import boot_pool_members, conflicting_boot_pool_disks, install, upgrade
+from .journal import InstallJournal
+from .probe import recommend_boot_disks
+from .staging import image_stager
+from .wipe import discard_supported
 
 
 class InstallerMenu:
@@ -16,6 +19,7 @@ class InstallerMenu:
         self.installer = installer
 
     async def run(self):
+        image_stager.start()
         await self._main_menu()
 
     async def _main_menu(self):
@@ -42,6 +46,29 @@ class InstallerMenu:
             await dialog_msgbox("Choose Destination Media", "No drives available")
             return False
 
+        journal = InstallJournal.load()
+        if (
+            journal is not None and
+            journal.resumable and
+            set(journal.disks) <= {disk.name for disk in disks} and
+            await dialog_yesno(
+                "Resume Installation",
+                "\n".join([
+                    f"The previous installation on {', '.join(journal.disks)} failed:",
+                    journal.error,
+                    "",
+                    "Resume it without formatting the disks again?",
+                ]),
+            )
+        ):
+            return await self._resume(disks, journal)
+
+        # The most suitable boot device is selected by default
+        recommended = [
+            probe.name for probe in (await recommend_boot_disks(disks))[:1]
+            if probe.error is None and not probe.in_use
+        ]
+
         while True:
             destination_disks = await dialog_checklist(
                 "Choose Destination Media",
@@ -58,7 +85,8 @@ class InstallerMenu:
                         humanfriendly.format_size(disk.size, binary=True)
                     ])
                     for disk in disks
-                }
+                },
+                recommended,
             )
 
             if destination_disks is None:
@@ -72,14 +100,18 @@ class InstallerMenu:
                 )
                 continue
 
-            wipe_disks = [
-                disk.name
-                for disk in disks
-                if (
-                    any(zfs_member.pool == "boot-pool" for zfs_member in disk.zfs_members) and
-                    disk.name not in destination_disks
-                )
-            ]
+            if all(boot_pool_members(disk) for disk in self._select_disks(disks, destination_disks)):
+                if await dialog_yesno(
+                    f"{vendor} Upgrade",
+                    (
+                        f"{', '.join(destination_disks)} contain an existing {vendor} installation. Upgrade it? The "
+                        "existing boot environments and configuration are kept. Choose No to erase the disks and "
+                        "perform a fresh installation."
+                    ),
+                ):
+                    return await self._upgrade(disks, destination_disks)
+
+            wipe_disks = [disk.name for disk in conflicting_boot_pool_disks(disks, destination_disks)]
             if wipe_disks:
                 # The presence of multiple `boot-pool` disks with different guids leads to boot pool import error
                 text = "\n".join([
@@ -108,18 +140,8 @@ class InstallerMenu:
         if not await dialog_yesno(f"{self.installer.vendor} Installation", text):
             return False
 
-        if vendor == "HexOS":
-            authentication_method = await self._authentication_truenas_admin()
-        else:
-            authentication_method = await dialog_menu(
-                "Web UI Authentication Method",
-                {
-                    "Administrative user (truenas_admin)": self._authentication_truenas_admin,
-                    "Configure using Web UI": self._authentication_webui,
-                }
-            )
-            if authentication_method is False:
-                return False
+        if (authentication_method := await self._authentication()) is False:
+            return False
 
         set_pmbr = False
         if not self.installer.efi:
@@ -131,9 +153,32 @@ class InstallerMenu:
                 ),
             )
 
-        # If the installer was booted with serial mode enabled, we should save these values to the installed system
-        sql = await serial_sql()
+        wipe_mode = "signatures"
+        if discard_disks := [disk.name for disk in self._select_disks(disks, destination_disks + wipe_disks)
+                             if discard_supported(disk.device)]:
+            # Only the disks that support discard are discarded, the others only have their signatures erased
+            if await dialog_yesno(
+                "Discard Disks",
+                (
+                    f"Discard (TRIM) all data on {', '.join(discard_disks)} before installing? This gives the new "
+                    "boot pool freshly trimmed flash and improves write performance. Disks that do not support "
+                    "discard only have their signatures erased."
+                ),
+            ):
+                wipe_mode = "discard"
+
+        return await self._install(disks, destination_disks, wipe_disks, set_pmbr, authentication_method, wipe_mode)
+
+    async def _resume(self, disks, journal):
+        if (authentication_method := await self._authentication()) is False:
+            return False
 
+        wipe_disks = [name for name in journal.wipe_disks if name in {disk.name for disk in disks}]
+        return await self._install(disks, journal.disks, wipe_disks, journal.set_pmbr, authentication_method,
+                                   journal.wipe_mode, True)
+
+    async def _install(self, disks, destination_disks, wipe_disks, set_pmbr, authentication_method, wipe_mode,
+                       resume=False):
         try:
             await install(
                 self._select_disks(disks, destination_disks),
@@ -141,8 +186,10 @@ class InstallerMenu:
                 set_pmbr,
                 authentication_method,
                 None,
-                sql,
+                None,
                 self._callback,
+                wipe_mode,
+                resume,
             )
         except InstallError as e:
             await dialog_msgbox("Installation Error", e.message)
@@ -157,6 +204,40 @@ class InstallerMenu:
         )
         return True
 
+    async def _upgrade(self, disks, destination_disks):
+        try:
+            await upgrade(
+                self._select_disks(disks, destination_disks),
+                self.installer.version,
+                None,
+                None,
+                self._callback,
+            )
+        except InstallError as e:
+            await dialog_msgbox("Upgrade Error", e.message)
+            return False
+
+        await dialog_msgbox(
+            "Upgrade Succeeded",
+            (
+                f"The {self.installer.vendor} upgrade on {', '.join(destination_disks)} succeeded!\n"
+                "Please reboot and remove the installation media."
+            ),
+        )
+        return True
+
+    async def _authentication(self):
+        if self.installer.vendor == "HexOS":
+            return await self._authentication_truenas_admin()
+
+        return await dialog_menu(
+            "Web UI Authentication Method",
+            {
+                "Administrative user (truenas_admin)": self._authentication_truenas_admin,
+                "Configure using Web UI": self._authentication_webui,
+            }
+        )
+
     def _select_disks(self, disks: list[Disk], disks_names: list[str]):
         disks_dict = {disk.name: disk for disk in disks}
         return [disks_dict[disk_name] for disk_name in disks_names]
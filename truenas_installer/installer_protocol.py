@@ -0,0 +1,68 @@
+import os
+
+__all__ = ["INSTALLER_EXTENSIONS", "INSTALLER_PARAMS_SCHEMA", "installer_supports"]
+
+# Parameters that `python3 -m truenas_install` (shipped in the update image) reads as a JSON object from its stdin.
+# It reports progress as `{"progress": <0..1>, "message": <str>}` and failure as `{"error": <str>}` JSON lines on
+# stdout and exits with a non-zero code if the installation failed.
+INSTALLER_PARAMS_SCHEMA = {
+    "type": "object",
+    "required": ["authentication_method", "disks", "json", "pool_name", "post_install", "sql", "src"],
+    "additionalProperties": False,
+    "properties": {
+        # `{"username": ..., "password": ...}` of the administrative user, `null` to keep the existing one
+        "authentication_method": {"type": ["object", "null"]},
+        # Names of the disks the boot pool is created on
+        "disks": {"type": "array", "items": {"type": "string"}},
+        # Report progress as JSON lines
+        "json": {"type": "boolean"},
+        # Name the boot pool is currently imported under
+        "pool_name": {"type": "string"},
+        # Configuration applied to the installed system (network interfaces, TrueNAS Connect, ...)
+        "post_install": {"type": ["object", "null"]},
+        # SQL executed against the configuration database of the installed system
+        "sql": {"type": ["string", "null"]},
+        # Where the update image is mounted
+        "src": {"type": "string"},
+        # Boot environment dataset to install into instead of creating `<pool_name>/ROOT/<version>`
+        "dataset_name": {"type": "string"},
+        # `dataset_name` already contains the system (received from a `zfs send` stream), only the post-install steps
+        # (configuration database, fstab, bootloader, ...) are performed, the update image is not copied into it
+        "skip_copy": {"type": "boolean"},
+        # Upgrade: the boot pool is kept together with its other boot environments, `dataset_name` is the new boot
+        # environment and the configuration is migrated from the previous one
+        "upgrade": {"type": "boolean"},
+        # Where the previously active boot environment is mounted (read-only) to migrate the configuration from
+        "old_root": {"type": ["string", "null"]},
+        # Name the boot pool has on disk (and is imported under on the installed system) if `pool_name` is a
+        # temporary in-core name (see `zpool create -t`). The boot configuration must reference this name.
+        "boot_pool_name": {"type": "string"},
+    },
+}
+# Optional parameters that older `truenas_install` versions do not know about. They are only sent to an installer
+# that reads them (see `installer_supports`), an installer that ignored them would silently install something else.
+INSTALLER_EXTENSIONS = ["boot_pool_name", "dataset_name", "skip_copy", "upgrade", "old_root"]
+
+
+def installer_supports(src: str, parameter: str) -> bool:
+    """
+    Returns `True` if the `truenas_install` package of the update image mounted at `src` reads the optional
+    `parameter` (one of `INSTALLER_EXTENSIONS`) from its parameters.
+    """
+    package = os.path.join(src, "truenas_install")
+    try:
+        names = sorted(os.listdir(package))
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+    for name in names:
+        if not name.endswith(".py"):
+            continue
+
+        with open(os.path.join(package, name), encoding="utf-8", errors="replace") as f:
+            source = f.read()
+
+        if f'"{parameter}"' in source or f"'{parameter}'" in source:
+            return True
+
+    return False
@@ -0,0 +1,67 @@
+from dataclasses import asdict, dataclass, field
+import json
+import os
+
+from .executor import host_path
+
+__all__ = ["InstallJournal", "PERSISTENT_STAGES"]
+
+JOURNAL_PATH = "/run/truenas_installer_journal.json"
+# Stages whose effects survive a failed installation, so they don't need to be re-run when it is resumed
+PERSISTENT_STAGES = {"hostid", "verify_image", "find_partitions", "create_boot_pool"}
+PERSISTENT_STAGE_PREFIXES = ("format ", "wipe ")
+
+
+@dataclass
+class InstallJournal:
+    """
+    Records the progress of an installation so that, if it fails late (i.e. `truenas_install` crashes on a
+    post-install step), it can be resumed without reformatting the disks and recreating the boot pool.
+    """
+    disks: list[str]
+    wipe_disks: list[str]
+    set_pmbr: bool = False
+    wipe_mode: str = "signatures"
+    # Completed persistent stages and their results
+    completed: dict[str, object] = field(default_factory=dict)
+    # Data partition GUID for each of `disks` that was formatted (the result of its `format` stage)
+    partition_guids: dict[str, str] = field(default_factory=dict)
+    pool_guid: str | None = None
+    # One of: none, created, imported, exported
+    pool_state: str = "none"
+    error: str | None = None
+
+    @classmethod
+    def load(cls) -> "InstallJournal | None":
+        try:
+            with open(host_path(JOURNAL_PATH)) as f:
+                return cls(**json.load(f))
+        except (FileNotFoundError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def remove(cls):
+        try:
+            os.unlink(host_path(JOURNAL_PATH))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def resumable(self):
+        return self.error is not None and bool(self.completed)
+
+    def stage_completed(self, name, result):
+        if name in PERSISTENT_STAGES or name.startswith(PERSISTENT_STAGE_PREFIXES):
+            self.completed[name] = result
+            if name.startswith("format "):
+                self.partition_guids[name.removeprefix("format ")] = result
+
+            self.save()
+
+    def save(self):
+        path = host_path(JOURNAL_PATH)
+        with open(f"{path}.tmp", "w") as f:
+            os.fchmod(f.fileno(), 0o600)
+            json.dump(asdict(self), f)
+
+        os.rename(f"{path}.tmp", path)
@@ -1,13 +1,15 @@
 import pathlib
 
 from .exception import InstallError
+from .executor import host_path
 
 __all__ = ["installation_lock"]
 
 
 class InstallationLock:
-    def __init__(self):
-        self.path = pathlib.Path("/run/truenas_installer.lock")
+    @property
+    def path(self):
+        return pathlib.Path(host_path("/run/truenas_installer.lock"))
 
     def locked(self):
         return self.path.exists()
@@ -0,0 +1,191 @@
+import asyncio
+from dataclasses import dataclass
+import mmap
+import os
+import random
+import threading
+from typing import Callable
+
+from .disks import Disk
+from .exception import InstallError
+from .gpt import boot_disk_layout, device_geometry
+from .trace import span
+from .utils import open_direct
+
+__all__ = ["PREFLIGHT_MODES", "SurfaceRegion", "check_surface", "surface_regions"]
+
+# `read` only reads the regions, `write` additionally writes a pattern to them, reads it back and restores the
+# original data
+PREFLIGHT_MODES = ["none", "read", "write"]
+# A healthy disk completes any single I/O much faster than this
+IO_TIMEOUT = 5
+STRIPE_SIZE = 1024 ** 2
+EFI_SAMPLES = 4
+DATA_SAMPLES = 16
+
+
+@dataclass
+class SurfaceRegion:
+    name: str
+    offset: int
+    length: int
+
+
+def surface_regions(sector_size: int, size: int) -> list[SurfaceRegion]:
+    """
+    Returns the regions of a disk of `size` bytes that the installation writes to, the way `boot_disk_layout` lays
+    them out: both GPT copies and the BIOS boot partition in full, and evenly spaced `STRIPE_SIZE` samples of the EFI
+    system and data partitions.
+    """
+    table = boot_disk_layout(sector_size, size // sector_size, False)
+    bios, efi, data = table.partitions
+    regions = [
+        SurfaceRegion("primary GPT", 0, table.first_usable_lba * sector_size),
+        SurfaceRegion("BIOS boot partition", bios.first_lba * sector_size, bios.sectors * sector_size),
+    ]
+    for name, partition, samples in [
+        ("EFI system partition", efi, EFI_SAMPLES),
+        ("data partition", data, DATA_SAMPLES),
+    ]:
+        start = partition.first_lba * sector_size
+        length = partition.sectors * sector_size
+        stripe = min(STRIPE_SIZE, length)
+        offsets = sorted({
+            start + (length - stripe) * i // max(samples - 1, 1) // sector_size * sector_size
+            for i in range(samples)
+        })
+        regions.extend(SurfaceRegion(name, offset, stripe) for offset in offsets)
+
+    backup_gpt = (table.last_usable_lba + 1) * sector_size
+    regions.append(SurfaceRegion("backup GPT", backup_gpt, size // sector_size * sector_size - backup_gpt))
+    return regions
+
+
+async def check_surface(disk: Disk, write: bool, callback: Callable, timeout: float = IO_TIMEOUT):
+    """
+    Reads (and, if `write` is set, write-verifies) the regions of `disk` that the installation is going to write to.
+    Raises `InstallError` if any I/O fails, returns wrong data or does not complete within `timeout` seconds.
+
+    The I/O is performed by a separate thread. In read mode it is a daemon thread that is abandoned if the disk does
+    not respond, so that a disk that never completes an I/O can not hang the installer. In write mode the original
+    data of the region being checked must be restored before anything else happens to the disk, so the thread is
+    always waited for (even if the check times out or is cancelled) and keeps the installer running until it is done.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def report(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is closed, nobody is waiting for the result anymore
+            stop.set()
+
+    callback(0, f"Checking disk {disk.name}")
+    with span("check_surface", "disk", disk=disk.name, write=write) as args:
+        thread = threading.Thread(target=_check, args=(disk.device, write, report, stop), daemon=not write)
+        thread.start()
+        try:
+            await _wait_for_check(disk, queue, timeout, args)
+        finally:
+            stop.set()
+            if write:
+                await asyncio.to_thread(thread.join)
+
+
+async def _wait_for_check(disk, queue, timeout, args):
+    try:
+        regions = await asyncio.wait_for(queue.get(), timeout)
+    except asyncio.TimeoutError:
+        raise InstallError(f"Disk {disk.name} did not respond within {timeout} seconds")
+
+    if isinstance(regions, OSError):
+        raise InstallError(f"Unable to check disk {disk.name}: {regions}")
+
+    args["regions"] = len(regions)
+    for region in regions:
+        try:
+            error = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise InstallError(
+                f"Disk {disk.name} did not complete I/O at offset {region.offset} ({region.name}) within "
+                f"{timeout} seconds, it is likely failing"
+            )
+
+        if error is not None:
+            raise InstallError(
+                f"Disk {disk.name} failed I/O at offset {region.offset} ({region.name}): {error}, it is likely "
+                "failing"
+            )
+
+
+def _check(device, write, report, stop):
+    """
+    Reports the list of regions and then the result (`None` or error message) of checking each one of them, until
+    `stop` is set.
+    """
+    try:
+        fd = open_direct(device, os.O_RDWR if write else os.O_RDONLY)[0]
+    except OSError as e:
+        report(e)
+        return
+
+    # mmap-allocated buffers are page aligned, as `O_DIRECT` requires
+    buffers = [mmap.mmap(-1, STRIPE_SIZE) for _ in range(3 if write else 1)]
+    try:
+        try:
+            regions = surface_regions(*device_geometry(fd))
+        except (OSError, ValueError) as e:
+            report(OSError(str(e)))
+            return
+
+        report(regions)
+        for region in regions:
+            if stop.is_set():
+                return
+
+            views = [memoryview(buffer)[:region.length] for buffer in buffers]
+            try:
+                _check_region(fd, region, views)
+            except OSError as e:
+                report(e.strerror or str(e))
+                return
+            finally:
+                for view in views:
+                    view.release()
+
+            report(None)
+    finally:
+        for buffer in buffers:
+            buffer.close()
+
+        os.close(fd)
+
+
+def _check_region(fd, region, buffers):
+    _read(fd, buffers[0], region.offset)
+    if len(buffers) == 1:
+        return
+
+    original, pattern, readback = buffers
+    pattern[:] = random.randbytes(region.length)
+    _write(fd, pattern, region.offset)
+    try:
+        _read(fd, readback, region.offset)
+        if readback != pattern:
+            raise OSError("data read back does not match the data written")
+    finally:
+        _write(fd, original, region.offset)
+
+
+def _read(fd, buffer, offset):
+    if os.preadv(fd, [buffer], offset) != len(buffer):
+        raise OSError("short read")
+
+
+def _write(fd, buffer, offset):
+    if os.pwritev(fd, [buffer], offset) != len(buffer):
+        raise OSError("short write")
+
+    os.fdatasync(fd)
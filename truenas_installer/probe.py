@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+from dataclasses import dataclass
+import mmap
+import os
+import random
+import threading
+import time
+
+from .disks import Disk
+from .install import boot_pool_members
+from .utils import open_direct
+
+__all__ = ["DiskProbe", "probe_disk", "recommend_boot_disks"]
+
+RANDOM_READ_SIZE = 4096
+RANDOM_READS = 64
+SEQUENTIAL_READ_SIZE = 1024 ** 2
+SEQUENTIAL_READS = 16
+# Seconds a disk probe may take. A disk that does not respond is most likely failing, it is reported with a `timeout`
+# error instead of blocking the disk selection.
+PROBE_TIMEOUT = 10
+# Transports that are slow or wear out quickly, even if they are solid state
+DISCOURAGED_TRANSPORTS = {"mmc", "usb"}
+
+
+@dataclass
+class DiskProbe:
+    name: str
+    model: str
+    size: int
+    # One of `disks.TRANSPORTS`
+    transport: str
+    rotational: bool
+    # Whether the disk was read bypassing the page cache (otherwise the results are optimistic)
+    direct: bool = False
+    # Random `RANDOM_READ_SIZE` read latency percentiles, in microseconds
+    latency_p50_us: float | None = None
+    latency_p99_us: float | None = None
+    # Sequential read throughput in bytes per second
+    throughput: float | None = None
+    # Whether the disk contains data other than a boot pool, so installing to it should not be suggested
+    in_use: bool = False
+    error: str | None = None
+
+
+async def recommend_boot_disks(disks: list[Disk], timeout: float = PROBE_TIMEOUT) -> list[DiskProbe]:
+    """
+    Probes all `disks` concurrently and returns them ranked from the most to the least suitable boot device:
+    unused disks before the ones that contain data, then solid state disks before rotational ones and USB/MMC
+    devices, then by measured random read latency and sequential read throughput. Disks that could not be read are
+    last.
+
+    Each disk is probed by a separate daemon thread that is abandoned if the probe does not complete within
+    `timeout` seconds (see `preflight.check_surface`).
+    """
+    probes = await asyncio.gather(*[_probe_disk_with_timeout(disk, timeout) for disk in disks])
+    return sorted(probes, key=_rank)
+
+
+async def _probe_disk_with_timeout(disk, timeout):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()
+
+    def complete(probe):
+        if not future.done():
+            future.set_result(probe)
+
+    def probe():
+        result = context.run(probe_disk, disk)
+        try:
+            loop.call_soon_threadsafe(complete, result)
+        except RuntimeError:
+            # The event loop is closed, nobody is waiting for the result anymore
+            pass
+
+    threading.Thread(target=probe, daemon=True).start()
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        result = _new_probe(disk)
+        result.error = "timeout"
+        return result
+
+
+def probe_disk(disk: Disk) -> DiskProbe:
+    """
+    Measures `disk` with short, non-destructive reads: `RANDOM_READS` random reads of `RANDOM_READ_SIZE` bytes and
+    `SEQUENTIAL_READS` sequential reads of `SEQUENTIAL_READ_SIZE` bytes from the middle of the disk.
+    """
+    probe = _new_probe(disk)
+    try:
+        fd, probe.direct = open_direct(disk.device)
+    except OSError as e:
+        probe.error = e.strerror
+        return probe
+
+    # mmap-allocated buffers are page aligned, as `O_DIRECT` requires
+    buffer = mmap.mmap(-1, SEQUENTIAL_READ_SIZE)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        if size < RANDOM_READ_SIZE:
+            probe.error = f"Disk is smaller than {RANDOM_READ_SIZE} bytes"
+            return probe
+
+        # The same offsets are read every time, so that the probes of the same disk are comparable
+        generator = random.Random(disk.name)
+        latencies = sorted(
+            _timed_read(fd, memoryview(buffer)[:RANDOM_READ_SIZE],
+                        generator.randrange(size // RANDOM_READ_SIZE) * RANDOM_READ_SIZE) / 1000
+            for _ in range(RANDOM_READS)
+        )
+        probe.latency_p50_us = latencies[len(latencies) // 2]
+        probe.latency_p99_us = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+
+        start = max(0, size // 2 - size // 2 % SEQUENTIAL_READ_SIZE)
+        reads = min(SEQUENTIAL_READS, (size - start) // SEQUENTIAL_READ_SIZE)
+        if reads:
+            elapsed = sum(_timed_read(fd, buffer, start + i * SEQUENTIAL_READ_SIZE) for i in range(reads))
+            probe.throughput = reads * SEQUENTIAL_READ_SIZE / max(elapsed, 1) * 1e9
+    except OSError as e:
+        probe.error = e.strerror
+    finally:
+        buffer.close()
+        os.close(fd)
+
+    return probe
+
+
+def _new_probe(disk):
+    return DiskProbe(
+        disk.name,
+        disk.model,
+        disk.size,
+        disk.transport,
+        disk.rotational,
+        in_use=bool(disk.label) and not boot_pool_members(disk),
+    )
+
+
+def _timed_read(fd, buffer, offset):
+    start = time.perf_counter_ns()
+    os.preadv(fd, [buffer], offset)
+    return time.perf_counter_ns() - start
+
+
+def _rank(probe):
+    return (
+        probe.error is not None,
+        probe.in_use,
+        probe.rotational or probe.transport in DISCOURAGED_TRANSPORTS,
+        probe.latency_p50_us or 0,
+        -(probe.throughput or 0),
+        probe.name,
+    )
@@ -1,7 +1,9 @@
 import aiohttp_rpc
 
 import truenas_installer.server.api  # noqa
+from truenas_installer.disks import disk_inventory
 from truenas_installer.server.api.adoption import adoption_middleware
+from truenas_installer.staging import image_stager
 from .error import exception_middleware
 from .method import methods
 
@@ -25,3 +27,11 @@ class InstallerRPCServer(aiohttp_rpc.WsJsonRpcServer):
         for method in methods.values():
             method.server = self
             self.add_method(aiohttp_rpc.protocol.JsonRpcMethod(method.call, name=method.name))
+
+    async def on_startup(self, app):
+        image_stager.start()
+
+    async def on_shutdown(self, app):
+        await image_stager.stop()
+        disk_inventory.close()
+        await super().on_shutdown(app)
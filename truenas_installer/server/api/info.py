@@ -1,14 +1,60 @@
+import asyncio
 from dataclasses import asdict
+import errno
 
-from truenas_installer.disks import list_disks as _list_disks
+from aiohttp_rpc.protocol import JsonRpcRequest
+
+from truenas_installer.disk_query import DEFAULT_LIMIT, FILTER_OPERATORS, QUERY_FIELDS, query_disks as _query_disks
+from truenas_installer.disks import TRANSPORTS, list_disks as _list_disks
 from truenas_installer.network_interfaces import (
     list_network_interfaces as _list_network_interfaces,
     get_available_ip_addresses as _get_available_ip_addresses
 )
+from truenas_installer.journal import InstallJournal
 from truenas_installer.lock import installation_lock
+from truenas_installer.probe import recommend_boot_disks as _recommend_boot_disks
+from truenas_installer.server.error import Error
 from truenas_installer.server.method import method
+from truenas_installer.staging import image_stager
+
+__all__ = ["system_info", "image_staging_status", "list_disks", "stream_disks", "query_disks", "recommend_boot_disks",
+           "list_network_interfaces", "get_available_ip_addresses"]
 
-__all__ = ["system_info", "list_disks", "list_network_interfaces", "get_available_ip_addresses"]
+DISK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "size": {"type": "number"},
+        "model": {"type": "string"},
+        "label": {"type": "string"},
+        "zfs_members": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "pool": {"type": "string"},
+                    "pool_guid": {"type": ["string", "null"]},
+                    "txg": {"type": ["integer", "null"]},
+                    "hostid": {"type": ["integer", "null"]},
+                    "state": {"type": ["string", "null"]},
+                },
+            },
+        },
+        "removable": {"type": "boolean"},
+        "transport": {
+            "type": "string",
+            "enum": TRANSPORTS,
+        },
+        "rotational": {"type": "boolean"},
+        "serial": {"type": ["string", "null"]},
+        "wwn": {"type": ["string", "null"]},
+        "nvme_namespace": {"type": ["integer", "null"]},
+        "enclosure_slot": {"type": ["string", "null"]},
+        "logical_block_size": {"type": "integer"},
+        "physical_block_size": {"type": "integer"},
+    },
+}
 
 
 @method(None, {
@@ -17,6 +63,7 @@ __all__ = ["system_info", "list_disks", "list_network_interfaces", "get_availabl
         "installation_running": {"type": "boolean"},
         "installation_completed": {"type": "boolean"},
         "installation_error": {'oneOf': [{'type': 'null'}, {'type': 'string'}]},
+        "installation_resumable": {"type": "boolean"},
         "version": {"type": "string"},
         "efi": {"type": "boolean"},
     },
@@ -29,39 +76,177 @@ async def system_info(context):
         "installation_running": installation_lock.locked(),
         "installation_completed": context.server.installation_completed,
         "installation_error": context.server.installation_error,
+        "installation_resumable": (journal := InstallJournal.load()) is not None and journal.resumable,
         "version": context.server.installer.version,
         "efi": context.server.installer.efi,
     }
 
 
+@method(None, {
+    "type": "object",
+    "properties": {
+        "state": {
+            "type": "string",
+            "enum": ["idle", "starting", "copying", "reading", "staged", "cached", "skipped", "failed"],
+        },
+        "staged_bytes": {"type": "integer"},
+        "total_bytes": {"type": "integer"},
+        "error": {"type": ["string", "null"]},
+    },
+})
+async def image_staging_status(context):
+    """
+    Reports the progress of staging the update image into memory (`copying` to tmpfs or `reading` into the page
+    cache). The image is staged in the background from the moment the installer starts.
+    """
+    return image_stager.status()
+
+
+@method(None, {
+    "type": "array",
+    "items": DISK_SCHEMA,
+})
+async def list_disks(context):
+    """
+    Provides list of available disks.
+
+    The list is served from an inventory that is kept current by udev, so calling this often is cheap.
+    """
+    return [asdict(disk) for disk in await _list_disks()]
+
+
+@method(None, {"type": "integer"})
+async def stream_disks(context):
+    """
+    Provides the same list of available disks as `list_disks`, but sends each disk to the calling client as soon as
+    it is enumerated, without waiting for the other disks to be scanned.
+
+    Each disk is sent as a `disk_enumerated` notification, followed by a single `disk_enumeration_completed`
+    notification once all the disks were sent. Both are only sent to the websocket connection the method was called
+    from, before the method returns. Returns the number of disks sent.
+    """
+    websocket = context.rpc_request.context["ws_connect"]
+    queue = asyncio.Queue()
+
+    async def send():
+        # Notifications are sent one by one, so that they arrive in order and before the method result
+        while (notification := await queue.get()) is not None:
+            method, params = notification
+            if not websocket.closed:
+                await websocket.send_str(
+                    context.server.json_serialize(JsonRpcRequest(method, params=[params]).dump())
+                )
+
+    sender = asyncio.ensure_future(send())
+    try:
+        disks = await _list_disks(lambda disk: queue.put_nowait(("disk_enumerated", asdict(disk))))
+        queue.put_nowait(("disk_enumeration_completed", {"count": len(disks)}))
+    finally:
+        queue.put_nowait(None)
+        await sender
+
+    return len(disks)
+
+
+@method({
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "filters": {
+            "type": "array",
+            "items": {
+                "type": "array",
+                "prefixItems": [
+                    {"type": "string", "enum": QUERY_FIELDS},
+                    {"type": "string", "enum": list(FILTER_OPERATORS)},
+                    {},
+                ],
+                "minItems": 3,
+                "maxItems": 3,
+            },
+        },
+        "order_by": {
+            "type": "array",
+            "items": {"type": "string", "enum": QUERY_FIELDS + [f"-{field}" for field in QUERY_FIELDS]},
+        },
+        "limit": {
+            "type": "integer",
+            "minimum": 1,
+            "maximum": 1000,
+        },
+        "cursor": {"type": ["string", "null"]},
+    },
+}, {
+    "type": "object",
+    "properties": {
+        "disks": {
+            "type": "array",
+            "items": DISK_SCHEMA,
+        },
+        "next_cursor": {"type": ["string", "null"]},
+        "total": {"type": "integer"},
+    },
+})
+async def query_disks(context, params):
+    """
+    Provides a filtered, sorted and paginated list of available disks (the same disks `list_disks` returns).
+
+    `filters` is a list of `[field, operator, value]` conditions that must all match, i.e.
+    `[["transport", "=", "nvme"], ["size", "<=", 512000000000]]`. Operators are `=`, `!=`, `>`, `>=`, `<`, `<=`,
+    `~` (regular expression search), `in` and `nin` (value is in/not in the list).
+
+    `order_by` is a list of fields, prefixed with `-` for descending order (i.e. `["transport", "-size"]`). Disks are
+    always sorted by `name` last.
+
+    At most `limit` (100 by default) disks are returned. If there are more, `next_cursor` is set: pass it as `cursor`
+    (with the same `filters` and `order_by`) to get the next page. `total` is the number of disks that match
+    `filters`.
+    """
+    try:
+        disks, next_cursor, total = _query_disks(
+            await _list_disks(),
+            params.get("filters", []),
+            params.get("order_by", []),
+            params.get("limit", DEFAULT_LIMIT),
+            params.get("cursor"),
+        )
+    except ValueError as e:
+        raise Error(str(e), errno.EINVAL)
+
+    return {"disks": [asdict(disk) for disk in disks], "next_cursor": next_cursor, "total": total}
+
+
 @method(None, {
     "type": "array",
     "items": {
         "type": "object",
         "properties": {
             "name": {"type": "string"},
-            "size": {"type": "number"},
             "model": {"type": "string"},
-            "label": {"type": "string"},
-            "zfs_members": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string"},
-                        "pool": {"type": "string"},
-                    },
-                },
+            "size": {"type": "number"},
+            "transport": {
+                "type": "string",
+                "enum": TRANSPORTS,
             },
-            "removable": {"type": "boolean"},
+            "rotational": {"type": "boolean"},
+            "direct": {"type": "boolean"},
+            "latency_p50_us": {"type": ["number", "null"]},
+            "latency_p99_us": {"type": ["number", "null"]},
+            "throughput": {"type": ["number", "null"]},
+            "in_use": {"type": "boolean"},
+            "error": {"type": ["string", "null"]},
         },
     },
 })
-async def list_disks(context):
+async def recommend_boot_disks(context):
     """
-    Provides list of available disks.
+    Measures all the available disks with short, non-destructive reads and returns them ranked from the most to the
+    least suitable boot device. Disks that contain data (other than a boot pool) are ranked after the unused ones,
+    and solid state disks before rotational disks and USB/MMC devices. Within these groups, disks are ranked by the
+    measured random read latency (`latency_p50_us`, in microseconds) and sequential read throughput (`throughput`,
+    in bytes per second).
     """
-    return [asdict(disk) for disk in await _list_disks()]
+    return [asdict(probe) for probe in await _recommend_boot_disks(await _list_disks())]
 
 
 @method(None, {
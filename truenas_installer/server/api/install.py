@@ -1,5 +1,6 @@
 import asyncio
 import copy
+from dataclasses import asdict
 import errno
 import functools
 
@@ -7,81 +8,35 @@ from aiohttp_rpc.protocol import JsonRpcRequest
 
 from truenas_installer.disks import list_disks
 from truenas_installer.exception import InstallError
-from truenas_installer.install import install as install_
-from truenas_installer.serial import serial_sql
+from truenas_installer.imaging import imaging_install as imaging_install_
+from truenas_installer.install import install as install_, upgrade as upgrade_
+from truenas_installer.install_schema import AUTHENTICATION_SCHEMA, INSTALL_SCHEMA, POST_INSTALL_SCHEMA
 from truenas_installer.server.api.truenas_connect.cache import get_tnc_config
 from truenas_installer.server.error import Error
 from truenas_installer.server.method import method
+from truenas_installer.trace import get_last_trace
 
-__all__ = ["install"]
+__all__ = ["install", "imaging_install", "installation_trace"]
 
 
-@method({
-    "type": "object",
-    "required": ["disks", "set_pmbr", "authentication"],
-    "additionalProperties": False,
-    "properties": {
-        "wipe_disks": {
-            "type": "array",
-            "items": {"type": "string"},
-        },
-        "disks": {
-            "type": "array",
-            "items": {"type": "string"},
-        },
-        "set_pmbr": {"type": "boolean"},
-        "authentication": {
-            "type": ["object", "null"],
-            "required": ["username", "password"],
-            "additionalProperties": False,
-            "properties": {
-                "username": {
-                    "type": "string",
-                    "enum": ["truenas_admin", "root"],
-                },
-                "password": {
-                    "type": "string",
-                    "minLength": 6,
-                },
-            },
-        },
-        "post_install": {
-            "type": "object",
-            "additionalProperties": False,
-            "properties": {
-                "network_interfaces": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "required": ["name"],
-                        "additionalProperties": False,
-                        "properties": {
-                            "name": {"type": "string"},
-                            "aliases": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "required": ["type", "address", "netmask"],
-                                    "additionalProperties": False,
-                                    "properties": {
-                                        "type": {"type": "string"},
-                                        "address": {"type": "string"},
-                                        "netmask": {"type": "integer"},
-                                    },
-                                },
-                            },
-                            "ipv4_dhcp": {"type": "boolean"},
-                            "ipv6_auto": {"type": "boolean"},
-                        },
-                    },
-                },
-            },
-        },
-    },
-}, None)
+@method(INSTALL_SCHEMA, None)
 async def install(context, params):
     """
     Performs system installation.
+
+    If `resume` is `true`, continues the last failed installation (see `installation_resumable` in `system_info`)
+    without re-formatting the disks. `disks` must be the same as in the failed installation.
+
+    If `upgrade` is `true`, `disks` must contain an existing `boot-pool`. It is kept (together with its boot
+    environments) and the new version is installed into a new boot environment, migrating the configuration from the
+    active one. `authentication` is ignored in this case.
+
+    Before anything is written, the destination disks are checked for failing I/O (`preflight`): `read` (the default)
+    reads the regions the installation writes to, `write` also writes a pattern to them, reads it back and restores
+    the original data, `none` skips the check. `preflight` is ignored when resuming an installation.
+
+    If `payload` is `stream`, the boot environment is received from the prebuilt `zfs send` stream shipped on the
+    installation media instead of being copied file by file from the update image.
     """
     disks = {disk.name: disk for disk in await list_disks()}
 
@@ -98,16 +53,34 @@ async def install(context, params):
     post_install = copy.deepcopy(params.get("post_install") or {})
     post_install["tnc_config"] = get_tnc_config()
 
-    try:
-        await install_(
+    if params.get("upgrade"):
+        if wipe_disks or params.get("resume"):
+            raise Error("`wipe_disks` and `resume` can't be used with `upgrade`", errno.EINVAL)
+
+        installation = upgrade_(
+            destination_disks,
+            context.server.installer.version,
+            post_install,
+            None,
+            functools.partial(callback, context.server),
+        )
+    else:
+        installation = install_(
             destination_disks,
             wipe_disks,
             params["set_pmbr"],
             params["authentication"],
             post_install,
-            await serial_sql(),
+            None,
             functools.partial(callback, context.server),
+            params.get("wipe_mode", "signatures"),
+            params.get("resume", False),
+            params.get("payload", "image"),
+            params.get("preflight", "read"),
         )
+
+    try:
+        await installation
     except InstallError as e:
         context.server.installation_error = str(e)
         raise Error(e.message, errno.EFAULT)
@@ -115,11 +88,97 @@ async def install(context, params):
         context.server.installation_completed = True
 
 
+@method({
+    "type": "object",
+    "required": ["groups", "set_pmbr", "authentication"],
+    "additionalProperties": False,
+    "properties": {
+        "groups": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "array",
+                "minItems": 1,
+                "items": {"type": "string"},
+            },
+        },
+        "set_pmbr": {"type": "boolean"},
+        "authentication": AUTHENTICATION_SCHEMA,
+        "post_install": POST_INSTALL_SCHEMA,
+    },
+}, {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "disks": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+            "error": {"type": ["string", "null"]},
+        },
+    },
+})
+async def imaging_install(context, params):
+    """
+    Imaging station mode: installs the system to each group of disks in `groups` independently and concurrently. Each
+    group gets its own boot pool, which is exported at the end, so the disks can be moved to the systems they are
+    meant for.
+
+    Progress of each target is reported with `imaging_progress` notifications that carry the target `name`. Returns
+    the result for each target, the installation on one target failing does not affect the others.
+    """
+    disks = {disk.name: disk for disk in await list_disks()}
+
+    try:
+        groups = [[disks[disk_name] for disk_name in group] for group in params["groups"]]
+    except KeyError as e:
+        raise Error(f"Disk {e.args[0]!r} does not exist", errno.EFAULT)
+
+    post_install = copy.deepcopy(params.get("post_install") or {})
+    post_install["tnc_config"] = get_tnc_config()
+
+    try:
+        results = await imaging_install_(
+            groups,
+            params["set_pmbr"],
+            params["authentication"],
+            post_install,
+            None,
+            functools.partial(imaging_callback, context.server),
+        )
+    except InstallError as e:
+        raise Error(e.message, errno.EFAULT)
+
+    return [asdict(result) for result in results]
+
+
+@method(None, {"type": ["object", "null"]})
+async def installation_trace(context):
+    """
+    Returns the trace of the last installation (subprocesses, partition waits, installation stages and progress
+    messages with their timings) in Chrome trace-event format, or `null` if no installation was performed yet.
+    """
+    if (trace := get_last_trace()) is None:
+        return None
+
+    return trace.to_chrome()
+
+
 def callback(server, progress, message):
+    notify(server, "installation_progress", {"progress": progress, "message": message})
+
+
+def imaging_callback(server, name, progress, message):
+    notify(server, "imaging_progress", {"name": name, "progress": progress, "message": message})
+
+
+def notify(server, method, params):
     request = server.json_serialize(
         JsonRpcRequest(
-            "installation_progress",
-            params=[{"progress": progress, "message": message}]
+            method,
+            params=[params]
         ).dump()
     )
 
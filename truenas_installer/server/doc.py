@@ -48,3 +48,43 @@ def generate_api_doc():
         },
     }, indent=2), "    "))
     print()
+
+    print("## imaging_progress")
+    print()
+    print("Server calls this method on the client to report the installation progress of each target of ")
+    print("`imaging_install`. `name` is the target name, as returned in the `imaging_install` result. This method ")
+    print("will only be called after the client initiates imaging installation and before the server reports its ")
+    print("result.")
+    print()
+    print("### Parameter jsonschema")
+    print()
+    print(textwrap.indent(json.dumps({
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "progress": {"type": "number"},
+            "message": {"type": "text"},
+        },
+    }, indent=2), "    "))
+    print()
+
+    print("## disk_enumerated")
+    print()
+    print("Server calls this method on the client that called `stream_disks` with each disk as soon as it is ")
+    print("enumerated. The parameter has the same format as the `list_disks` items.")
+    print()
+
+    print("## disk_enumeration_completed")
+    print()
+    print("Server calls this method on the client that called `stream_disks` after all the disks were sent with ")
+    print("`disk_enumerated`.")
+    print()
+    print("### Parameter jsonschema")
+    print()
+    print(textwrap.indent(json.dumps({
+        "type": "object",
+        "properties": {
+            "count": {"type": "integer"},
+        },
+    }, indent=2), "    "))
+    print()
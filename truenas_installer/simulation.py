@@ -0,0 +1,458 @@
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+from dataclasses import dataclass, field
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+
+from jsonschema import ValidationError, validate
+
+from .disks import Disk, ZFSMember, disk_transport
+from .executor import Executor, use_executor
+from .gpt import read_partition_table
+from .install import STREAM_DECOMPRESSORS, install, upgrade
+from .installer_protocol import INSTALLER_PARAMS_SCHEMA
+from .trace import TRACE_PATH, get_last_trace
+from .zfs_label import (DATA_TYPE_STRING, DATA_TYPE_UINT64, LABEL_SIZE, NV_ENCODE_XDR, POOL_STATES, VDEV_LABELS,
+                        VDEV_PHYS_OFFSET, label_offsets)
+
+__all__ = ["FakeInstallerProcess", "FakeReceiveProcess", "Response", "SimulatedExecutor", "pack_nvlist",
+           "simulate_install", "simulate_upgrade", "write_zfs_labels"]
+
+
+@dataclass
+class Response:
+    # Regular expression that is matched against the space-joined command line
+    pattern: str
+    returncode: int = 0
+    stdout: str = ""
+    stderr: str = ""
+    # Seconds the simulated command takes to complete
+    delay: float = 0
+
+
+# `dmu_replay_record` header followed by `drr_begin` (magic, versioninfo, creation_time, type, flags, toguid,
+# fromguid, toname)
+STREAM_HEADER = struct.Struct("<IIQQQIIQQ256s")
+DMU_BACKUP_MAGIC = 0x2F5BACBAC
+
+DATA_TYPE_NVLIST = 19
+
+DEFAULT_RESPONSES = [
+    Response(r"^zgenhostid$", delay=0.01),
+    Response(r"^zpool create ", delay=0.3),
+    Response(r"^zfs create ", delay=0.05),
+    Response(r"^zpool get -H -o value guid ", stdout="5764350912338712816\n"),
+    Response(r"^zpool get -H -o value bootfs ", stdout="boot-pool/ROOT/25.04\n"),
+    Response(r"^zpool export ", delay=0.1),
+    Response(r"^zpool list ", 1, stderr="cannot open 'boot-pool': no such pool\n"),
+    Response(r"^zpool import ", delay=0.1),
+    Response(r"^zfs list -H -o name boot-pool/ROOT/[^ ]+$", 1, stderr="dataset does not exist\n"),
+    Response(r"^zfs list ", stdout="boot-pool/ROOT\nboot-pool/ROOT/25.10\n"),
+    Response(r"^zfs destroy ", delay=0.02),
+    Response(r"^zpool set bootfs="),
+    Response(r"^mount ", delay=0.05),
+    Response(r"^umount ", delay=0.02),
+    Response(r"^udevadm settle$"),
+]
+
+DEFAULT_INSTALLER_STEPS = [
+    (0.05, 0.0, "Copying files"),
+    (0.2, 0.5, "Copying files"),
+    (0.1, 0.8, "Configuring system"),
+    (0.05, 0.95, "Installing bootloader"),
+]
+
+
+def _write_fake_installer(src):
+    # The update image is not really mounted, but `installer_supports` inspects the `truenas_install` it contains
+    os.makedirs(os.path.join(src, "truenas_install"), exist_ok=True)
+    with open(os.path.join(src, "truenas_install", "__main__.py"), "w") as f:
+        f.write(f"# Simulated `truenas_install`, replaced with `FakeInstallerProcess`\n"
+                f"PARAMS = {json.dumps(list(INSTALLER_PARAMS_SCHEMA['properties']))}\n")
+
+
+@dataclass
+class FakeInstallerProcess:
+    """
+    Stands in for the `python3 -m truenas_install` process: reads params JSON from stdin and, once it is closed,
+    emits `(delay, progress, message)` `steps` as progress JSON lines. If `error` is set, it is reported at the
+    end and the process exits with code 1. Params that do not match `INSTALLER_PARAMS_SCHEMA` (i.e. unknown keys) are
+    reported as an error right away.
+    """
+    steps: list[tuple[float, float, str]]
+    error: str | None = None
+    params: dict | None = None
+    returncode: int | None = None
+    stdout: asyncio.StreamReader = field(default_factory=asyncio.StreamReader)
+
+    def __post_init__(self):
+        self.stdin = self
+        self._input = b""
+        self._done = asyncio.Event()
+
+    def write(self, data):
+        self._input += data
+
+    def close(self):
+        self.params = json.loads(self._input)
+        asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            validate(self.params, INSTALLER_PARAMS_SCHEMA)
+        except ValidationError as e:
+            self._emit({"error": f"Invalid parameters: {e.message}"})
+            self.returncode = 1
+            self.stdout.feed_eof()
+            self._done.set()
+            return
+
+        for delay, progress, message in self.steps:
+            await asyncio.sleep(delay)
+            self._emit({"progress": progress, "message": message})
+
+        if self.error is not None:
+            self._emit({"error": self.error})
+            self.returncode = 1
+        else:
+            self.returncode = 0
+
+        self.stdout.feed_eof()
+        self._done.set()
+
+    def _emit(self, data):
+        self.stdout.feed_data((json.dumps(data) + "\n").encode("utf-8"))
+
+    async def wait(self):
+        await self._done.wait()
+        return self.returncode
+
+    def kill(self):
+        if not self._done.is_set():
+            self.returncode = -9
+            self.stdout.feed_eof()
+            self._done.set()
+
+
+@dataclass
+class FakeReceiveProcess:
+    """
+    Stands in for `zfs recv -e <target>`: parses the name of the sent snapshot from the `DRR_BEGIN` record of the
+    stream written to its stdin and counts the received bytes.
+    """
+    target: str
+    received: int = 0
+    dataset: str | None = None
+    returncode: int | None = None
+    stdout: asyncio.StreamReader = field(default_factory=asyncio.StreamReader)
+
+    def __post_init__(self):
+        self.stdin = self
+        self._header = b""
+        self._done = asyncio.Event()
+
+    def write(self, data):
+        if self.returncode is not None:
+            raise BrokenPipeError()
+
+        if len(self._header) < STREAM_HEADER.size:
+            self._header += data[:STREAM_HEADER.size - len(self._header)]
+
+        self.received += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        if self.returncode is not None:
+            return
+
+        if len(self._header) < STREAM_HEADER.size or STREAM_HEADER.unpack(self._header)[2] != DMU_BACKUP_MAGIC:
+            self._exit(1, "cannot receive: invalid stream (bad magic number)")
+            return
+
+        snapshot = STREAM_HEADER.unpack(self._header)[-1].rstrip(b"\0").decode("utf-8")
+        name, snap = snapshot.split("@", 1)
+        self.dataset = f"{self.target}/{name.rsplit('/', 1)[-1]}"
+        self._exit(0, f"receiving full stream of {snapshot} into {self.dataset}@{snap}")
+
+    def _exit(self, returncode, output):
+        self.returncode = returncode
+        self.stdout.feed_data(f"{output}\n".encode("utf-8"))
+        self.stdout.feed_eof()
+        self._done.set()
+
+    async def wait(self):
+        await self._done.wait()
+        return self.returncode
+
+    def kill(self):
+        if not self._done.is_set():
+            self._exit(-9, "")
+
+
+class SimulatedExecutor(Executor):
+    """
+    Executor that runs the installation pipeline inside `root` directory, which gets a fake `/dev`, `/sys/block`,
+    `/etc`, `/run` and `/cdrom`. Use `add_disk` to create simulated disks.
+
+    Partition tables and wipes are really written to the sparse disk images, `sgdisk`/`zpool`/`zfs`/`mount` and
+    other commands are answered with scripted, timed `responses`, `truenas_install` is replaced with a
+    `FakeInstallerProcess` and `zfs recv` with a `FakeReceiveProcess` (stream decompressors are real).
+    `partition_delay` simulates the time the kernel takes to re-read a partition table. Every command that was run is
+    recorded in `commands`.
+
+    Simulated runs are deterministic, so `python3 -m truenas_installer.simulation` can be used as an end-to-end
+    benchmark of the installation pipeline.
+    """
+
+    def __init__(self, root: str, responses: list[Response] | None = None,
+                 installer_steps: list[tuple[float, float, str]] | None = None, installer_error: str | None = None,
+                 partition_delay: float = 0.01):
+        self.root = root
+        self.responses = DEFAULT_RESPONSES if responses is None else responses
+        self.installer_steps = DEFAULT_INSTALLER_STEPS if installer_steps is None else installer_steps
+        self.installer_error = installer_error
+        self.partition_delay = partition_delay
+        self.commands = []
+        self.installers = []
+        self.receivers = []
+
+        for path in ["dev", "sys/block", "etc", "run", "cdrom", "tmp"]:
+            os.makedirs(os.path.join(root, path), exist_ok=True)
+
+        with open(os.path.join(root, "cdrom/TrueNAS.update"), "wb"):
+            pass
+
+    def add_disk(self, name: str, size: int, model: str = "Simulated Disk",
+                 zfs_members: list[ZFSMember] | None = None, rotational: bool = False) -> Disk:
+        """
+        Creates a disk image and its sysfs and udev database entries. `zfs_members` partitions are only present in
+        sysfs and udev database, the disk image itself is empty. If a member has `pool_guid`, its partition also gets
+        a small device node with ZFS labels.
+        """
+        with open(os.path.join(self.root, "dev", name), "wb") as f:
+            f.truncate(size)
+
+        sysfs = os.path.join(self.root, "sys/block", name)
+        os.makedirs(os.path.join(sysfs, "queue"), exist_ok=True)
+        os.makedirs(os.path.join(sysfs, "device"), exist_ok=True)
+        minor = len(os.listdir(os.path.join(self.root, "sys/block"))) * 16
+        self._write_block_device(sysfs, [
+            ("size", size // 512),
+            ("removable", 0),
+            ("queue/discard_max_bytes", 0),
+            ("queue/rotational", int(rotational)),
+            ("queue/logical_block_size", 512),
+            ("queue/physical_block_size", 4096),
+            ("device/model", model),
+            ("device/serial", f"SIM{minor:04d}"),
+        ], minor, {})
+
+        zfs_members = [
+            # The members that have labels are returned as they are scanned
+            dataclasses.replace(zfs_member, txg=zfs_member.txg or 0, state=zfs_member.state or "active")
+            if zfs_member.pool_guid is not None else zfs_member
+            for zfs_member in zfs_members or []
+        ]
+        for zfs_member in zfs_members:
+            os.makedirs(part_sysfs := os.path.join(sysfs, zfs_member.name))
+            number = int(re.search(r"([0-9]+)$", zfs_member.name).group(1))
+            self._write_block_device(part_sysfs, [("partition", number)], minor + number,
+                                     {"ID_FS_TYPE": "zfs_member", "ID_FS_LABEL": zfs_member.pool})
+            if zfs_member.pool_guid is not None:
+                write_zfs_labels(os.path.join(self.root, "dev", zfs_member.name), VDEV_LABELS * LABEL_SIZE, {
+                    "version": 5000,
+                    "name": zfs_member.pool,
+                    "state": POOL_STATES.index(zfs_member.state),
+                    "txg": zfs_member.txg,
+                    "pool_guid": int(zfs_member.pool_guid),
+                    **({"hostid": zfs_member.hostid} if zfs_member.hostid is not None else {}),
+                    "guid": minor + number,
+                    "vdev_tree": {"type": "disk", "id": 0, "guid": minor + number},
+                })
+
+        label = ", ".join([f"zfs-\"{zfs_member.pool}\"" for zfs_member in zfs_members])
+        return Disk(name, size, model, label, zfs_members, False, disk_transport(name, sysfs, False), rotational,
+                    f"SIM{minor:04d}", None, 1 if name.startswith("nvme") else None, None, 512, 4096)
+
+    def _write_block_device(self, sysfs, attributes, minor, udev_properties):
+        for attribute, value in attributes + [("dev", f"8:{minor}")]:
+            with open(os.path.join(sysfs, attribute), "w") as f:
+                f.write(f"{value}\n")
+
+        os.makedirs(os.path.join(self.root, "run/udev/data"), exist_ok=True)
+        with open(os.path.join(self.root, f"run/udev/data/b8:{minor}"), "w") as f:
+            f.write("".join(f"E:{key}={value}\n" for key, value in udev_properties.items()))
+
+    async def run(self, args):
+        command = " ".join(args)
+        self.commands.append(command)
+        for response in self.responses:
+            if re.search(response.pattern, command):
+                await asyncio.sleep(response.delay)
+                if response.returncode == 0:
+                    if args[0] == "mount" and "squashfs" in args:
+                        _write_fake_installer(args[2])
+                    elif args[0] == "umount":
+                        shutil.rmtree(os.path.join(args[-1], "truenas_install"), ignore_errors=True)
+
+                return response.returncode, response.stdout.encode("utf-8"), response.stderr.encode("utf-8")
+
+        return 127, b"", f"{args[0]}: simulated command not found".encode("utf-8")
+
+    async def spawn(self, args, cwd, merge_stderr=True):
+        self.commands.append(" ".join(args))
+        if args[:2] == ["zfs", "recv"]:
+            process = FakeReceiveProcess(args[-1])
+            self.receivers.append(process)
+            return process
+
+        if args in [list(decompress) for decompress in STREAM_DECOMPRESSORS.values()]:
+            # Decompressors are real
+            return await super().spawn(args, cwd, merge_stderr)
+
+        if args != ["python3", "-m", "truenas_install"]:
+            raise FileNotFoundError(args[0])
+
+        process = FakeInstallerProcess(self.installer_steps, self.installer_error)
+        self.installers.append(process)
+        return process
+
+    def reread_partition_table(self, device):
+        time.sleep(self.partition_delay)
+
+        name = os.path.basename(device)
+        sysfs = os.path.join(self.root, "sys/block", name)
+        for entry in os.listdir(sysfs):
+            if entry.startswith(name):
+                shutil.rmtree(os.path.join(sysfs, entry))
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(os.path.join(self.root, "dev", entry))
+
+        if (table := read_partition_table(device)) is None:
+            return
+
+        for partition in table.partitions:
+            part_name = f"{name}{partition.number}"
+            os.makedirs(os.path.join(sysfs, part_name))
+            for attribute, value in [
+                ("partition", partition.number),
+                ("start", partition.first_lba * table.sector_size // 512),
+                ("size", partition.sectors * table.sector_size // 512),
+            ]:
+                with open(os.path.join(sysfs, part_name, attribute), "w") as f:
+                    f.write(f"{value}\n")
+
+            with open(os.path.join(self.root, "dev", part_name), "wb"):
+                pass
+
+
+def pack_nvlist(pairs: dict, header: bool = True) -> bytes:
+    """
+    Encodes `pairs` (`int`, `str` or nested `dict` values) as an XDR nvlist, the way ZFS stores vdev configuration
+    in its labels.
+    """
+    data = bytes([NV_ENCODE_XDR, 1, 0, 0]) if header else b""
+    # `nvl_version`, `nvl_nvflag` (NV_UNIQUE_NAME)
+    data += struct.pack(">iI", 0, 1)
+    for name, value in pairs.items():
+        pair = _pack_xdr_string(name)
+        if isinstance(value, dict):
+            pair += struct.pack(">ii", DATA_TYPE_NVLIST, 1) + pack_nvlist(value, False)
+        elif isinstance(value, str):
+            pair += struct.pack(">ii", DATA_TYPE_STRING, 1) + _pack_xdr_string(value)
+        else:
+            pair += struct.pack(">iiQ", DATA_TYPE_UINT64, 1, value)
+
+        # The decoded size is not used by the decoder
+        data += struct.pack(">ii", 8 + len(pair), 0) + pair
+
+    return data + struct.pack(">ii", 0, 0)
+
+
+def write_zfs_labels(path: str, size: int, config: dict):
+    """
+    Writes all four ZFS labels with vdev configuration `config` to a `size` bytes long device image at `path`.
+    """
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(size)
+        for offset in label_offsets(size):
+            f.seek(offset + VDEV_PHYS_OFFSET)
+            f.write(pack_nvlist(config))
+
+
+def _pack_xdr_string(value):
+    encoded = value.encode("utf-8")
+    return struct.pack(">I", len(encoded)) + encoded + b"\0" * (-len(encoded) % 4)
+
+
+async def simulate_install(executor: SimulatedExecutor, destination_disks: list[Disk], wipe_disks: list[Disk],
+                           callback=None, **kwargs):
+    """
+    Runs `install()` with `executor` and returns the time it took in seconds.
+    """
+    with use_executor(executor):
+        start = time.monotonic()
+        await install(
+            destination_disks,
+            wipe_disks,
+            kwargs.pop("set_pmbr", False),
+            kwargs.pop("authentication", None),
+            kwargs.pop("post_install", None),
+            kwargs.pop("sql", ""),
+            callback or (lambda progress, message: None),
+            **kwargs,
+        )
+        return time.monotonic() - start
+
+
+async def simulate_upgrade(executor: SimulatedExecutor, disks: list[Disk], version: str, callback=None, **kwargs):
+    """
+    Runs `upgrade()` with `executor` and returns the time it took in seconds.
+    """
+    with use_executor(executor):
+        start = time.monotonic()
+        await upgrade(
+            disks,
+            version,
+            kwargs.pop("post_install", None),
+            kwargs.pop("sql", ""),
+            callback or (lambda progress, message: None),
+        )
+        return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulated installation and report its timings")
+    parser.add_argument("--disks", type=int, default=2, help="Number of destination disks")
+    parser.add_argument("--wipe-disks", type=int, default=0, help="Number of additional disks to wipe")
+    parser.add_argument("--disk-size", type=int, default=16 * 1024 ** 3, help="Size of each disk in bytes")
+    parser.add_argument("--trace", default=TRACE_PATH, help="Where to write the Chrome trace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        executor = SimulatedExecutor(root)
+        disks = [executor.add_disk(f"sd{chr(ord('a') + i)}", args.disk_size)
+                 for i in range(args.disks + args.wipe_disks)]
+
+        elapsed = asyncio.run(simulate_install(
+            executor,
+            disks[:args.disks],
+            disks[args.disks:],
+            lambda progress, message: print(f"[{int(progress * 100)}%] {message}"),
+        ))
+
+    get_last_trace().write(args.trace)
+    print(f"Simulated installation took {elapsed:.3f} seconds, trace written to {args.trace}")
+
+
+if __name__ == "__main__":
+    main()
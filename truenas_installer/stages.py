@@ -0,0 +1,121 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from .trace import span
+
+__all__ = ["Stage", "StageGraph"]
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[], Awaitable]
+    requires: list[str] = field(default_factory=list)
+
+
+class StageGraph:
+    """
+    A dependency graph of asynchronous stages. `run` starts every stage as soon as all the stages it requires have
+    completed, so independent stages run concurrently.
+
+    If any stage fails, all other stages are cancelled and the exception of the first failed stage is raised.
+    """
+
+    def __init__(self, on_complete: Callable[[str, object], None] | None = None):
+        self.stages = {}
+        self.results = {}
+        # Names of the successfully completed stages, in completion order
+        self.completed = []
+        # Called with the name and the result of each stage that completes successfully
+        self.on_complete = on_complete
+        self.restored = {}
+
+    def add(self, name: str, fn: Callable[[], Awaitable], requires: list[str] = ()):
+        """
+        Adds a stage. `fn` is a coroutine function that will be called without arguments, its result will be
+        available in `results[name]` for the stages that require this one.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name!r} already exists")
+
+        self.stages[name] = Stage(name, fn, list(requires))
+
+    def restore(self, name: str, result=None):
+        """
+        Marks stage `name` as already completed with `result` (i.e. by a previous run that failed later), so that
+        `run` does not run it again.
+        """
+        if name not in self.stages:
+            raise ValueError(f"Unknown stage {name!r}")
+
+        self.restored[name] = result
+
+    async def run(self):
+        self._check()
+
+        tasks = {}
+        errors = []
+
+        async def run_stage(stage):
+            if stage.name in self.restored:
+                self.results[stage.name] = self.restored[stage.name]
+                self.completed.append(stage.name)
+                return
+
+            if stage.requires:
+                await asyncio.gather(*[tasks[name] for name in stage.requires])
+
+            try:
+                with span(stage.name, "stage"):
+                    self.results[stage.name] = await stage.fn()
+            except Exception as e:
+                errors.append(e)
+                raise
+
+            self.completed.append(stage.name)
+            if self.on_complete is not None:
+                self.on_complete(stage.name, self.results[stage.name])
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage), name=stage.name)
+
+        if not tasks:
+            return
+
+        try:
+            await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+            # Wait for the cancelled stages to actually finish so that none of them outlives the graph
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        if errors:
+            raise errors[0]
+
+    def _check(self):
+        for stage in self.stages.values():
+            for name in stage.requires:
+                if name not in self.stages:
+                    raise ValueError(f"Stage {stage.name!r} requires unknown stage {name!r}")
+
+        visited = set()
+        path = []
+
+        def visit(name):
+            if name in path:
+                raise ValueError(f"Stage dependency cycle: {' -> '.join(path[path.index(name):] + [name])}")
+
+            if name in visited:
+                return
+
+            path.append(name)
+            for required in self.stages[name].requires:
+                visit(required)
+            path.pop()
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import threading
+
+from .executor import host_path
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["IMAGE_PATH", "ImageStager", "image_stager"]
+
+IMAGE_PATH = "/cdrom/TrueNAS.update"
+STAGING_PATH = "/dev/shm/TrueNAS.update"
+# Memory that must remain available for the installer itself after the image is staged
+MEMORY_RESERVE = 2 * 1024 ** 3
+CHUNK_SIZE = 8 * 1024 ** 2
+
+
+class ImageStager:
+    """
+    Stages the update image while the user is still choosing disks, so that `truenas_install` does not have to read
+    it from slow install media (USB2 sticks, BMC virtual media).
+
+    If there is enough memory, the image is copied to tmpfs (`STAGING_PATH`). Otherwise, if the image at least fits
+    into available memory, it is read once so that it ends up in the page cache.
+    """
+
+    def __init__(self, source=IMAGE_PATH, destination=STAGING_PATH):
+        self.source = source
+        self.destination = destination
+        # One of: idle, starting, copying, reading, staged, cached, skipped, failed
+        self.state = "idle"
+        self.staged_bytes = 0
+        self.total_bytes = 0
+        self.error = None
+        self.task = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.task is None:
+            self.state = "starting"
+            self.task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._stage))
+
+    async def stop(self):
+        if self.task is not None:
+            self.stop_event.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "staged_bytes": self.staged_bytes,
+            "total_bytes": self.total_bytes,
+            "error": self.error,
+        }
+
+    async def image_path(self) -> str:
+        """
+        Returns the path the update image should be mounted from. If the image is being copied to memory, waits for
+        the copy to finish, as reading the install media concurrently would only slow both readers down.
+        """
+        while self.state == "starting" and not self.task.done():
+            await asyncio.sleep(0.1)
+
+        if self.state == "copying":
+            await asyncio.gather(asyncio.shield(self.task), return_exceptions=True)
+
+        if self.state == "staged":
+            return host_path(self.destination)
+
+        return host_path(self.source)
+
+    def _stage(self):
+        try:
+            self.total_bytes = os.path.getsize(host_path(self.source))
+            available = _memory_available()
+            try:
+                tmpfs_free = os.statvfs(os.path.dirname(host_path(self.destination)))
+                tmpfs_free = tmpfs_free.f_bavail * tmpfs_free.f_frsize
+            except OSError:
+                tmpfs_free = 0
+
+            if available >= self.total_bytes + MEMORY_RESERVE and tmpfs_free >= self.total_bytes:
+                self.state = "copying"
+                self._copy()
+                self.state = "staged"
+            elif available >= self.total_bytes:
+                self.state = "reading"
+                self._read()
+                self.state = "cached"
+            else:
+                self.state = "skipped"
+        except Exception as e:
+            logger.warning("Unable to stage %r", self.source, exc_info=True)
+            self.state = "failed"
+            self.error = str(e)
+            try:
+                os.unlink(host_path(self.destination))
+            except OSError:
+                pass
+
+    def _copy(self):
+        with open(host_path(self.source), "rb") as src, open(host_path(self.destination), "wb") as dst:
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while chunk := src.read(CHUNK_SIZE):
+                if self.stop_event.is_set():
+                    raise RuntimeError("Staging was cancelled")
+
+                dst.write(chunk)
+                # The image is in tmpfs now, there is no need to also keep it in the page cache
+                os.posix_fadvise(src.fileno(), self.staged_bytes, len(chunk), os.POSIX_FADV_DONTNEED)
+                self.staged_bytes += len(chunk)
+
+    def _read(self):
+        with open(host_path(self.source), "rb") as src:
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while chunk := src.read(CHUNK_SIZE):
+                if self.stop_event.is_set():
+                    raise RuntimeError("Staging was cancelled")
+
+                self.staged_bytes += len(chunk)
+
+
+def _memory_available():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+
+image_stager = ImageStager()
@@ -0,0 +1,145 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from .executor import host_path
+
+__all__ = ["InstallTrace", "TRACE_PATH", "get_last_trace", "instant", "span", "tracing"]
+
+TRACE_PATH = "/tmp/truenas_installer_trace.json"
+
+_current = contextvars.ContextVar("install_trace", default=None)
+_last = None
+
+
+class InstallTrace:
+    """
+    Collects timed spans and instant events of an installation and exports them in Chrome trace-event format
+    (can be loaded in `chrome://tracing` or https://ui.perfetto.dev).
+
+    Each asyncio task (or thread) gets its own lane so that concurrent operations do not overlap visually.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.events = []
+        self.lanes = {}
+        self.pid = os.getpid()
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str, **args):
+        """
+        Records a span covering the body of the `with` statement. Yields `args` dict so that the caller can add
+        results (i.e. exit code) to it.
+        """
+        tid = self._tid()
+        start = time.monotonic()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self._ts(start),
+                "dur": self._ts(time.monotonic()) - self._ts(start),
+                "pid": self.pid,
+                "tid": tid,
+                "args": args,
+            })
+
+    def instant(self, name: str, cat: str, **args):
+        self.events.append({
+            "name": name,
+            "cat": cat,
+            "ph": "i",
+            "s": "t",
+            "ts": self._ts(time.monotonic()),
+            "pid": self.pid,
+            "tid": self._tid(),
+            "args": args,
+        })
+
+    def to_chrome(self) -> dict:
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.lanes.values()
+        ]
+        return {
+            "traceEvents": metadata + sorted(self.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+        }
+
+    def write(self, path: str | None = None):
+        """
+        Writes the trace in Chrome trace-event format to `path` (`TRACE_PATH` in the current executor's root by
+        default).
+        """
+        if path is None:
+            path = host_path(TRACE_PATH)
+
+        with open(path, "w") as f:
+            json.dump(self.to_chrome(), f)
+
+    def _tid(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        if task is not None:
+            key, name = id(task), task.get_name()
+        else:
+            key, name = threading.get_ident(), threading.current_thread().name
+
+        if key not in self.lanes:
+            self.lanes[key] = (len(self.lanes) + 1, name)
+
+        return self.lanes[key][0]
+
+    def _ts(self, t):
+        return round((t - self.start) * 1_000_000)
+
+
+@contextlib.contextmanager
+def tracing(trace: InstallTrace):
+    """
+    Makes `trace` the current trace for the body of the `with` statement (including the asyncio tasks and threads
+    started from it). When the body finishes, `trace` becomes available via `get_last_trace`.
+    """
+    global _last
+
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        _last = trace
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str, **args):
+    """
+    Records a span in the current trace. Does nothing (except yielding `args`) if there is no current trace.
+    """
+    if (trace := _current.get()) is None:
+        yield args
+    else:
+        with trace.span(name, cat, **args) as args:
+            yield args
+
+
+def instant(name: str, cat: str, **args):
+    if (trace := _current.get()) is not None:
+        trace.instant(name, cat, **args)
+
+
+def get_last_trace() -> InstallTrace | None:
+    return _last
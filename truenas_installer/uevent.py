@@ -0,0 +1,143 @@
+import asyncio
+from dataclasses import dataclass
+import errno
+import socket
+import struct
+
+__all__ = ["KERNEL_GROUP", "UDEV_GROUP", "Uevent", "UeventListener", "parse_kernel_uevent", "parse_udev_uevent"]
+
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group the kernel broadcasts raw uevents to
+KERNEL_GROUP = 1
+# Multicast group udev re-broadcasts uevents to once it has processed them (created device nodes, probed filesystems)
+UDEV_GROUP = 2
+# libudev `monitor_netlink_header`: prefix, magic (big endian), header size, properties offset and length, filter
+# hashes (native endian)
+UDEV_HEADER = struct.Struct("=8sIIIIIIII")
+UDEV_MAGIC = 0xfeedcafe
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+@dataclass
+class Uevent:
+    action: str
+    devpath: str
+    properties: dict
+
+    @property
+    def subsystem(self):
+        return self.properties.get("SUBSYSTEM")
+
+    @property
+    def devname(self):
+        return self.properties.get("DEVNAME")
+
+
+def parse_kernel_uevent(data: bytes) -> Uevent | None:
+    """
+    Parses a kernel uevent netlink message, which looks like `action@devpath\0KEY=VALUE\0KEY=VALUE\0...`.
+    Returns `None` for messages that are not kernel uevents (i.e. the ones sent by udev).
+    """
+    header, *fields = data.decode("utf-8", "ignore").split("\0")
+    if "@" not in header or header.startswith("libudev"):
+        return None
+
+    action, devpath = header.split("@", 1)
+    properties = {}
+    for field in fields:
+        if "=" in field:
+            key, value = field.split("=", 1)
+            properties[key] = value
+
+    return Uevent(action, devpath, properties)
+
+
+def parse_udev_uevent(data: bytes) -> Uevent | None:
+    """
+    Parses a uevent netlink message sent by udev, which is a binary `libudev` header followed by
+    `KEY=VALUE\0KEY=VALUE\0...` properties. Returns `None` for messages that are not udev uevents.
+    """
+    if len(data) < UDEV_HEADER.size:
+        return None
+
+    prefix, magic, header_size, properties_offset, properties_length, *_ = UDEV_HEADER.unpack_from(data)
+    if prefix != b"libudev\0" or socket.ntohl(magic) != UDEV_MAGIC:
+        return None
+
+    properties = {}
+    for field in data[properties_offset:properties_offset + properties_length].decode("utf-8", "ignore").split("\0"):
+        if "=" in field:
+            key, value = field.split("=", 1)
+            properties[key] = value
+
+    if "ACTION" not in properties or "DEVPATH" not in properties:
+        return None
+
+    return Uevent(properties["ACTION"], properties["DEVPATH"], properties)
+
+
+class UeventListener:
+    """
+    Listens for kernel uevents (or, if `group` is `UDEV_GROUP`, the uevents udev has processed) on a netlink socket.
+    The socket starts buffering events as soon as the listener is entered, so events triggered after that moment are
+    never missed, even if `receive` is called later.
+    """
+
+    def __init__(self, group=KERNEL_GROUP):
+        self.group = group
+        self.parse = parse_kernel_uevent if group == KERNEL_GROUP else parse_udev_uevent
+        self.socket = None
+
+    def __enter__(self):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK, NETLINK_KOBJECT_UEVENT)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            self.socket.bind((0, self.group))
+        except Exception:
+            self.socket.close()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.socket.close()
+        self.socket = None
+
+    async def receive(self, timeout: float) -> list[Uevent] | None:
+        """
+        Waits up to `timeout` seconds for at least one uevent and returns all the events that are currently queued.
+        Returns an empty list on timeout and `None` if the kernel had to drop events because the socket receive
+        buffer overflowed (the caller should then assume that anything could have changed).
+        """
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.socket.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            loop.remove_reader(self.socket.fileno())
+
+        return self.receive_queued()
+
+    def receive_queued(self) -> list[Uevent] | None:
+        """
+        Returns the uevents that are currently queued without waiting. Returns `None` if events were dropped.
+        """
+        events = []
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    return None
+
+                raise
+
+            if (event := self.parse(data)) is not None:
+                events.append(event)
+
+        return events
@@ -0,0 +1,264 @@
+import asyncio
+import copy
+import json
+import logging
+import re
+import sys
+
+from jsonschema import ValidationError, validate
+
+from .disks import Disk, list_disks
+from .exception import InstallError
+from .install import conflicting_boot_pool_disks, install, upgrade
+from .install_schema import INSTALL_SCHEMA
+from .network_interfaces import get_available_ip_addresses, get_interface_ips
+from .staging import image_stager
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["load_answer_file", "resolve_answers", "run_unattended", "select_disks"]
+
+DISK_SELECTOR_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        # Regular expressions that are searched in the disk name/model
+        "name": {"type": "string"},
+        "model": {"type": "string"},
+        "min_size": {"type": "integer"},
+        "max_size": {"type": "integer"},
+        "removable": {"type": "boolean"},
+        "order": {
+            "type": "string",
+            "enum": ["name", "smallest", "largest"],
+        },
+        "count": {
+            "type": "integer",
+            "minimum": 1,
+        },
+    },
+}
+
+TNC_SCHEMA = {
+    "type": "object",
+    "required": ["enabled"],
+    "additionalProperties": False,
+    "properties": {
+        "enabled": {"type": "boolean"},
+        "ips": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "interfaces": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "use_all_interfaces": {"type": "boolean"},
+        "account_service_base_url": {"type": "string"},
+        "leca_service_base_url": {"type": "string"},
+        "heartbeat_service_base_url": {"type": "string"},
+        "tnc_base_url": {"type": "string"},
+    },
+}
+
+# Any other property is passed to `install` as is and is validated with the `install` method schema
+ANSWER_FILE_SCHEMA = {
+    "type": "object",
+    "required": ["disks"],
+    "properties": {
+        "disks": {
+            "oneOf": [
+                INSTALL_SCHEMA["properties"]["disks"],
+                DISK_SELECTOR_SCHEMA,
+            ],
+        },
+        "wipe_disks": {
+            "oneOf": [
+                INSTALL_SCHEMA["properties"]["wipe_disks"],
+                # All the disks with a boot pool that were not selected for installation
+                {"type": "string", "enum": ["boot_pools"]},
+            ],
+        },
+        "tnc": TNC_SCHEMA,
+        "when_done": {
+            "type": "string",
+            "enum": ["poweroff", "reboot", "none"],
+        },
+    },
+}
+
+
+def load_answer_file(path: str) -> dict:
+    """
+    Loads a JSON or (if `path` ends with `.yaml` or `.yml`) YAML answer file.
+    """
+    try:
+        with open(path) as f:
+            text = f.read()
+    except OSError as e:
+        raise InstallError(f"Unable to read answer file: {e}")
+
+    if path.endswith((".yaml", ".yml")):
+        # PyYAML is only required for YAML answer files
+        import yaml
+
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise InstallError(f"Invalid answer file: {e}")
+
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise InstallError(f"Invalid answer file: {e}")
+
+
+def select_disks(disks: list[Disk], selector: dict) -> list[Disk]:
+    """
+    Selects `count` (1 by default) disks matching `selector` (i.e. the two smallest NVMe disks are
+    `{"name": "^nvme", "order": "smallest", "count": 2}`).
+    """
+    candidates = [
+        disk for disk in disks
+        if (
+            re.search(selector.get("name", ""), disk.name) and
+            re.search(selector.get("model", ""), disk.model) and
+            disk.size >= selector.get("min_size", 0) and
+            disk.size <= selector.get("max_size", disk.size) and
+            disk.removable == selector.get("removable", disk.removable)
+        )
+    ]
+
+    if (order := selector.get("order", "name")) == "smallest":
+        candidates.sort(key=lambda disk: (disk.size, disk.name))
+    elif order == "largest":
+        candidates.sort(key=lambda disk: (-disk.size, disk.name))
+
+    count = selector.get("count", 1)
+    if len(candidates) < count:
+        raise InstallError(f"Disk selector {json.dumps(selector)} matches {len(candidates)} disk(s), {count} required")
+
+    return candidates[:count]
+
+
+def resolve_answers(answers: dict, disks: list[Disk]) -> dict:
+    """
+    Validates `answers` and resolves their disk selectors. Returns the `install` method parameters.
+    """
+    try:
+        validate(answers, ANSWER_FILE_SCHEMA)
+    except ValidationError as e:
+        raise InstallError(f"Invalid answer file: {e.message}")
+
+    params = {k: v for k, v in answers.items() if k not in ("tnc", "when_done")}
+    disks_dict = {disk.name: disk for disk in disks}
+
+    if isinstance(params["disks"], dict):
+        params["disks"] = [disk.name for disk in select_disks(disks, params["disks"])]
+    elif missing := [name for name in params["disks"] if name not in disks_dict]:
+        raise InstallError(f"Disk {missing[0]!r} does not exist")
+
+    if params.get("wipe_disks") == "boot_pools":
+        params["wipe_disks"] = [disk.name for disk in conflicting_boot_pool_disks(disks, params["disks"])]
+    elif missing := [name for name in params.get("wipe_disks", []) if name not in disks_dict]:
+        raise InstallError(f"Disk {missing[0]!r} does not exist")
+
+    try:
+        validate(params, INSTALL_SCHEMA)
+    except ValidationError as e:
+        raise InstallError(f"Invalid answer file: {e.message}")
+
+    if params.get("upgrade") and (params.get("wipe_disks") or params.get("resume")):
+        raise InstallError("`wipe_disks` and `resume` can't be used with `upgrade`")
+
+    return params
+
+
+async def tnc_config(tnc: dict | None) -> dict:
+    # The server is not running in unattended mode, only its TrueNAS Connect configuration cache is used
+    from .server.api.truenas_connect.cache import get_tnc_config
+
+    config = get_tnc_config()
+    if tnc is None:
+        return config
+
+    config |= tnc
+    if tnc["enabled"]:
+        if "use_all_interfaces" not in tnc:
+            config["use_all_interfaces"] = not tnc.get("interfaces")
+
+        if tnc.get("interfaces"):
+            try:
+                ips = await get_interface_ips(tnc["interfaces"])
+            except ValueError as e:
+                raise InstallError(str(e))
+        elif config["use_all_interfaces"]:
+            ips = await get_available_ip_addresses()
+        else:
+            ips = {"ipv4": [], "ipv6": []}
+
+        config["interfaces_ips"] = ips["ipv4"] + ips["ipv6"]
+        if not config.get("ips") and not config["interfaces_ips"]:
+            raise InstallError("No IP addresses available for TrueNAS Connect")
+
+    return config
+
+
+async def run_unattended(installer, path: str) -> int:
+    """
+    Installs the system as described by the answer file at `path` without any prompts, then powers off or reboots
+    the system (`when_done`, `poweroff` by default). Returns the exit code.
+    """
+    image_stager.start()
+    try:
+        answers = load_answer_file(path)
+        disks = await list_disks()
+        params = resolve_answers(answers, disks)
+        disks_dict = {disk.name: disk for disk in disks}
+
+        post_install = copy.deepcopy(params.get("post_install") or {})
+        post_install["tnc_config"] = await tnc_config(answers.get("tnc"))
+
+        destination_disks = [disks_dict[name] for name in params["disks"]]
+        if params.get("upgrade"):
+            await upgrade(destination_disks, installer.version, post_install, None, _callback)
+        else:
+            await install(
+                destination_disks,
+                [disks_dict[name] for name in params.get("wipe_disks", [])],
+                params["set_pmbr"],
+                params["authentication"],
+                post_install,
+                None,
+                _callback,
+                params.get("wipe_mode", "signatures"),
+                params.get("resume", False),
+                params.get("payload", "image"),
+                params.get("preflight", "read"),
+            )
+    except InstallError as e:
+        sys.stderr.write(f"Installation failed: {e.message}\n")
+        return 1
+    except Exception as e:
+        logger.debug("Unhandled exception", exc_info=True)
+        sys.stderr.write(f"Installation failed: {e!r}\n")
+        return 1
+    finally:
+        await image_stager.stop()
+
+    sys.stdout.write(f"Installation on {', '.join(params['disks'])} succeeded\n")
+    sys.stdout.flush()
+
+    if (when_done := answers.get("when_done", "poweroff")) == "poweroff":
+        process = await asyncio.create_subprocess_exec("shutdown", "now")
+        await process.communicate()
+    elif when_done == "reboot":
+        process = await asyncio.create_subprocess_exec("reboot")
+        await process.communicate()
+
+    return 0
+
+
+def _callback(progress, message):
+    sys.stdout.write(f"[{int(progress * 100)}%] {message}\n")
+    sys.stdout.flush()
@@ -1,8 +1,14 @@
 import asyncio
+import contextlib
+import errno
 import os
 import subprocess
 
-__all__ = ["GiB", "get_partitions", "run"]
+from .executor import get_executor, host_path
+from .trace import span
+from .uevent import UeventListener
+
+__all__ = ["GiB", "get_partitions", "open_direct", "run"]
 
 GiB = 1024 ** 3
 MAX_PARTITION_WAIT_TIME_SECS = 300
@@ -17,48 +23,60 @@ async def get_partitions(
     `device`: str (i.e. /dev/sda, /dev/nvme0n1)
     `partitions`: list of integers (i.e. [1, 2, 3])
     `tries`: None or int, defaults to None, if provided, will
-        sleep up to that time waiting on all `partitions` for `device`
+        wait up to that many seconds for all `partitions` for `device`
         to appear in sysfs. Maximum of `MAX_PARTITION_WAIT_TIME_SECS`.
+
+    sysfs is re-scanned every time the kernel reports a uevent for `device`,
+    so this returns as soon as the partitions appear. If the uevent socket
+    can't be opened, sysfs is polled once per second instead.
     """
     if not isinstance(tries, int) or tries < 2:
         tries = 1
     else:
         tries = min(tries, MAX_PARTITION_WAIT_TIME_SECS)
 
+    with contextlib.ExitStack() as stack:
+        try:
+            listener = stack.enter_context(UeventListener())
+        except OSError:
+            listener = None
+
+        with span("get_partitions", "wait", device=device, partitions=partitions, tries=tries) as args:
+            args["found"] = await _get_partitions(device, partitions, tries, listener)
+            return args["found"]
+
+
+async def _get_partitions(device, partitions, tries, listener):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + tries
+
     # by the time this function is called, partitions should have been
     # written to the disk. However, it doesn't mean the kernel/udev has
     # updated the various symlinks in sysfs. We'll open the block device
     # in write mode. This should send a kernel and udev change event for
     # the device and any partitions as well. Ideally, this will help bubble
     # up the events so sysfs is populated before the logic below kicks in
-    with open(device, 'w'):
-        pass
+    os.close(os.open(device, os.O_WRONLY))
 
     disk_partitions = {i: None for i in partitions}
-    device = device.removeprefix('/dev/')
-    for _try in range(tries):
+    device = device.removeprefix(host_path('/dev/'))
+    while True:
+        _scan_sysfs_partitions(device, disk_partitions)
         if all((disk_partitions[i] is not None for i in disk_partitions)):
             # all partitions were found on disk
             return disk_partitions
 
-        try:
-            with os.scandir(f"/sys/block/{device}") as dir_contents:
-                for partdir in filter(lambda x: x.is_dir() and x.name.startswith(device), dir_contents):
-                    with open(os.path.join(partdir.path, 'partition')) as f:
-                        try:
-                            _part = int(f.read().strip())
-                            if _part in partitions:
-                                # looks like {1: '/dev/sda1', 2: '/dev/nvme0n1p2'}
-                                disk_partitions[_part] = f'/dev/{partdir.name}'
-                        except (OSError, ValueError):
-                            # OSError: [Errno 19] No such device was seen on
-                            # our internal CI/CD infrastructure for reasons
-                            # not understood...
-                            continue
-        except FileNotFoundError:
+        if (timeout := deadline - loop.time()) <= 0:
+            break
+
+        if listener is None:
+            await asyncio.sleep(min(timeout, 1))
             continue
 
-        await asyncio.sleep(1)
+        while (timeout := deadline - loop.time()) > 0:
+            events = await listener.receive(timeout)
+            if events is None or any(_is_device_uevent(event, device) for event in events):
+                break
 
     empty_parts = {k: v for k, v in disk_partitions.items() if v is None}
     if empty_parts:
@@ -67,25 +85,68 @@ async def get_partitions(
         # to it. We're seeing our CI/CD randomly "fail" because sysfs hasn't
         # been populated after partition creation. As a last resort, we'll just
         # haphazardly check to see if the disk partitions block device exists
-        with os.scandir('/dev/') as dir_contents:
-            for dev in filter(lambda x: x.name.startswith(device), dir_contents):
-                for partnum in empty_parts:
-                    part_str = str(partnum)
-                    if dev.name[-len(part_str):] == part_str:
-                        disk_partitions[partnum] = f'/dev/{dev.name}'
+        for partnum in empty_parts:
+            # The kernel separates the partition number with `p` if the disk name ends with a digit (i.e. nvme0n1p1)
+            if os.path.exists(path := host_path(f'/dev/{device}{"p" if device[-1:].isdigit() else ""}{partnum}')):
+                disk_partitions[partnum] = path
 
     return disk_partitions
 
 
+def _is_device_uevent(event, device):
+    # The event is for the disk itself or one of its partitions (`/devices/.../block/sda/sda1`), not for another disk
+    # whose name starts with the same letters (`sdaa`)
+    return event.subsystem == 'block' and device in (
+        os.path.basename(event.devpath), os.path.basename(os.path.dirname(event.devpath))
+    )
+
+
+def _scan_sysfs_partitions(device, disk_partitions):
+    try:
+        with os.scandir(host_path(f"/sys/block/{device}")) as dir_contents:
+            for partdir in filter(lambda x: x.is_dir() and x.name.startswith(device), dir_contents):
+                try:
+                    with open(os.path.join(partdir.path, 'partition')) as f:
+                        _part = int(f.read().strip())
+                except (OSError, ValueError):
+                    # OSError: [Errno 19] No such device was seen on
+                    # our internal CI/CD infrastructure for reasons
+                    # not understood...
+                    continue
+
+                if _part in disk_partitions:
+                    # looks like {1: '/dev/sda1', 2: '/dev/nvme0n1p2'}
+                    disk_partitions[_part] = host_path(f'/dev/{partdir.name}')
+    except FileNotFoundError:
+        pass
+
+
 async def run(args, check=True):
-    process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = await process.communicate()
+    with span(os.path.basename(args[0]), "command", argv=args) as trace_args:
+        returncode, stdout, stderr = await get_executor().run(args)
+
+        trace_args.update(returncode=returncode, stdout_bytes=len(stdout), stderr_bytes=len(stderr))
 
     stdout = stdout.decode("utf-8", "ignore")
     stderr = stderr.decode("utf-8", "ignore")
 
     if check:
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args, stdout, stderr)
+
+    return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+
+def open_direct(device: str, flags: int = os.O_RDONLY) -> tuple[int, bool]:
+    """
+    Opens `device` with `O_DIRECT`, so that reads and writes bypass the page cache. Some devices (and plain files,
+    when simulating) do not support it, they are opened normally. Returns the file descriptor and whether `O_DIRECT`
+    is in effect.
+    """
+    try:
+        return os.open(device, flags | os.O_DIRECT), True
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
 
-    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    return os.open(device, flags), False
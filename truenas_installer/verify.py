@@ -0,0 +1,103 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import threading
+from typing import Callable
+
+__all__ = ["MANIFEST_SUFFIX", "ImageVerificationError", "generate_manifest", "load_manifest", "verify_image"]
+
+# The manifest is shipped next to the image, i.e. `/cdrom/TrueNAS.update.manifest.json`
+MANIFEST_SUFFIX = ".manifest.json"
+DEFAULT_CHUNK_SIZE = 64 * 1024 ** 2
+
+
+class ImageVerificationError(Exception):
+    pass
+
+
+def generate_manifest(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, algorithm: str = "sha256") -> dict:
+    """
+    Generates a manifest (per-chunk hashes) for the image at `path`. This is meant to be run when the image is built.
+    """
+    return {
+        "algorithm": algorithm,
+        "size": os.path.getsize(path),
+        "chunk_size": chunk_size,
+        "chunks": _hash_chunks(path, algorithm, chunk_size),
+    }
+
+
+def load_manifest(image_path: str) -> dict | None:
+    try:
+        with open(image_path + MANIFEST_SUFFIX) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def verify_image(path: str, manifest: dict, progress: Callable | None = None, stop: threading.Event | None = None):
+    """
+    Hashes the image at `path` in parallel chunks and compares the hashes with `manifest`. Raises
+    `ImageVerificationError` if they don't match.
+
+    `progress` is called with a number between 0 and 1 after each chunk. Verification is aborted as soon as `stop`
+    is set.
+    """
+    if (size := os.path.getsize(path)) != manifest["size"]:
+        raise ImageVerificationError(f"Image size is {size} bytes, expected {manifest['size']} bytes")
+
+    hashes = _hash_chunks(path, manifest["algorithm"], manifest["chunk_size"], progress, stop)
+    if bad := [i for i, (actual, expected) in enumerate(zip(hashes, manifest["chunks"])) if actual != expected]:
+        offsets = ", ".join(str(i * manifest["chunk_size"]) for i in bad[:5])
+        raise ImageVerificationError(f"{len(bad)} corrupt chunk(s) found at offset(s) {offsets}")
+
+    if len(hashes) != len(manifest["chunks"]):
+        raise ImageVerificationError("Manifest chunk count does not match image size")
+
+
+def _hash_chunks(path, algorithm, chunk_size, progress=None, stop=None):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        def hash_chunk(offset):
+            if stop is not None and stop.is_set():
+                raise ImageVerificationError("Verification was cancelled")
+
+            # hashlib releases the GIL while hashing large buffers, so chunks are hashed on all CPUs at once
+            with view[offset:offset + chunk_size] as chunk:
+                return hashlib.new(algorithm, chunk).hexdigest()
+
+        offsets = range(0, size, chunk_size)
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            futures = [executor.submit(hash_chunk, offset) for offset in offsets]
+            try:
+                for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                    future.result()
+                    if progress is not None:
+                        progress(done / len(futures))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+
+                raise
+
+            return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the integrity manifest for an update image")
+    parser.add_argument("image")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with open(args.image + MANIFEST_SUFFIX, "w") as f:
+        json.dump(generate_manifest(args.image, args.chunk_size), f)
+
+
+if __name__ == "__main__":
+    main()
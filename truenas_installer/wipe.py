@@ -0,0 +1,260 @@
+from dataclasses import dataclass, field
+import errno
+import fcntl
+import mmap
+import os
+import stat
+import struct
+from typing import Callable
+
+from .executor import host_path
+from .gpt import MBR_ENTRY, device_geometry, read_partition_table
+from .utils import open_direct
+
+__all__ = ["WIPE_MODES", "WipeReport", "WipedRegion", "discard_device", "discard_supported", "signature_regions",
+           "wipe_signatures"]
+
+KiB = 1024
+MiB = 1024 ** 2
+GiB = 1024 ** 3
+
+# Regions are zeroed in aligned blocks of this size
+WIPE_ALIGNMENT = MiB
+ZFS_LABEL_SIZE = 256 * KiB
+GPT_ENTRIES_SIZE = 128 * 128
+
+BLKDISCARD = 0x1277
+BLKSECDISCARD = 0x127D
+BLKZEROOUT = 0x127F
+# Whole-device discards are issued in chunks of this size so that progress can be reported
+DISCARD_CHUNK_SIZE = 4 * GiB
+
+# `signatures` only erases on-disk signatures, `discard` and `secure_discard` additionally discard every block of the
+# devices that support that first (the other devices only have their signatures erased)
+WIPE_MODES = ["signatures", "discard", "secure_discard"]
+
+
+@dataclass
+class WipedRegion:
+    offset: int
+    length: int
+    signatures: list[str] = field(default_factory=list)
+
+
+@dataclass
+class WipeReport:
+    device: str
+    regions: list[WipedRegion]
+
+    @property
+    def bytes_wiped(self):
+        return sum(region.length for region in self.regions)
+
+
+def signature_regions(size: int, sector_size: int, partitions: list[tuple[int, int]]) -> list[WipedRegion]:
+    """
+    Returns the (not yet aligned or merged) regions of a device of `size` bytes where on-disk signatures might live.
+    `partitions` is a list of `(offset, size)` tuples (in bytes) of the partitions that exist (or used to exist)
+    on the device.
+    """
+    regions = [
+        WipedRegion(0, sector_size, ["MBR"]),
+        WipedRegion(sector_size, sector_size + GPT_ENTRIES_SIZE, ["GPT primary header and entries"]),
+        WipedRegion(size - sector_size - GPT_ENTRIES_SIZE, sector_size + GPT_ENTRIES_SIZE,
+                    ["GPT backup header and entries"]),
+    ]
+
+    for prefix, start, length in [("disk", 0, size)] + [
+        (f"partition {i}", start, length) for i, (start, length) in enumerate(partitions, start=1)
+    ]:
+        for offset, region_length, signature in _range_signatures(length):
+            if 0 <= offset and offset + region_length <= length:
+                regions.append(WipedRegion(start + offset, region_length, [f"{prefix}: {signature}"]))
+
+    return regions
+
+
+def _range_signatures(length):
+    # ZFS vdev labels live in the first and the last 512 KiB of the 256 KiB aligned vdev size
+    aligned = length // ZFS_LABEL_SIZE * ZFS_LABEL_SIZE
+    yield 0, ZFS_LABEL_SIZE, "ZFS label L0"
+    yield ZFS_LABEL_SIZE, ZFS_LABEL_SIZE, "ZFS label L1"
+    yield aligned - 2 * ZFS_LABEL_SIZE, ZFS_LABEL_SIZE, "ZFS label L2"
+    yield aligned - ZFS_LABEL_SIZE, ZFS_LABEL_SIZE, "ZFS label L3"
+
+    yield 0, 4 * KiB, "FAT/NTFS/XFS/LUKS/swap/LVM2/mdraid 1.1 superblock"
+    yield 4 * KiB, 4 * KiB, "mdraid 1.2/bcache superblock"
+    yield 1 * KiB, 1 * KiB, "ext2/3/4 superblock"
+    yield 16 * KiB, 4 * KiB, "LUKS2 secondary header"
+    yield 32 * KiB, 4 * KiB, "ISO9660 volume descriptor"
+    yield 60 * KiB, 4 * KiB, "swap signature"
+    for mirror in [64 * KiB, 64 * MiB, 256 * GiB]:
+        yield mirror, 4 * KiB, "btrfs superblock"
+
+    # md 1.0 superblock is stored 8-12 KiB from the end of the device, 4 KiB aligned
+    yield (length - 8 * KiB) // (4 * KiB) * (4 * KiB), 4 * KiB, "mdraid 0.90/1.0 superblock"
+    yield length - 512, 512, "NTFS backup boot sector"
+
+
+def _merge(regions, size):
+    aligned = []
+    for region in regions:
+        start = region.offset // WIPE_ALIGNMENT * WIPE_ALIGNMENT
+        end = min(-(-(region.offset + region.length) // WIPE_ALIGNMENT) * WIPE_ALIGNMENT, size)
+        aligned.append(WipedRegion(start, end - start, list(region.signatures)))
+
+    merged = []
+    for region in sorted(aligned, key=lambda region: region.offset):
+        if merged and region.offset <= merged[-1].offset + merged[-1].length:
+            last = merged[-1]
+            last.length = max(last.offset + last.length, region.offset + region.length) - last.offset
+            last.signatures.extend(region.signatures)
+        else:
+            merged.append(region)
+
+    return merged
+
+
+def _partitions(device, fd, sector_size):
+    partitions = set()
+
+    if (table := read_partition_table(device)) is not None:
+        for partition in table.partitions:
+            partitions.add((partition.first_lba * table.sector_size, partition.sectors * table.sector_size))
+    else:
+        mbr = os.pread(fd, 512, 0)
+        if mbr[510:512] == b"\x55\xaa":
+            for i in range(4):
+                _, _, type_, _, first_lba, sectors = MBR_ENTRY.unpack_from(mbr, 446 + i * MBR_ENTRY.size)
+                if type_ not in (0x00, 0xEE) and sectors:
+                    partitions.add((first_lba * sector_size, sectors * sector_size))
+
+    # The kernel might still know about partitions that are no longer present in the on-disk partition table.
+    # sysfs always reports these in 512-byte units.
+    if stat.S_ISBLK(os.fstat(fd).st_mode):
+        name = os.path.basename(os.path.realpath(device))
+        try:
+            with os.scandir(host_path(f"/sys/block/{name}")) as dir_contents:
+                for partdir in filter(lambda x: x.is_dir() and x.name.startswith(name), dir_contents):
+                    try:
+                        with open(os.path.join(partdir.path, "start")) as f:
+                            start = int(f.read().strip())
+                        with open(os.path.join(partdir.path, "size")) as f:
+                            length = int(f.read().strip())
+                    except (OSError, ValueError):
+                        continue
+
+                    partitions.add((start * 512, length * 512))
+        except FileNotFoundError:
+            pass
+
+    return sorted(partitions)
+
+
+def wipe_signatures(device: str) -> WipeReport:
+    """
+    Zeroes every region of `device` (a block device or a plain image file) where ZFS labels, partition tables
+    or common filesystem superblocks might live, both for the whole device and for each of its partitions.
+    Regions are aligned to `WIPE_ALIGNMENT` and written with `O_DIRECT` when the device supports it.
+
+    The caller is responsible for making the kernel re-read the (now empty) partition table afterwards.
+    """
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        sector_size, size = device_geometry(fd)
+        partitions = _partitions(device, fd, sector_size)
+    finally:
+        os.close(fd)
+
+    regions = _merge(signature_regions(size, sector_size, partitions), size)
+
+    fd = open_direct(device, os.O_WRONLY)[0]
+    try:
+        for region in regions:
+            _zero(fd, region.offset, region.length)
+
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return WipeReport(device, regions)
+
+
+def discard_supported(device: str) -> bool:
+    """
+    Returns `True` if the block device `device` advertises discard support in sysfs.
+    """
+    name = os.path.basename(os.path.realpath(device))
+    try:
+        with open(host_path(f"/sys/block/{name}/queue/discard_max_bytes")) as f:
+            return int(f.read().strip()) > 0
+    except (OSError, ValueError):
+        return False
+
+
+def discard_device(device: str, secure: bool = False, progress: Callable | None = None, zero: bool = True) -> str:
+    """
+    Discards every block of `device`. `BLKSECDISCARD` is used if `secure` is set, falling back to `BLKDISCARD`, and
+    then, if `zero` is set, to zeroing the device (using `BLKZEROOUT` for block devices) if discard is not supported.
+    Otherwise `OSError` with `EOPNOTSUPP` is raised if the device does not support discard.
+
+    `progress` is called with a number between 0 and 1 after each `DISCARD_CHUNK_SIZE` chunk.
+    Returns the method that was used: `secure_discard`, `discard` or `zero`.
+    """
+    methods = []
+    fd = os.open(device, os.O_WRONLY)
+    try:
+        _, size = device_geometry(fd)
+        if stat.S_ISBLK(os.fstat(fd).st_mode):
+            if discard_supported(device):
+                if secure:
+                    methods.append(("secure_discard", BLKSECDISCARD))
+                methods.append(("discard", BLKDISCARD))
+            if zero:
+                methods.append(("zero", BLKZEROOUT))
+        elif zero:
+            methods.append(("zero", None))
+
+        if not methods:
+            raise OSError(errno.EOPNOTSUPP, f"{device} does not support discard")
+
+        offset = 0
+        while offset < size:
+            length = min(size - offset, DISCARD_CHUNK_SIZE)
+            while True:
+                method, ioctl = methods[0]
+                try:
+                    if ioctl is None:
+                        _zero(fd, offset, length)
+                    else:
+                        fcntl.ioctl(fd, ioctl, struct.pack("QQ", offset, length))
+                except OSError as e:
+                    if e.errno in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY):
+                        if len(methods) > 1:
+                            methods.pop(0)
+                            continue
+
+                        if method != "zero":
+                            raise OSError(errno.EOPNOTSUPP, f"{device} does not support discard") from e
+
+                    raise
+
+                break
+
+            offset += length
+            if progress is not None:
+                progress(offset / size)
+
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return methods[0][0]
+
+
+def _zero(fd, offset, length):
+    # Anonymous mappings are page-aligned and zero-filled, which is exactly what O_DIRECT needs
+    with mmap.mmap(-1, WIPE_ALIGNMENT) as buffer, memoryview(buffer) as zeroes:
+        end = offset + length
+        while offset < end:
+            offset += os.pwrite(fd, zeroes[:min(end - offset, WIPE_ALIGNMENT)], offset)
@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+import os
+import struct
+
+__all__ = ["ZFSLabel", "label_offsets", "read_zfs_label", "unpack_nvlist"]
+
+# Each vdev has four copies of `vdev_label_t`, two at the beginning and two at the end of the device
+VDEV_LABELS = 4
+LABEL_SIZE = 256 * 1024
+# `vdev_phys_t` (the XDR packed nvlist with the vdev configuration) follows 8K of blank space and 8K boot block header
+VDEV_PHYS_OFFSET = 16 * 1024
+VDEV_PHYS_SIZE = 112 * 1024
+
+NV_ENCODE_XDR = 1
+DATA_TYPE_UINT64 = 8
+DATA_TYPE_STRING = 9
+NVPAIR_HEADER = struct.Struct(">ii")
+
+# `pool_state_t`
+POOL_STATES = ["active", "exported", "destroyed", "spare", "l2cache", "uninitialized", "unavail",
+               "potentially_active"]
+
+
+@dataclass
+class ZFSLabel:
+    pool: str
+    pool_guid: int
+    # GUID of the vdev the label was read from
+    guid: int
+    txg: int
+    hostid: int | None
+    state: str
+
+
+def label_offsets(size: int) -> list[int]:
+    size -= size % LABEL_SIZE
+    return [
+        label * LABEL_SIZE + (0 if label < VDEV_LABELS // 2 else size - VDEV_LABELS * LABEL_SIZE)
+        for label in range(VDEV_LABELS)
+    ]
+
+
+def read_zfs_label(path: str) -> ZFSLabel | None:
+    """
+    Reads the ZFS labels of the device at `path`. Returns the pool configuration from the valid label with the
+    highest txg or `None` if the device is not a ZFS pool member (spares and cache devices do not belong to a pool).
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if (size := os.lseek(fd, 0, os.SEEK_END)) < VDEV_LABELS * LABEL_SIZE:
+            return None
+
+        labels = []
+        for offset in label_offsets(size):
+            try:
+                config = unpack_nvlist(os.pread(fd, VDEV_PHYS_SIZE, offset + VDEV_PHYS_OFFSET))
+            except ValueError:
+                continue
+
+            if isinstance(config.get("name"), str) and isinstance(config.get("pool_guid"), int):
+                labels.append(config)
+    finally:
+        os.close(fd)
+
+    if not labels:
+        return None
+
+    config = max(labels, key=lambda config: config.get("txg", 0))
+    state = config.get("state")
+    return ZFSLabel(
+        config["name"],
+        config["pool_guid"],
+        config.get("guid", 0),
+        config.get("txg", 0),
+        config.get("hostid"),
+        POOL_STATES[state] if isinstance(state, int) and state < len(POOL_STATES) else "unknown",
+    )
+
+
+def unpack_nvlist(data: bytes) -> dict:
+    """
+    Decodes the top-level `uint64` and `string` pairs of an XDR encoded nvlist (other pairs, including nested
+    nvlists such as `vdev_tree`, are skipped). Raises `ValueError` if `data` is not a valid XDR nvlist.
+    """
+    # `nvs_header_t` (encoding, endianness, reserved) followed by `nvl_version` and `nvl_nvflag`
+    if len(data) < 12 or data[0] != NV_ENCODE_XDR:
+        raise ValueError("Not an XDR encoded nvlist")
+
+    pairs = {}
+    offset = 12
+    try:
+        while True:
+            # Each pair starts with its encoded and decoded size, the list ends with two zeros
+            encoded_size, decoded_size = NVPAIR_HEADER.unpack_from(data, offset)
+            if encoded_size == 0:
+                return pairs
+
+            if encoded_size < NVPAIR_HEADER.size or offset + encoded_size > len(data):
+                raise ValueError(f"Invalid nvpair size {encoded_size} at offset {offset}")
+
+            name, position = _unpack_string(data, offset + NVPAIR_HEADER.size)
+            data_type, elements = NVPAIR_HEADER.unpack_from(data, position)
+            position += NVPAIR_HEADER.size
+            if data_type == DATA_TYPE_UINT64 and elements == 1:
+                pairs[name] = struct.unpack_from(">Q", data, position)[0]
+            elif data_type == DATA_TYPE_STRING and elements == 1:
+                pairs[name] = _unpack_string(data, position)[0]
+
+            offset += encoded_size
+    except struct.error as e:
+        raise ValueError(f"Truncated nvlist: {e}") from None
+
+
+def _unpack_string(data, offset):
+    # XDR strings are length-prefixed and padded to 4 bytes
+    length = struct.unpack_from(">I", data, offset)[0]
+    if offset + 4 + length > len(data):
+        raise ValueError(f"Invalid string length {length} at offset {offset}")
+
+    return data[offset + 4:offset + 4 + length].decode("utf-8", "replace"), offset + 4 + (length + 3) // 4 * 4